@@ -1,38 +1,31 @@
 import asyncio
-from typing import Any, Dict, List, Optional, Tuple
+import inspect
+import re
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, TypeVar, Union
 
+import command_queue
 import core
+import gesture_coalescer
+import image_probe
 import logging
+import webdriver_client as wd
 
-try:  # soft import; give clear error if missing
-    from appium.webdriver import Remote  # type: ignore
-    try:
-        from appium.options.ios import XCUITestOptions  # type: ignore
-    except Exception:  # pragma: no cover
-        XCUITestOptions = None  # type: ignore
-    try:
-        from appium.options.common import AppiumOptions  # type: ignore
-    except Exception:  # pragma: no cover
-        AppiumOptions = None  # type: ignore
-    APPIM_AVAILABLE = True
-except Exception as _e:  # pragma: no cover
-    Remote = None  # type: ignore
-    XCUITestOptions = None  # type: ignore
-    AppiumOptions = None  # type: ignore
-    APPIM_AVAILABLE = False
-try:
-    from selenium.common.exceptions import InvalidSessionIdException  # type: ignore
-except Exception:  # pragma: no cover
-    InvalidSessionIdException = None  # type: ignore
-
-
-# In-memory driver registry: (base, sessionId) -> driver
-_DRIVERS: Dict[Tuple[str, str], Any] = {}
+
+# In-memory session registry: (base, sessionId) -> WebDriverSession（纯异步 HTTP，无线程/驱动对象）
+_SESSIONS: Dict[Tuple[str, str], wd.WebDriverSession] = {}
+# 同一会话的命令排队按序执行，会话之间轮转共享全局在途上限
+_SCHEDULER = command_queue.CommandScheduler()
 # 记录每个 base 最近一次用于创建会话的 capabilities，便于自动重建
 _LAST_CAPS: Dict[str, Dict[str, Any]] = {}
 # 会话映射：按 base 维护 udid <-> sessionId 双向关系，便于外部查询
 _UDID_TO_SESSION: Dict[Tuple[str, str], str] = {}
 _SESSION_TO_UDID: Dict[Tuple[str, str], str] = {}
+# 会话几何缓存：窗口尺寸（点）与截图像素尺寸，只在旋转或显式刷新时重新获取
+_GEOMETRY: Dict[Tuple[str, str], "Geometry"] = {}
+_GEOMETRY_LOADS: Dict[Tuple[str, str], "asyncio.Task[Geometry]"] = {}
+# 每台设备创建会话时分配的 mjpegServerPort，供 /stream/{udid} 按设备代理 MJPEG
+_UDID_TO_MJPEG_PORT: Dict[Tuple[str, str], int] = {}
 
 
 def _key(base: str, sid: str) -> Tuple[str, str]:
@@ -51,7 +44,18 @@ def _udid_key(base: str, udid: str) -> Tuple[str, str]:
     return (base.rstrip("/"), udid)
 
 
-def _register_session(base: str, sid: str, udid: Optional[str]) -> None:
+def _caps_mjpeg_port(capabilities: Any) -> Optional[int]:
+    if not isinstance(capabilities, dict):
+        return None
+    raw = capabilities.get("appium:mjpegServerPort") or capabilities.get("mjpegServerPort")
+    try:
+        port = int(raw)
+    except Exception:
+        return None
+    return port if port > 0 else None
+
+
+def _register_session(base: str, sid: str, udid: Optional[str], mjpeg_port: Optional[int] = None) -> None:
     if not udid:
         return
     b = base.rstrip("/")
@@ -62,6 +66,10 @@ def _register_session(base: str, sid: str, udid: Optional[str]) -> None:
         _SESSION_TO_UDID.pop(_key(b, prev_sid), None)
     _UDID_TO_SESSION[key_udid] = sid
     _SESSION_TO_UDID[key_session] = udid
+    if mjpeg_port:
+        _UDID_TO_MJPEG_PORT[key_udid] = mjpeg_port
+    else:
+        _UDID_TO_MJPEG_PORT.pop(key_udid, None)
 
 
 def _forget_session(base: str, sid: str) -> None:
@@ -70,6 +78,7 @@ def _forget_session(base: str, sid: str) -> None:
     udid = _SESSION_TO_UDID.pop(session_key, None)
     if udid:
         _UDID_TO_SESSION.pop(_udid_key(b, udid), None)
+        _UDID_TO_MJPEG_PORT.pop(_udid_key(b, udid), None)
 
 
 def invalidate_session(base: str, sid: str) -> None:
@@ -79,19 +88,13 @@ def invalidate_session(base: str, sid: str) -> None:
     """
     b = base.rstrip("/")
     k = _key(b, sid)
-    if k in _DRIVERS:
-        try:
-            drv = _DRIVERS.pop(k)
-            try:
-                # 不主动 quit，避免与上游无效会话的二次错误；仅清缓存。
-                pass
-            except Exception:
-                pass
-        finally:
-            logging.getLogger("wda.web").info(
-                f"appium invalidate-session: base={b} sid={sid} cache_cleared=True"
-            )
+    # 不主动 DELETE，避免与上游无效会话的二次错误；仅清缓存。
+    if _SESSIONS.pop(k, None) is not None:
+        logging.getLogger("wda.web").info(
+            f"appium invalidate-session: base={b} sid={sid} cache_cleared=True"
+        )
     _forget_session(base, sid)
+    _GEOMETRY.pop(k, None)
     # 若最新标记指向该 sid，则一并移除
     try:
         if core.APPIUM_LATEST.get(b) == sid:
@@ -100,116 +103,82 @@ def invalidate_session(base: str, sid: str) -> None:
         pass
 
 
-async def ensure_available() -> None:
-    if not APPIM_AVAILABLE:
-        raise RuntimeError('Appium-Python-Client is not installed. Install via: pip install "Appium-Python-Client>=3.0.0"')
-
-
-async def create_session(base: str, capabilities: Dict[str, Any]) -> Tuple[str, Any]:
-    await ensure_available()
+async def create_session(base: str, capabilities: Dict[str, Any]) -> Tuple[str, wd.WebDriverSession]:
     b = base.rstrip("/")
-
-    # Attempt 1: XCUITestOptions (Appium v2 preferred)
-    driver = None
-    last_err: Optional[Exception] = None
-    if XCUITestOptions is not None:
-        def _mk_opts() -> Any:
-            opts = XCUITestOptions()
-            # opts.set_new_command_timeout(0)  # 或 Duration/秒数
-            # Feed provided caps as-is
-            for k, v in (capabilities or {}).items():
-                try:
-                    opts.set_capability(k, v)
-                except Exception:
-                    pass
-            return Remote(command_executor=b, options=opts)
-        try:
-            driver = await asyncio.to_thread(_mk_opts)
-        except Exception as e:
-            last_err = e
-            core.logger.warning(f"Appium create (options) failed: {e}")
-
-    # Attempt 2: Fallback to generic AppiumOptions with de-namespaced caps (for broader compatibility)
-    if driver is None:
-        def _mk_opts_generic() -> Any:
-            # 去命名空间（如 appium:udid -> udid），以兼容某些服务端对旧键的容忍
-            caps_legacy: Dict[str, Any] = {}
-            for k, v in (capabilities or {}).items():
-                kk = k
-                if isinstance(k, str) and k.startswith("appium:"):
-                    kk = k.split(":", 1)[1]
-                caps_legacy[kk] = v
-            # # 强制确保 newCommandTimeout 存在且为 0（永不超时），除非调用方明确覆盖
-            # if "newCommandTimeout" not in caps_legacy:
-            #     caps_legacy["newCommandTimeout"] = 0
-            if AppiumOptions is None:
-                # 理论上 v3 应存在 AppiumOptions；若不存在，直接重抛到外层
-                raise RuntimeError("AppiumOptions is not available in this Appium Python client")
-            opts = AppiumOptions()
-            try:
-                opts.load_capabilities(caps_legacy)
-            except Exception:
-                # 退化逐项设置
-                for k, v in caps_legacy.items():
-                    try:
-                        opts.set_capability(k, v)
-                    except Exception:
-                        pass
-            return Remote(command_executor=b, options=opts)
-        try:
-            driver = await asyncio.to_thread(_mk_opts_generic)
-        except Exception as e2:
-            core.logger.error(f"Appium create (fallback options) failed: {e2}")
-            if last_err is not None:
-                core.logger.error(f"Previous create (options) error: {last_err}")
-            raise
-
-    sid = getattr(driver, "session_id", None)
-    if not sid:
-        try:
-            driver.quit()
-        except Exception:
-            pass
-        raise RuntimeError("Failed to obtain Appium sessionId from driver")
+    session = await wd.create_session(b, capabilities or {})
+    sid = session.session_id
     udid = None
-    try:
-        if isinstance(capabilities, dict):
-            udid = (
-                str(capabilities.get("appium:udid") or capabilities.get("udid") or "").strip()
-            ) or None
-    except Exception:
-        udid = None
+    if isinstance(capabilities, dict):
+        udid = str(capabilities.get("appium:udid") or capabilities.get("udid") or "").strip() or None
     if not udid:
-        try:
-            caps_ret = getattr(driver, "capabilities", {}) or {}
-            if isinstance(caps_ret, dict):
-                udid = (
-                    str(
-                        caps_ret.get("udid")
-                        or caps_ret.get("appium:udid")
-                        or caps_ret.get("desired", {}).get("udid")
-                    ).strip()
-                ) or None
-        except Exception:
-            udid = None
-    _DRIVERS[_key(b, sid)] = driver
+        caps_ret = session.capabilities
+        udid = str(
+            caps_ret.get("udid") or caps_ret.get("appium:udid") or (caps_ret.get("desired") or {}).get("udid") or ""
+        ).strip() or None
+    _SESSIONS[_key(b, sid)] = session
     if udid:
-        _register_session(base, sid, udid)
-    try:
-        core.APPIUM_LATEST[b] = sid
-    except Exception:
-        pass
+        _register_session(base, sid, udid, _caps_mjpeg_port(capabilities))
+    core.APPIUM_LATEST[b] = sid
     # 保存最近一次用于该 base 的 capabilities，便于自动重建
+    if isinstance(capabilities, dict):
+        _LAST_CAPS[b] = dict(capabilities)
+    # 后台预取窗口尺寸，首个 device-info 不必再等一次往返
+    asyncio.get_running_loop().create_task(_prime_geometry(b, sid), name=f"appium-geometry-{sid}")
+    return sid, session
+
+
+def get_session(base: str, sid: str) -> Optional[wd.WebDriverSession]:
+    return _SESSIONS.get(_key(base, sid))
+
+
+_T = TypeVar("_T")
+
+
+async def _run(
+    base: str,
+    sid: str,
+    kind: str,
+    op: Callable[[wd.WebDriverSession], Awaitable[_T]],
+    session: Optional[wd.WebDriverSession] = None,
+) -> _T:
+    """Queue one command on the session's ordered queue, mapping upstream invalid-session errors."""
+    return await _enqueue(base, sid, kind, op, session)
+
+
+def _enqueue(
+    base: str,
+    sid: str,
+    kind: str,
+    op: Callable[[wd.WebDriverSession], Awaitable[_T]],
+    session: Optional[wd.WebDriverSession] = None,
+) -> Awaitable[_T]:
+    # 同步入队：返回前命令已在会话队列中占好位置，之后再等待结果
+    session = session or get_session(base, sid)
+    if session is None:
+        raise RuntimeError("unknown session; create it via /api/appium/create in this backend")
+    # 任何命令入队都截断该会话尚在收集的手势分组，后到的分片不能越过这条命令
+    _COALESCER.cut(base, sid)
+    return _result(base, sid, _SCHEDULER.enqueue(_key(base, sid), kind, lambda: op(session)))
+
+
+async def _result(base: str, sid: str, future: "asyncio.Future[_T]") -> _T:
     try:
-        if isinstance(capabilities, dict):
-            _LAST_CAPS[b] = dict(capabilities)
-    except Exception:
-        pass
-    return sid, driver
+        return await future
+    except wd.WebDriverError as e:
+        # 识别上游会话失效并清理缓存
+        if e.invalid_session:
+            invalidate_session(base, sid)
+            raise AppiumInvalidSession(
+                "Appium session is invalid or terminated; please recreate the session"
+            ) from e
+        raise
 
 
-def get_driver(base: str, sid: str) -> Optional[Any]:
-    return _DRIVERS.get(_key(base, sid))
+async def delete_session(base: str, sid: str) -> None:
+    try:
+        await _run(base, sid, "delete", lambda s: s.quit())
+    finally:
+        invalidate_session(base, sid)
 
 
 def get_last_caps(base: str) -> Optional[Dict[str, Any]]:
@@ -217,33 +186,109 @@ def get_last_caps(base: str) -> Optional[Dict[str, Any]]:
     return _LAST_CAPS.get(b)
 
 
+_ORIENTATION_HINT = re.compile(r"orientation|rotat", re.IGNORECASE)
+
+
+def _script_kind(script: str) -> str:
+    # mobile: 命令集合有限，按命令名分别统计；任意 JS 脚本统一归为 execute
+    return script.strip() if script.strip().startswith("mobile:") else "execute"
+
+
 async def exec_mobile(base: str, sid: str, script: str, args: Any) -> Any:
-    await ensure_available()
-    drv = get_driver(base, sid)
-    if drv is None:
-        raise RuntimeError("unknown session; create it via /api/appium/create in this backend")
+    # mobile: 命令的参数对象作为 args 数组的唯一元素
+    res = await _run(base, sid, _script_kind(script), lambda s: s.execute_script(script, args))
+    if _ORIENTATION_HINT.search(script):
+        # 可能改变了屏幕方向，下一次读取几何信息时重新获取
+        _GEOMETRY.pop(_key(base, sid), None)
+    return res
 
-    def _exec() -> Any:
-        # Appium Python Client accepts dict for mobile: commands; it wraps as array internally
-        try:
-            return drv.execute_script(script, args)
-        except Exception as e:
-            # 识别上游会话失效并清理缓存
-            is_invalid = False
-            if InvalidSessionIdException is not None and isinstance(e, InvalidSessionIdException):
-                is_invalid = True
-            else:
-                msg = str(e) or e.__class__.__name__
-                if "InvalidSessionId" in msg or "A session is either terminated or not started" in msg:
-                    is_invalid = True
-            if is_invalid:
-                invalidate_session(base, sid)
-                raise AppiumInvalidSession(
-                    "Appium session is invalid or terminated; please recreate the session"
-                ) from e
-            raise
 
-    return await asyncio.to_thread(_exec)
+_ActionsArg = Union[
+    List[Dict[str, Any]],
+    Callable[[], Union[List[Dict[str, Any]], Awaitable[List[Dict[str, Any]]]]],
+]
+
+
+async def perform_actions(base: str, sid: str, actions: _ActionsArg, timeout: float = 30) -> Any:
+    """W3C actions; sessions created outside this backend are still accepted and queued by sessionId.
+
+    actions 也可以是无参函数（可返回 awaitable），在命令出队时才求值（手势合并据此在排队期间继续并入分片）。
+    """
+    return await queue_actions(base, sid, actions, timeout)
+
+
+def queue_actions(base: str, sid: str, actions: _ActionsArg, timeout: float = 30) -> Awaitable[Any]:
+    """perform_actions() whose command is already queued when this returns; await the result later."""
+    session = get_session(base, sid) or wd.WebDriverSession(base, sid)
+
+    async def _op(s: wd.WebDriverSession) -> Any:
+        payload = actions() if callable(actions) else actions
+        if inspect.isawaitable(payload):
+            payload = await payload
+        return await s.perform_actions(payload, timeout)
+
+    return _enqueue(base, sid, "actions", _op, session)
+
+
+_COALESCER = gesture_coalescer.ActionCoalescer(queue_actions)
+
+
+async def submit_actions(base: str, sid: str, actions: List[Dict[str, Any]]) -> Any:
+    """Interactive gesture path: merges queued pointer chunks and simplifies move paths."""
+    return await _COALESCER.submit(base, sid, actions)
+
+
+def gesture_stats() -> Dict[str, Any]:
+    return _COALESCER.stats.snapshot()
+
+
+async def run_batch(
+    base: str,
+    sid: str,
+    steps: List[Tuple[str, Optional[str], Any]],
+    continue_on_error: bool = False,
+) -> List[Dict[str, Any]]:
+    """Run (kind, script, arg) steps back to back as one queued command; returns per-step results.
+
+    整个批次只占会话队列的一个位置，期间不会有其它命令插到步骤之间。
+    会话失效时抛出 AppiumInvalidSession，其 steps 属性为已执行步骤（含失败的那一步）的结果。
+    """
+    session = get_session(base, sid) or wd.WebDriverSession(base, sid)
+    results: List[Dict[str, Any]] = []
+
+    async def _op(s: wd.WebDriverSession) -> List[Dict[str, Any]]:
+        for index, (kind, script, arg) in enumerate(steps):
+            started = time.monotonic()
+            item: Dict[str, Any] = {"index": index, "kind": kind}
+            if script is not None:
+                item["script"] = script
+            results.append(item)
+            try:
+                if kind == "actions":
+                    item["value"] = await s.perform_actions(arg, 30)
+                else:
+                    item["value"] = await s.execute_script(script, arg)
+                    if _ORIENTATION_HINT.search(script):
+                        _GEOMETRY.pop(_key(base, sid), None)
+                item["ok"] = True
+            except Exception as e:
+                item.update({"ok": False, "error": str(e)})
+                if isinstance(e, wd.WebDriverError) and e.invalid_session:
+                    item["ms"] = round((time.monotonic() - started) * 1000.0, 2)
+                    raise
+                core.logger.warning(
+                    f"appium batch step failed: base={base} sid={sid} step={index} kind={kind} err={e}"
+                )
+            item["ms"] = round((time.monotonic() - started) * 1000.0, 2)
+            if not item["ok"] and not continue_on_error:
+                break
+        return results
+
+    try:
+        return await _run(base, sid, "batch", _op, session)
+    except AppiumInvalidSession as e:
+        e.steps = results  # type: ignore[attr-defined]
+        raise
 
 
 async def exec_mobile_with_auto_recreate(base: str, sid: str, script: str, args: Any) -> Tuple[Any, Optional[str]]:
@@ -268,7 +313,7 @@ async def exec_mobile_with_auto_recreate(base: str, sid: str, script: str, args:
                 pass
             raise
         try:
-            new_sid, _drv = await create_session(base, capabilities=caps)
+            new_sid, _session = await create_session(base, capabilities=caps)
         except Exception as e:
             try:
                 core.logger.exception(f"auto-recreate failed: base={base} oldSid={sid} err={e}")
@@ -303,7 +348,7 @@ async def exec_mobile_with_auto_recreate(base: str, sid: str, script: str, args:
                     "Unknown session in backend and no cached capabilities; please recreate the session"
                 ) from e
             try:
-                new_sid, _drv = await create_session(base, capabilities=caps)
+                new_sid, _session = await create_session(base, capabilities=caps)
             except Exception as e2:
                 try:
                     core.logger.exception(f"auto-recreate failed: base={base} oldSid={sid} err={e2}")
@@ -322,64 +367,113 @@ async def exec_mobile_with_auto_recreate(base: str, sid: str, script: str, args:
 
 
 async def get_settings(base: str, sid: str) -> Dict[str, Any]:
-    await ensure_available()
-    drv = get_driver(base, sid)
-    if drv is None:
-        raise RuntimeError("unknown session; create it via /api/appium/create in this backend")
+    return await _run(base, sid, "settings", lambda s: s.get_settings())
 
-    def _get() -> Dict[str, Any]:
-        try:
-            return drv.get_settings()
-        except Exception as e:
-            is_invalid = False
-            if InvalidSessionIdException is not None and isinstance(e, InvalidSessionIdException):
-                is_invalid = True
-            else:
-                msg = str(e) or e.__class__.__name__
-                if "InvalidSessionId" in msg or "A session is either terminated or not started" in msg:
-                    is_invalid = True
-            if is_invalid:
-                invalidate_session(base, sid)
-                raise AppiumInvalidSession(
-                    "Appium session is invalid or terminated; please recreate the session"
-                ) from e
-            raise
 
-    return await asyncio.to_thread(_get)
+async def update_settings(base: str, sid: str, settings: Dict[str, Any]) -> Dict[str, Any]:
+    async def _upd_and_get(session: wd.WebDriverSession) -> Dict[str, Any]:
+        await session.update_settings(settings)
+        return await session.get_settings()
 
+    return await _run(base, sid, "settings", _upd_and_get)
+
+
+async def get_window_size(base: str, sid: str) -> Tuple[int, int]:
+    """Window size in points."""
+    return await _run(base, sid, "window", lambda s: s.get_window_size())
+
+
+async def get_screenshot_png(base: str, sid: str) -> bytes:
+    return await _run(base, sid, "screenshot", lambda s: s.get_screenshot_as_png())
+
+
+async def get_screenshot_size(base: str, sid: str) -> Optional[Tuple[int, int]]:
+    """Screenshot pixel size from the image header; only a base64 prefix is decoded."""
+    encoded = await _run(base, sid, "screenshot", lambda s: s.get_screenshot_as_base64())
+    return image_probe.b64_image_size(encoded)
 
-async def update_settings(base: str, sid: str, settings: Dict[str, Any]) -> Dict[str, Any]:
-    await ensure_available()
-    drv = get_driver(base, sid)
-    if drv is None:
-        raise RuntimeError("unknown session; create it via /api/appium/create in this backend")
 
-    def _upd_and_get() -> Dict[str, Any]:
+class Geometry:
+    """Cached window size (points) and screenshot pixel size for one session."""
+
+    __slots__ = ("size_pt", "size_px", "shot", "updated_at")
+
+    def __init__(self, size_pt: Optional[Tuple[int, int]], size_px: Optional[Tuple[int, int]], shot: bool) -> None:
+        self.size_pt = size_pt
+        self.size_px = size_px
+        # 是否已尝试过截图（失败也算，避免每次请求都重试）
+        self.shot = shot
+        self.updated_at = time.time()
+
+    @property
+    def landscape(self) -> Optional[bool]:
+        if not self.size_pt or self.size_pt[0] == self.size_pt[1]:
+            return None
+        return self.size_pt[0] > self.size_pt[1]
+
+
+async def _load_geometry(base: str, sid: str, screenshot: bool) -> Geometry:
+    w, h = await get_window_size(base, sid)
+    size_pt = (w, h) if w and h else None
+    size_px = None
+    if screenshot:
         try:
-            drv.update_settings(settings)
-            return drv.get_settings()
-        except Exception as e:
-            is_invalid = False
-            if InvalidSessionIdException is not None and isinstance(e, InvalidSessionIdException):
-                is_invalid = True
-            else:
-                msg = str(e) or e.__class__.__name__
-                if "InvalidSessionId" in msg or "A session is either terminated or not started" in msg:
-                    is_invalid = True
-            if is_invalid:
-                invalidate_session(base, sid)
-                raise AppiumInvalidSession(
-                    "Appium session is invalid or terminated; please recreate the session"
-                ) from e
+            size_px = await get_screenshot_size(base, sid)
+        except AppiumInvalidSession:
             raise
+        except Exception as e:
+            core.logger.info(f"geometry: skip screenshot size for sid={sid}: {e}")
+    geometry = Geometry(size_pt, size_px, screenshot)
+    # 加载期间会话被清理时不再写回
+    if get_session(base, sid) is not None:
+        _GEOMETRY[_key(base, sid)] = geometry
+    return geometry
+
+
+async def get_geometry(base: str, sid: str, refresh: bool = False, screenshot: bool = True) -> Geometry:
+    """Session geometry from memory; loads on first use, after rotation or when ``refresh`` is set.
+
+    screenshot=False 时不截图（size_px 可能为 None）；同一会话并发请求共用一次加载。
+    """
+    key = _key(base, sid)
+    pending = _GEOMETRY_LOADS.get(key)
+    if pending is not None:
+        await asyncio.shield(pending)
+        # 刚加载完的结果已足够新，不再重复刷新
+        refresh = False
+    geometry = _GEOMETRY.get(key)
+    if geometry is not None and not refresh and (geometry.shot or not screenshot):
+        return geometry
+    task = asyncio.get_running_loop().create_task(_load_geometry(base, sid, screenshot), name=f"appium-geometry-{sid}")
+    _GEOMETRY_LOADS[key] = task
+    task.add_done_callback(lambda t: _geometry_loaded(key, t))
+    return await asyncio.shield(task)
+
+
+def _geometry_loaded(key: Tuple[str, str], task: "asyncio.Task[Geometry]") -> None:
+    if _GEOMETRY_LOADS.get(key) is task:
+        del _GEOMETRY_LOADS[key]
+    # 调用方都已放弃时也要取走异常，避免 "Task exception was never retrieved"
+    if not task.cancelled():
+        task.exception()
+
+
+async def _prime_geometry(base: str, sid: str) -> None:
+    try:
+        await get_geometry(base, sid, screenshot=False)
+    except Exception as e:
+        core.logger.info(f"geometry: prime failed for sid={sid}: {e}")
 
-    return await asyncio.to_thread(_upd_and_get)
+
+def queue_stats() -> Dict[str, Any]:
+    """Queue depth per session and wait/exec timings per command type."""
+    return _SCHEDULER.snapshot(label=lambda key: key[1])
 
 
 def list_sessions(base: str) -> List[str]:
     b = base.rstrip("/")
     res = []
-    for (bb, sid) in list(_DRIVERS.keys()):
+    for (bb, sid) in list(_SESSIONS.keys()):
         if bb == b:
             res.append(sid)
     return res
@@ -389,3 +483,16 @@ def get_session_by_udid(base: str, udid: str) -> Optional[str]:
     if not udid:
         return None
     return _UDID_TO_SESSION.get(_udid_key(base, udid.strip()))
+
+
+def get_udid_by_session(base: str, sid: str) -> Optional[str]:
+    if not sid:
+        return None
+    return _SESSION_TO_UDID.get(_key(base, sid))
+
+
+def get_mjpeg_port(base: str, udid: str) -> Optional[int]:
+    """Return the mjpegServerPort the device's active session was created with."""
+    if not udid:
+        return None
+    return _UDID_TO_MJPEG_PORT.get(_udid_key(base, udid.strip()))
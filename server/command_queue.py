@@ -0,0 +1,199 @@
+import asyncio
+import os
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Hashable, List, Optional, Set
+
+# 每个会话同时在途的命令数；1 表示严格串行（按提交顺序逐条执行）
+SESSION_DEPTH = max(1, int(os.environ.get("APPIUM_SESSION_DEPTH", "1")))
+# 全部会话合计在途上限，超出后按会话轮转（round-robin）依次放行
+MAX_INFLIGHT = max(1, int(os.environ.get("APPIUM_MAX_INFLIGHT", "64")))
+# 每种命令保留最近 N 个样本用于分位数
+_SAMPLES = 512
+
+
+def _summary(values: Deque[float]) -> Dict[str, float]:
+    if not values:
+        return {"avg": 0.0, "p50": 0.0, "p99": 0.0, "max": 0.0}
+    vals = sorted(values)
+    last = len(vals) - 1
+    return {
+        "avg": round(sum(vals) / len(vals), 2),
+        "p50": round(vals[int(round(0.5 * last))], 2),
+        "p99": round(vals[int(round(0.99 * last))], 2),
+        "max": round(vals[-1], 2),
+    }
+
+
+class CommandStats:
+    """Queue-wait and execution time for one command type."""
+
+    __slots__ = ("count", "errors", "wait_ms", "exec_ms")
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.errors = 0
+        self.wait_ms: Deque[float] = deque(maxlen=_SAMPLES)
+        self.exec_ms: Deque[float] = deque(maxlen=_SAMPLES)
+
+    def record(self, wait_ms: float, exec_ms: float, ok: bool) -> None:
+        self.count += 1
+        if not ok:
+            self.errors += 1
+        self.wait_ms.append(wait_ms)
+        self.exec_ms.append(exec_ms)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "waitMs": _summary(self.wait_ms),
+            "execMs": _summary(self.exec_ms),
+        }
+
+
+class _Command:
+    __slots__ = ("kind", "factory", "future", "enqueued_at")
+
+    def __init__(self, kind: str, factory: Callable[[], Awaitable[Any]], future: asyncio.Future) -> None:
+        self.kind = kind
+        self.factory = factory
+        self.future = future
+        self.enqueued_at = time.monotonic()
+
+
+class _SessionQueue:
+    __slots__ = ("pending", "inflight", "in_ring")
+
+    def __init__(self) -> None:
+        self.pending: Deque[_Command] = deque()
+        self.inflight = 0
+        self.in_ring = False
+
+
+class CommandScheduler:
+    """Per-session FIFO command queues sharing a global in-flight budget.
+
+    同一会话的命令按提交顺序启动，最多 depth 条同时在途；全局空出槽位时沿环形顺序
+    从下一个有待执行命令的会话取一条，繁忙设备排再多命令也只能轮到自己的那一份。
+    """
+
+    def __init__(self, depth: int = SESSION_DEPTH, max_inflight: int = MAX_INFLIGHT) -> None:
+        self.depth = depth
+        self.max_inflight = max_inflight
+        self.inflight = 0
+        self._queues: Dict[Hashable, _SessionQueue] = {}
+        self._ring: Deque[Hashable] = deque()
+        self._tasks: Set[asyncio.Task] = set()
+        self.stats: Dict[str, CommandStats] = {}
+
+    async def submit(self, key: Hashable, kind: str, factory: Callable[[], Awaitable[Any]]) -> Any:
+        """Queue ``factory()`` behind earlier commands of ``key`` and return its result."""
+        return await self.enqueue(key, kind, factory)
+
+    def enqueue(self, key: Hashable, kind: str, factory: Callable[[], Awaitable[Any]]) -> asyncio.Future:
+        """Synchronous half of submit(): the command takes its place in the queue before this returns.
+
+        取消返回的 future 时，尚未开始的命令直接出队，已发出的让其跑完。
+        """
+        queue = self._queues.get(key)
+        if queue is None:
+            queue = self._queues[key] = _SessionQueue()
+        command = _Command(kind, factory, asyncio.get_running_loop().create_future())
+        command.future.add_done_callback(lambda f: f.cancelled() and self._withdraw(key, queue, command))
+        queue.pending.append(command)
+        if not queue.in_ring:
+            queue.in_ring = True
+            self._ring.append(key)
+        self._dispatch()
+        return command.future
+
+    def _withdraw(self, key: Hashable, queue: _SessionQueue, command: _Command) -> None:
+        # 调用方放弃（如 HTTP 客户端断开）
+        if command in queue.pending:
+            queue.pending.remove(command)
+            self._drop_if_idle(key, queue)
+
+    def _dispatch(self) -> None:
+        ring = self._ring
+        while self.inflight < self.max_inflight and ring:
+            for _ in range(len(ring)):
+                key = ring.popleft()
+                queue = self._queues.get(key)
+                if queue is None:
+                    continue
+                if not queue.pending:
+                    queue.in_ring = False
+                    self._drop_if_idle(key, queue)
+                    continue
+                if queue.inflight >= self.depth:
+                    ring.append(key)
+                    continue
+                command = queue.pending.popleft()
+                if queue.pending:
+                    # 放回队尾，下一次放行先轮到其它会话
+                    ring.append(key)
+                else:
+                    queue.in_ring = False
+                self._start(key, queue, command)
+                break
+            else:
+                # 所有待执行会话都已达到 depth
+                return
+
+    def _start(self, key: Hashable, queue: _SessionQueue, command: _Command) -> None:
+        self.inflight += 1
+        queue.inflight += 1
+        task = asyncio.create_task(self._run(key, queue, command), name=f"appium-cmd-{command.kind}")
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, key: Hashable, queue: _SessionQueue, command: _Command) -> None:
+        started = time.monotonic()
+        ok = False
+        try:
+            result = await command.factory()
+            ok = True
+            if not command.future.done():
+                command.future.set_result(result)
+        except BaseException as exc:  # noqa: BLE001
+            if not command.future.done():
+                if isinstance(exc, asyncio.CancelledError):
+                    command.future.cancel()
+                else:
+                    command.future.set_exception(exc)
+            if not isinstance(exc, Exception):
+                raise
+        finally:
+            finished = time.monotonic()
+            stats = self.stats.get(command.kind)
+            if stats is None:
+                stats = self.stats[command.kind] = CommandStats()
+            stats.record((started - command.enqueued_at) * 1000.0, (finished - started) * 1000.0, ok)
+            self.inflight -= 1
+            queue.inflight -= 1
+            self._drop_if_idle(key, queue)
+            self._dispatch()
+
+    def _drop_if_idle(self, key: Hashable, queue: _SessionQueue) -> None:
+        # 仍在环中的会话由 _dispatch 轮到时再清理，避免环里留下指向新队列的重复项
+        if not queue.pending and not queue.inflight and not queue.in_ring and self._queues.get(key) is queue:
+            del self._queues[key]
+
+    def snapshot(self, label: Optional[Callable[[Hashable], Any]] = None) -> Dict[str, Any]:
+        sessions: List[Dict[str, Any]] = [
+            {
+                "session": label(key) if label else key,
+                "queued": len(queue.pending),
+                "inflight": queue.inflight,
+            }
+            for key, queue in self._queues.items()
+        ]
+        return {
+            "depth": self.depth,
+            "maxInflight": self.max_inflight,
+            "inflight": self.inflight,
+            "queued": sum(item["queued"] for item in sessions),
+            "sessions": sessions,
+            "commands": {kind: stats.snapshot() for kind, stats in sorted(self.stats.items())},
+        }
@@ -13,6 +13,8 @@ MJPEG_URL = os.environ.get("MJPEG", "").rstrip("/")
 APPIUM_BASE = (os.environ.get("APPIUM_BASE") or "http://127.0.0.1:4723").rstrip("/")
 _DISCOVERY_BASE_ENV = os.environ.get("DEVICE_DISCOVERY_BASE") or os.environ.get("DISCOVERY_BASE") or "http://127.0.0.1:3030"
 DISCOVERY_BASE = _DISCOVERY_BASE_ENV.rstrip("/") if _DISCOVERY_BASE_ENV else ""
+# 推流与片段导出共用的 ffmpeg 可执行文件
+FFMPEG_BIN = os.environ.get("FFMPEG_BIN", "ffmpeg")
 
 # Track last created Appium session per base
 APPIUM_LATEST: Dict[str, str] = {}
@@ -127,6 +129,14 @@ def _build_backend_base() -> str:
 
 BACKEND_BASE_LAN = _build_backend_base()
 
+
+def build_mjpeg_url(base_url: str, port: int) -> str:
+    """MJPEG server of a device lives on the Appium host at its mjpegServerPort."""
+    parsed = urlparse(base_url)
+    host = parsed.hostname or "127.0.0.1"
+    scheme = parsed.scheme or "http"
+    return f"{scheme}://{host}:{port}"
+
 # Logger
 logger = logging.getLogger("wda.web")
 if not logger.handlers:
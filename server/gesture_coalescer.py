@@ -0,0 +1,323 @@
+import asyncio
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+# 关闭后 /api/appium/actions 原样转发
+COALESCE_ENABLED = os.environ.get("GESTURE_COALESCE", "1").strip().lower() not in ("0", "false", "no", "off")
+# 路径简化容差（像素/点）：偏离首尾连线不超过该值的中间点会被合并
+TOLERANCE = max(0.0, float(os.environ.get("GESTURE_TOLERANCE_PX", "2")))
+# 分组出队后、发出前再等到首个分片到达满该毫秒数，以便收集后续分片（等待期间占住会话队列）；
+# 0 表示只合并排在在途命令之后的分片
+WINDOW_MS = max(0.0, float(os.environ.get("GESTURE_WINDOW_MS", "0")))
+
+_Point = Tuple[float, float]
+
+
+def _is_move(action: Any) -> bool:
+    # 以元素为原点的移动无法换算坐标，按普通动作原样保留
+    return (
+        isinstance(action, dict)
+        and action.get("type") == "pointerMove"
+        and action.get("origin", "viewport") in ("viewport", "pointer")
+        and isinstance(action.get("x"), (int, float))
+        and isinstance(action.get("y"), (int, float))
+    )
+
+
+def _count_moves(actions: List[Dict[str, Any]]) -> int:
+    return sum(
+        1
+        for source in actions
+        if isinstance(source, dict)
+        for action in source.get("actions") or []
+        if isinstance(action, dict) and action.get("type") == "pointerMove"
+    )
+
+
+def _distance(p: _Point, a: _Point, b: _Point) -> float:
+    dx, dy = b[0] - a[0], b[1] - a[1]
+    if dx == 0 and dy == 0:
+        return ((p[0] - a[0]) ** 2 + (p[1] - a[1]) ** 2) ** 0.5
+    return abs(dy * p[0] - dx * p[1] + b[0] * a[1] - b[1] * a[0]) / (dx * dx + dy * dy) ** 0.5
+
+
+def _rdp(points: List[_Point], tolerance: float) -> List[bool]:
+    """Ramer–Douglas–Peucker: mark which points survive; first and last always do."""
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        best, index = -1.0, -1
+        for i in range(first + 1, last):
+            d = _distance(points[i], points[first], points[last])
+            if d > best:
+                best, index = d, i
+        if index != -1 and best > tolerance:
+            keep[index] = True
+            stack.append((first, index))
+            stack.append((index, last))
+    return keep
+
+
+def _simplify_segment(
+    anchor: Optional[Dict[str, Any]],
+    moves: List[Dict[str, Any]],
+    tolerance: float,
+    keep_last: bool,
+) -> List[Dict[str, Any]]:
+    # anchor 为段首的 viewport 绝对移动（原样保留）；无 anchor 时以未知起点为原点做相对坐标
+    start: _Point = (float(anchor["x"]), float(anchor["y"])) if anchor else (0.0, 0.0)
+    points = [start]
+    for move in moves:
+        last = points[-1]
+        points.append((last[0] + move["x"], last[1] + move["y"]))
+    out: List[Dict[str, Any]] = [anchor] if anchor else []
+    if not moves:
+        return out
+    keep = _rdp(points, tolerance)
+    if keep_last and len(points) > 2:
+        # 抬起前的最后一段决定惯性滑动速度，保持原样
+        keep[-2] = True
+    prev = 0
+    duration = 0
+    for i in range(1, len(points)):
+        duration += int(moves[i - 1].get("duration") or 0)
+        if not keep[i]:
+            continue
+        if prev == i - 1:
+            out.append(moves[i - 1])
+        else:
+            out.append({
+                **moves[i - 1],
+                "duration": duration,
+                "x": int(round(points[i][0] - points[prev][0])),
+                "y": int(round(points[i][1] - points[prev][1])),
+            })
+        prev = i
+        duration = 0
+    return out
+
+
+def _simplify_run(
+    run: List[Dict[str, Any]],
+    tolerance: float,
+    hover: bool,
+    keep_last: bool,
+) -> List[Dict[str, Any]]:
+    if hover and len(run) > 1:
+        # 触摸指针未按下时只有最终位置有意义，中间的移动全部被覆盖
+        duration = sum(int(m.get("duration") or 0) for m in run)
+        anchor_at = max((i for i, m in enumerate(run) if m.get("origin", "viewport") == "viewport"), default=-1)
+        if anchor_at == -1:
+            dx = sum(m["x"] for m in run)
+            dy = sum(m["y"] for m in run)
+            return [{**run[-1], "duration": duration, "origin": "pointer", "x": dx, "y": dy}]
+        tail = run[anchor_at + 1:]
+        x = run[anchor_at]["x"] + sum(m["x"] for m in tail)
+        y = run[anchor_at]["y"] + sum(m["y"] for m in tail)
+        return [{**run[anchor_at], "duration": duration, "origin": "viewport", "x": x, "y": y}]
+    out: List[Dict[str, Any]] = []
+    anchor: Optional[Dict[str, Any]] = None
+    moves: List[Dict[str, Any]] = []
+    for move in run:
+        if move.get("origin", "viewport") == "viewport":
+            out.extend(_simplify_segment(anchor, moves, tolerance, False))
+            anchor, moves = move, []
+        else:
+            moves.append(move)
+    out.extend(_simplify_segment(anchor, moves, tolerance, keep_last))
+    return out
+
+
+def simplify_sequence(
+    seq: List[Dict[str, Any]],
+    pointer_type: str = "touch",
+    tolerance: float = TOLERANCE,
+) -> List[Dict[str, Any]]:
+    """Simplify consecutive pointerMove runs of one pointer source.
+
+    pointerDown/pointerUp/pause 及其顺序保持不变，因此点击与长按的时长、位置不受影响；
+    每段连续移动的起止点、总时长保留，只合并共线或抖动范围内的中间点。
+    """
+    out: List[Dict[str, Any]] = []
+    # None 表示未知（分片可能从上一次调用的拖动中途开始），此时不做悬停折叠
+    down: Optional[bool] = None
+    i = 0
+    while i < len(seq):
+        action = seq[i]
+        if not _is_move(action):
+            out.append(action)
+            kind = action.get("type") if isinstance(action, dict) else None
+            if kind == "pointerDown":
+                down = True
+            elif kind == "pointerUp":
+                down = False
+            i += 1
+            continue
+        j = i
+        while j < len(seq) and _is_move(seq[j]):
+            j += 1
+        followed_by_up = j < len(seq) and isinstance(seq[j], dict) and seq[j].get("type") == "pointerUp"
+        out.extend(
+            _simplify_run(seq[i:j], tolerance, hover=down is False and pointer_type == "touch", keep_last=followed_by_up)
+        )
+        i = j
+    return out
+
+
+def _single_pointer(actions: Any) -> Optional[Tuple[Tuple[Any, str], List[Dict[str, Any]]]]:
+    # 多个输入源按 tick 对齐执行，删减其中一个的动作会打乱同步，因此只处理单指针负载
+    if not isinstance(actions, list) or len(actions) != 1:
+        return None
+    source = actions[0]
+    if not isinstance(source, dict) or source.get("type") != "pointer":
+        return None
+    seq = source.get("actions")
+    if not isinstance(seq, list):
+        return None
+    return (source.get("id"), _pointer_type(source)), seq
+
+
+def _pointer_type(source: Dict[str, Any]) -> str:
+    params = source.get("parameters") or {}
+    # W3C 默认 pointerType 为 mouse
+    return str(params.get("pointerType") or "mouse") if isinstance(params, dict) else "mouse"
+
+
+class CoalesceStats:
+    __slots__ = ("requests", "calls", "merged", "moves_in", "moves_out", "actions_in", "actions_out")
+
+    def __init__(self) -> None:
+        self.requests = 0
+        self.calls = 0
+        self.merged = 0
+        self.moves_in = 0
+        self.moves_out = 0
+        self.actions_in = 0
+        self.actions_out = 0
+
+    def snapshot(self) -> Dict[str, Any]:
+        def ratio(before: int, after: int) -> float:
+            return round(1.0 - after / before, 4) if before else 0.0
+
+        return {
+            "enabled": COALESCE_ENABLED,
+            "requests": self.requests,
+            "calls": self.calls,
+            "mergedRequests": self.merged,
+            "movesIn": self.moves_in,
+            "movesOut": self.moves_out,
+            "actionsIn": self.actions_in,
+            "actionsOut": self.actions_out,
+            "callReduction": ratio(self.requests, self.calls),
+            "moveReduction": ratio(self.moves_in, self.moves_out),
+            "actionReduction": ratio(self.actions_in, self.actions_out),
+        }
+
+
+class _Group:
+    __slots__ = ("source", "chunks", "future", "opened")
+
+    def __init__(self, source: Dict[str, Any], seq: List[Dict[str, Any]]) -> None:
+        self.source = source
+        self.chunks = [seq]
+        self.opened = time.monotonic()
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        # 所有调用方都已放弃时避免 "exception was never retrieved"
+        self.future.add_done_callback(lambda f: f.cancelled() or f.exception())
+
+
+# 调用即在会话队列中入队（同步），返回等待结果的 awaitable；provider 在命令出队时求值
+def _group_key(base: str, sid: str) -> Tuple[str, str]:
+    # 与命令队列的会话键一致
+    return (base.rstrip("/"), sid)
+
+
+SendFn = Callable[[str, str, Callable[[], Any]], Awaitable[Any]]
+
+
+class ActionCoalescer:
+    """Merge W3C action chunks per session before they reach Appium.
+
+    每组的命令在首个分片到达时就同步入队，与其它命令的相对顺序即提交顺序；此后同一指针的
+    分片并入这一组，直到它真正出队时才拼接并简化路径，所有并入的调用方共享同一个返回结果。
+    """
+
+    def __init__(self, send: SendFn, window_ms: float = WINDOW_MS, tolerance: float = TOLERANCE) -> None:
+        self._send = send
+        self.window = window_ms / 1000.0
+        self.tolerance = tolerance
+        self._open: Dict[Tuple[str, str], _Group] = {}
+        self._tasks: set = set()
+        self.stats = CoalesceStats()
+
+    async def submit(self, base: str, sid: str, actions: List[Dict[str, Any]]) -> Any:
+        stats = self.stats
+        stats.requests += 1
+        stats.moves_in += _count_moves(actions)
+        stats.actions_in += sum(len(s.get("actions") or []) for s in actions if isinstance(s, dict))
+        key = _group_key(base, sid)
+        single = _single_pointer(actions) if COALESCE_ENABLED else None
+        if single is None:
+            # 不可合并的负载截断当前分组并排在它之后，之后的分片进入新的一组
+            self._open.pop(key, None)
+            return await self._send(base, sid, lambda: self._passthrough(actions))
+        (source_id, pointer_type), seq = single
+        group = self._open.get(key)
+        if group is not None and (group.source.get("id"), _pointer_type(group.source)) == (source_id, pointer_type):
+            group.chunks.append(seq)
+            stats.merged += 1
+            return await asyncio.shield(group.future)
+        group = _Group(actions[0], seq)
+        pending = self._send(base, sid, lambda: self._close(base, sid, group))
+        self._open[key] = group
+        task = asyncio.create_task(self._flush(base, sid, group, pending), name=f"gesture-flush-{sid}")
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return await asyncio.shield(group.future)
+
+    def cut(self, base: str, sid: str) -> None:
+        """Close the session's open group; called whenever any command is queued for the session.
+
+        之后到达的分片进入新的一组并排在该命令之后，否则并入旧组会越过排在它后面的命令。
+        """
+        self._open.pop(_group_key(base, sid), None)
+
+    def _release(self, base: str, sid: str, group: _Group) -> None:
+        key = _group_key(base, sid)
+        if self._open.get(key) is group:
+            del self._open[key]
+
+    def _passthrough(self, actions: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        self.stats.calls += 1
+        self.stats.moves_out += _count_moves(actions)
+        self.stats.actions_out += sum(len(s.get("actions") or []) for s in actions if isinstance(s, dict))
+        return actions
+
+    async def _close(self, base: str, sid: str, group: _Group) -> List[Dict[str, Any]]:
+        # 在会话队列中真正出队时调用：窗口未满时占住队列等到窗口结束，此后到达的分片进入新的一组
+        delay = group.opened + self.window - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        self._release(base, sid, group)
+        seq = [action for chunk in group.chunks for action in chunk]
+        seq = simplify_sequence(seq, _pointer_type(group.source), self.tolerance)
+        return self._passthrough([{**group.source, "actions": seq}])
+
+    async def _flush(self, base: str, sid: str, group: _Group, pending: Awaitable[Any]) -> None:
+        try:
+            result = await pending
+        except BaseException as exc:  # noqa: BLE001
+            self._release(base, sid, group)
+            if not group.future.done():
+                if isinstance(exc, asyncio.CancelledError):
+                    group.future.cancel()
+                else:
+                    group.future.set_exception(exc)
+            if not isinstance(exc, Exception):
+                raise
+        else:
+            if not group.future.done():
+                group.future.set_result(result)
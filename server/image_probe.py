@@ -0,0 +1,90 @@
+import base64
+import binascii
+import re
+import struct
+from typing import Optional, Tuple
+
+_PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# SOF0..SOF15，排除 DHT(C4)、JPG(C8)、DAC(CC)
+_JPEG_SOF = frozenset(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+# 无长度字段的独立标记：TEM、RST0..RST7
+_JPEG_STANDALONE = frozenset([0x01, *range(0xD0, 0xD8)])
+_WHITESPACE = re.compile(rb"\s+")
+
+
+def _png_size(data: bytes) -> Optional[Tuple[int, int]]:
+    # 签名(8) + IHDR 长度(4) + "IHDR"(4) + 宽(4) + 高(4)
+    if len(data) < 24 or data[12:16] != b"IHDR":
+        return None
+    return struct.unpack(">II", data[16:24])
+
+
+def _jpeg_size(data: bytes) -> Optional[Tuple[int, int]]:
+    pos = 2
+    n = len(data)
+    while pos + 4 <= n:
+        if data[pos] != 0xFF:
+            return None
+        marker = data[pos + 1]
+        if marker == 0xFF:
+            # 填充字节
+            pos += 1
+            continue
+        if marker in _JPEG_STANDALONE:
+            pos += 2
+            continue
+        if marker in (0xD9, 0xDA):
+            # 到 EOI/SOS 仍未见 SOF
+            return None
+        (length,) = struct.unpack(">H", data[pos + 2:pos + 4])
+        if marker in _JPEG_SOF:
+            if pos + 9 > n:
+                return None
+            height, width = struct.unpack(">HH", data[pos + 5:pos + 9])
+            return width, height
+        pos += 2 + length
+    return None
+
+
+def image_size(data: bytes) -> Optional[Tuple[int, int]]:
+    """(width, height) of a PNG or JPEG read from its header; None when unknown or truncated.
+
+    只看 PNG 的 IHDR 或 JPEG 的 SOF 段，不解码像素；数据可以只是文件开头的一段。
+    """
+    if not data:
+        return None
+    if data.startswith(_PNG_SIGNATURE):
+        size = _png_size(data)
+    elif data.startswith(b"\xff\xd8"):
+        size = _jpeg_size(data)
+    else:
+        return None
+    if size is None or not size[0] or not size[1]:
+        return None
+    return size
+
+
+def b64_image_size(encoded: str, chunk: int = 512) -> Optional[Tuple[int, int]]:
+    """image_size() over a base64 string, decoding only as much of the prefix as needed.
+
+    PNG 的 IHDR 在前 24 字节内；JPEG 的 SOF 可能排在 EXIF 等 APP 段之后，
+    因此前缀不够时按倍数扩大，最坏情况才解码整串。
+    """
+    raw = encoded.encode("ascii", "ignore") if isinstance(encoded, str) else bytes(encoded)
+    end = chunk
+    while True:
+        prefix = _WHITESPACE.sub(b"", raw[:end])
+        complete = end >= len(raw)
+        if not complete:
+            prefix = prefix[: len(prefix) // 4 * 4]
+        try:
+            data = base64.b64decode(prefix)
+        except (binascii.Error, ValueError):
+            return None
+        size = image_size(data)
+        if size is not None or complete:
+            return size
+        if len(data) >= 8 and not (data.startswith(_PNG_SIGNATURE) or data.startswith(b"\xff\xd8")):
+            # 不是 PNG/JPEG，继续解码也无济于事
+            return None
+        end *= 4
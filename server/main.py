@@ -8,6 +8,7 @@ from fastapi.responses import Response, StreamingResponse
 import core
 import ws_proxy_client
 import stream_pusher
+import mjpeg_hub
 from routes.appium_proxy import router as appium_router
 from routes.stream import router as stream_router
 from routes.misc import router as misc_router
@@ -27,6 +28,14 @@ async def _startup_ws_proxy():
         core.logger.exception("Failed to start WS proxy client")
 
 
+@app.on_event("shutdown")
+async def _shutdown_mjpeg_hubs():
+    try:
+        await mjpeg_hub.stop_all()
+    except Exception:
+        core.logger.exception("Failed to stop MJPEG hubs")
+
+
 @app.on_event("shutdown")
 async def _shutdown_shared_http():
     # Ensure shared httpx client is closed gracefully
@@ -0,0 +1,627 @@
+import asyncio
+import contextlib
+import itertools
+import os
+import time
+import zlib
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+import httpx
+
+import core
+import image_probe
+import mjpeg_recorder
+import mjpeg_renditions
+import mjpeg_stats
+
+
+# 下游统一使用的 multipart 分隔符（帧由本模块重新封装，与上游 boundary 无关）
+FRAME_BOUNDARY = "wdaframe"
+FRAME_CONTENT_TYPE = f"multipart/x-mixed-replace; boundary={FRAME_BOUNDARY}"
+_FRAME_DELIMITER = f"--{FRAME_BOUNDARY}\r\n".encode()
+
+# 上游 MJPEG 地址可能只给了 host:port，按顺序尝试常见路径
+CANDIDATE_PATHS = (
+    "",
+    "/mjpeg",
+    "/mjpeg/",
+    "/mjpeg/0",
+    "/mjpeg/1",
+    "/stream.mjpeg",
+    "/video",
+    "/stream",
+    "/mjpegstream",
+    "/",
+)
+
+_MAX_FRAME_BYTES = int(os.environ.get("MJPEG_MAX_FRAME_BYTES", str(16 * 1024 * 1024)))
+_RECONNECT_BASE = float(os.environ.get("MJPEG_RECONNECT_BASE", "0.5"))
+_RECONNECT_MAX = float(os.environ.get("MJPEG_RECONNECT_MAX", "10"))
+READY_TIMEOUT = float(os.environ.get("MJPEG_READY_TIMEOUT", "15"))
+_RESOLVE_TTL = float(os.environ.get("MJPEG_RESOLVE_TTL", "600"))
+# 重复帧抑制：画面未变化时不再转发，但每隔 keyframe 间隔仍补发一帧
+_DEDUP_ENABLED = os.environ.get("MJPEG_DEDUP", "true").strip().lower() in {"1", "true", "yes", "y"}
+_DEDUP_KEYFRAME_INTERVAL = float(os.environ.get("MJPEG_DEDUP_KEYFRAME_INTERVAL", "2"))
+# 快照允许的最大帧龄（秒），超过视为流已停滞
+SNAPSHOT_MAX_AGE = float(os.environ.get("MJPEG_SNAPSHOT_MAX_AGE", "5"))
+
+if _RECONNECT_BASE <= 0:
+    _RECONNECT_BASE = 0.5
+if _RECONNECT_MAX < _RECONNECT_BASE:
+    _RECONNECT_MAX = max(_RECONNECT_BASE, 10.0)
+
+
+def normalize_content_type(ctype: str) -> Tuple[str, Optional[str]]:
+    """Return (Content-Type for browsers, boundary value).
+
+    部分上游会在 boundary 值前误带 "--"，浏览器可能无法解析，这里统一去掉。
+    """
+    try:
+        parts = [p.strip() for p in ctype.split(";")]
+        base = parts[0].lower()
+        boundary_val = None
+        rest = []
+        for p in parts[1:]:
+            if p.lower().startswith("boundary="):
+                boundary_val = p.split("=", 1)[1].strip().strip('"')
+            else:
+                rest.append(p)
+        if base.startswith("multipart/x-mixed-replace") and boundary_val:
+            if boundary_val.startswith("--"):
+                boundary_val = boundary_val[2:]
+            # 重新拼装 Content-Type
+            ctype_out = "multipart/x-mixed-replace; boundary=" + boundary_val
+            if rest:
+                ctype_out += "; " + "; ".join(rest)
+            return ctype_out, boundary_val
+    except Exception:
+        pass
+    return ctype, None
+
+
+class ResolvedEndpoint:
+    """Cached probe result for one MJPEG source."""
+
+    __slots__ = ("url", "content_type", "boundary", "expires_at")
+
+    def __init__(self, url: str, content_type: str, boundary: Optional[str], expires_at: float) -> None:
+        self.url = url
+        self.content_type = content_type
+        self.boundary = boundary
+        self.expires_at = expires_at
+
+
+# source -> 上次探测成功的路径；过期或失效后重新探测
+_RESOLVED: Dict[str, ResolvedEndpoint] = {}
+
+
+async def _open_stream(client: httpx.AsyncClient, url: str) -> httpx.Response:
+    request = client.build_request("GET", url, timeout=None)
+    return await client.send(request, stream=True)
+
+
+def _accept(resp: httpx.Response, source: str) -> Optional[ResolvedEndpoint]:
+    raw_ctype = resp.headers.get("Content-Type", "")
+    if resp.status_code >= 400 or not raw_ctype.lower().startswith("multipart/x-mixed-replace"):
+        return None
+    ctype, boundary = normalize_content_type(raw_ctype)
+    endpoint = ResolvedEndpoint(str(resp.url), ctype, boundary, time.monotonic() + _RESOLVE_TTL)
+    _RESOLVED[source] = endpoint
+    return endpoint
+
+
+async def open_upstream(client: httpx.AsyncClient, source: str) -> Tuple[httpx.Response, ResolvedEndpoint]:
+    """Open a live multipart response for ``source``.
+
+    命中缓存时只建一次连接；缓存路径失效才依次探测候选路径。探测成功的连接直接作为
+    直播连接返回，调用方负责 ``aclose()``。
+    """
+    cached = _RESOLVED.get(source)
+    if cached is not None and cached.expires_at > time.monotonic():
+        try:
+            resp = await _open_stream(client, cached.url)
+        except Exception as exc:
+            core.logger.info(f"MJPEG cached endpoint failed: {cached.url} err={exc}; re-probing")
+        else:
+            endpoint = _accept(resp, source)
+            if endpoint is not None:
+                return resp, endpoint
+            await resp.aclose()
+            core.logger.info(f"MJPEG cached endpoint is no longer multipart: {cached.url}; re-probing")
+    _RESOLVED.pop(source, None)
+
+    last_err: Optional[Exception] = None
+    for path in CANDIDATE_PATHS:
+        url = f"{source}{path}"
+        try:
+            resp = await _open_stream(client, url)
+        except Exception as e:
+            last_err = e
+            continue
+        endpoint = _accept(resp, source)
+        if endpoint is not None:
+            return resp, endpoint
+        await resp.aclose()
+    raise RuntimeError(f"no multipart endpoint found (last error: {last_err})")
+
+
+class MjpegFrame:
+    """One complete JPEG cut out of the upstream multipart stream."""
+
+    __slots__ = ("seq", "data", "captured_at", "_part", "_size")
+
+    def __init__(self, seq: int, data: bytes, captured_at: float) -> None:
+        self.seq = seq
+        self.data = data
+        self.captured_at = captured_at
+        self._part: Optional[bytes] = None
+        self._size: Optional[Tuple[int, int]] = None
+
+    @property
+    def size(self) -> Optional[Tuple[int, int]]:
+        """(width, height)，直接读 JPEG 的 SOF 段，不解码像素。"""
+        if self._size is None:
+            self._size = image_probe.image_size(self.data) or (0, 0)
+        return self._size if self._size[0] and self._size[1] else None
+
+    @property
+    def part(self) -> bytes:
+        """multipart 分片，所有观众共享同一份。
+
+        分隔符写在分片末尾：浏览器收到分隔符才认为该帧结束并渲染，末尾写出可让最后
+        一帧立即显示（重复帧被抑制时尤为重要）。起始分隔符由 iter_parts 单独输出。
+        """
+        if self._part is None:
+            self._part = (
+                f"Content-Type: image/jpeg\r\nContent-Length: {len(self.data)}\r\n\r\n"
+            ).encode() + self.data + b"\r\n" + _FRAME_DELIMITER
+        return self._part
+
+
+class MjpegFrameParser:
+    """Incremental multipart/x-mixed-replace parser yielding whole JPEG payloads.
+
+    优先按 Content-Length 切帧；缺失时以下一个分隔符为界。未声明 boundary 的上游
+    以正文首个 ``--`` 开头的行作为分隔符。
+    """
+
+    def __init__(self, boundary: Optional[str]) -> None:
+        self._delimiter: Optional[bytes] = f"--{boundary}".encode() if boundary else None
+        self._buf = bytearray()
+        self._in_body = False
+        self._length: Optional[int] = None
+
+    def reset(self) -> None:
+        self._buf.clear()
+        self._in_body = False
+        self._length = None
+
+    def feed(self, chunk: bytes) -> List[bytes]:
+        frames: List[bytes] = []
+        buf = self._buf
+        buf.extend(chunk)
+        while True:
+            if not self._in_body:
+                if not self._sniff_delimiter():
+                    if len(buf) > 8192:
+                        buf.clear()
+                    break
+                delimiter = self._delimiter
+                idx = buf.find(delimiter)
+                if idx == -1:
+                    # 保留可能被截断的分隔符前缀
+                    keep = len(delimiter)
+                    if len(buf) > keep:
+                        del buf[:-keep]
+                    break
+                head_end = buf.find(b"\r\n\r\n", idx)
+                if head_end == -1:
+                    if idx:
+                        del buf[:idx]
+                    if len(buf) > 8192:
+                        # 头部异常过长，丢弃后重新寻找分隔符
+                        del buf[: len(delimiter)]
+                        continue
+                    break
+                self._length = _content_length(bytes(buf[idx + len(delimiter):head_end]))
+                del buf[: head_end + 4]
+                self._in_body = True
+            if self._length is not None:
+                if len(buf) < self._length:
+                    break
+                frame = bytes(buf[: self._length])
+                del buf[: self._length]
+            else:
+                idx = buf.find(self._delimiter)
+                if idx == -1:
+                    if len(buf) > _MAX_FRAME_BYTES:
+                        self.reset()
+                    break
+                frame = bytes(buf[:idx]).rstrip(b"\r\n")
+                del buf[:idx]
+            self._in_body = False
+            self._length = None
+            if frame:
+                frames.append(frame)
+        return frames
+
+    def _sniff_delimiter(self) -> bool:
+        if self._delimiter is not None:
+            return True
+        buf = self._buf
+        start = buf.find(b"--")
+        if start == -1:
+            return False
+        end = buf.find(b"\r\n", start)
+        if end == -1:
+            return False
+        self._delimiter = bytes(buf[start:end]).strip()
+        return bool(self._delimiter)
+
+
+def _content_length(headers: bytes) -> Optional[int]:
+    for line in headers.split(b"\r\n"):
+        name, sep, value = line.partition(b":")
+        if sep and name.strip().lower() == b"content-length":
+            try:
+                length = int(value.strip())
+            except ValueError:
+                return None
+            if 0 < length <= _MAX_FRAME_BYTES:
+                return length
+            return None
+    return None
+
+
+_SUBSCRIBER_IDS = itertools.count(1)
+
+
+class MjpegSubscriber:
+    """One downstream viewer with a one-slot mailbox.
+
+    观众跟不上时新帧直接覆盖未取走的旧帧（latest-frame-wins），被覆盖的帧计入 ``dropped``。
+    """
+
+    __slots__ = (
+        "id", "client", "rendition", "delivered", "dropped", "connected_at", "stats",
+        "_hub_stats", "_frame", "_event", "_closed",
+    )
+
+    def __init__(self, client: Optional[str] = None, rendition: str = mjpeg_renditions.FULL) -> None:
+        self.id = next(_SUBSCRIBER_IDS)
+        self.client = client
+        self.rendition = rendition
+        self.delivered = 0
+        self.dropped = 0
+        self.connected_at = time.time()
+        self.stats = mjpeg_stats.ViewerStats()
+        self._hub_stats: Optional[mjpeg_stats.UpstreamStats] = None
+        self._frame: Optional[MjpegFrame] = None
+        self._event = asyncio.Event()
+        self._closed = False
+
+    def offer(self, frame: MjpegFrame) -> None:
+        if self._frame is not None:
+            self.dropped += 1
+        self._frame = frame
+        self._event.set()
+
+    def close(self) -> None:
+        self._closed = True
+        self._event.set()
+
+    async def next_frame(self) -> Optional[MjpegFrame]:
+        """等待下一帧；hub 关闭时返回 None。"""
+        while True:
+            frame = self._frame
+            if frame is not None:
+                self._frame = None
+                self.delivered += 1
+                size = len(frame.data)
+                self.stats.on_delivered(size, frame.captured_at)
+                if self._hub_stats is not None:
+                    self._hub_stats.on_bytes_out(size)
+                return frame
+            if self._closed:
+                return None
+            self._event.clear()
+            await self._event.wait()
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "client": self.client,
+            "rendition": self.rendition,
+            "delivered": self.delivered,
+            "dropped": self.dropped,
+            "queueDepth": 1 if self._frame is not None else 0,
+            "connectedAt": self.connected_at,
+            **self.stats.snapshot(),
+        }
+
+
+class MjpegHub:
+    """Single upstream MJPEG reader fanned out to every subscriber of one source."""
+
+    def __init__(self, source: str, udid: Optional[str] = None) -> None:
+        self.source = source
+        self.udid = udid
+        self.url: Optional[str] = None
+        self.upstream_content_type: Optional[str] = None
+        self.error: Optional[str] = None
+        self.connected = False
+        self.latest: Optional[MjpegFrame] = None
+        self._seq = 0
+        self._last_fingerprint: Optional[Tuple[int, int]] = None
+        self._last_forwarded_at = 0.0
+        self.stats = mjpeg_stats.UpstreamStats()
+        self._subscribers: List[MjpegSubscriber] = []
+        # 非 full 档位：每档一个转码 worker 及其最近一帧，由该档所有观众共享
+        self._workers: Dict[str, mjpeg_renditions.RenditionWorker] = {}
+        self._rendered: Dict[str, MjpegFrame] = {}
+        # 最近 N 秒画面的环形录制，供事后导出片段；同一设备的 hub 共用一个环
+        self.recorder: Optional[mjpeg_recorder.RingLease] = (
+            mjpeg_recorder.lease(udid or source) if mjpeg_recorder.RECORD_ENABLED else None
+        )
+        # 每次连上或连接失败时触发一次并换新，等待方据此重新检查状态
+        self._attempt_done = asyncio.Event()
+        # 已失败的连接尝试次数
+        self._failed_attempts = 0
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def content_type(self) -> Optional[str]:
+        return FRAME_CONTENT_TYPE if self.upstream_content_type else None
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
+
+    def _add(self, sub: MjpegSubscriber) -> None:
+        self._subscribers.append(sub)
+        sub._hub_stats = self.stats
+        if sub.rendition == mjpeg_renditions.FULL:
+            latest = self.latest
+        else:
+            if sub.rendition not in self._workers:
+                self._workers[sub.rendition] = mjpeg_renditions.RenditionWorker(sub.rendition, self._on_rendered)
+            latest = self._rendered.get(sub.rendition)
+        # 新观众立即拿到最近一帧，无需等待下一帧到达
+        if self.connected and latest is not None:
+            sub.offer(latest)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(), name=f"mjpeg-hub-{self.source}")
+
+    def _remove(self, sub: MjpegSubscriber) -> int:
+        with contextlib.suppress(ValueError):
+            self._subscribers.remove(sub)
+        sub.close()
+        name = sub.rendition
+        if name in self._workers and not any(s.rendition == name for s in self._subscribers):
+            self._workers.pop(name).close()
+            self._rendered.pop(name, None)
+        return len(self._subscribers)
+
+    async def wait_ready(self, timeout: float = READY_TIMEOUT) -> bool:
+        """等待上游连上；连上返回 True，开始等待后又有一次连接尝试失败或超时返回 False。
+
+        退避期间加入的观众不会因为上一次失败立即拿到 False，而是等下一次重连的结果。
+        """
+        failed = self._failed_attempts
+        deadline = time.monotonic() + timeout
+        while not self.connected:
+            if self._failed_attempts > failed:
+                return False
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining <= 0:
+                    raise asyncio.TimeoutError
+                await asyncio.wait_for(self._attempt_done.wait(), timeout=remaining)
+            except asyncio.TimeoutError:
+                if not self.error:
+                    self.error = f"timed out after {timeout:.0f}s"
+                return False
+        return True
+
+    def _notify_attempt(self) -> None:
+        self._attempt_done.set()
+        self._attempt_done = asyncio.Event()
+
+    def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        for sub in self._subscribers:
+            sub.close()
+        self._subscribers.clear()
+        for worker in self._workers.values():
+            worker.close()
+        self._workers.clear()
+        self._rendered.clear()
+        if self.recorder is not None:
+            self.recorder.close()
+        self.connected = False
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "source": self.source,
+            "udid": self.udid,
+            "url": self.url,
+            "connected": self.connected,
+            "error": self.error,
+            "frames": self._seq,
+            "stats": self.stats.snapshot(),
+            "renditions": {name: worker.snapshot() for name, worker in self._workers.items()},
+            "recorder": self.recorder.snapshot() if self.recorder is not None else None,
+            "viewers": [sub.snapshot() for sub in self._subscribers],
+        }
+
+    async def _run(self) -> None:
+        client = await core.get_http_client()
+        backoff = _RECONNECT_BASE
+        while self._subscribers:
+            try:
+                upstream, endpoint = await open_upstream(client, self.source)
+                try:
+                    parser = MjpegFrameParser(endpoint.boundary)
+                    self.url = endpoint.url
+                    self.upstream_content_type = endpoint.content_type
+                    self.error = None
+                    self.stats.on_connected()
+                    self.connected = True
+                    self._notify_attempt()
+                    backoff = _RECONNECT_BASE
+                    core.logger.info(
+                        f"MJPEG hub connected: {endpoint.url} ctype={endpoint.content_type} "
+                        f"viewers={len(self._subscribers)}"
+                    )
+                    async for chunk in upstream.aiter_raw():
+                        self.stats.on_chunk(len(chunk))
+                        for data in parser.feed(chunk):
+                            self._publish(data)
+                finally:
+                    self.connected = False
+                    await upstream.aclose()
+                self.error = "upstream closed"
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                self.error = str(exc) or exc.__class__.__name__
+                self._failed_attempts += 1
+                self._notify_attempt()
+            if not self._subscribers:
+                break
+            core.logger.warning(
+                f"MJPEG hub upstream lost: {self.source} err={self.error}; reconnect in {backoff:.1f}s"
+            )
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, _RECONNECT_MAX)
+
+    def _publish(self, data: bytes) -> None:
+        self._seq += 1
+        self.stats.on_frame(len(data))
+        frame = MjpegFrame(self._seq, data, time.time())
+        self.latest = frame
+        if self._is_duplicate(data):
+            self.stats.duplicates += 1
+            return
+        # 重复帧不入环：导出时按固定帧率展开，静止画面的时长不会丢失
+        if self.recorder is not None:
+            self.recorder.append(data, frame.captured_at)
+        for sub in self._subscribers:
+            if sub.rendition == mjpeg_renditions.FULL:
+                sub.offer(frame)
+        for worker in self._workers.values():
+            worker.offer(frame)
+
+    def _is_duplicate(self, data: bytes) -> bool:
+        """相同 JPEG 字节（crc32 + 长度）在 keyframe 间隔内不重复转发。"""
+        if not _DEDUP_ENABLED:
+            return False
+        now = time.monotonic()
+        fingerprint = (zlib.crc32(data), len(data))
+        if fingerprint == self._last_fingerprint and now - self._last_forwarded_at < _DEDUP_KEYFRAME_INTERVAL:
+            return True
+        self._last_fingerprint = fingerprint
+        self._last_forwarded_at = now
+        return False
+
+    def _on_rendered(self, name: str, source: MjpegFrame, data: bytes) -> None:
+        frame = MjpegFrame(source.seq, data, source.captured_at)
+        self._rendered[name] = frame
+        for sub in self._subscribers:
+            if sub.rendition == name:
+                sub.offer(frame)
+
+
+_HUBS: Dict[str, MjpegHub] = {}
+
+
+def subscribe(
+    source: str,
+    client: Optional[str] = None,
+    udid: Optional[str] = None,
+    rendition: str = mjpeg_renditions.FULL,
+) -> Tuple[MjpegHub, MjpegSubscriber]:
+    """Attach a viewer to the hub for ``source``, creating the hub on first use."""
+    hub = _HUBS.get(source)
+    if hub is None:
+        hub = MjpegHub(source, udid=udid)
+        _HUBS[source] = hub
+    elif udid and not hub.udid:
+        hub.udid = udid
+    sub = MjpegSubscriber(client, rendition)
+    hub._add(sub)
+    return hub, sub
+
+
+def unsubscribe(hub: MjpegHub, sub: MjpegSubscriber) -> None:
+    """Detach a viewer; the last one out tears the upstream reader down."""
+    if hub._remove(sub) > 0:
+        return
+    if _HUBS.get(hub.source) is hub:
+        del _HUBS[hub.source]
+    hub.close()
+    core.logger.info(f"MJPEG hub closed: {hub.source}")
+
+
+async def iter_parts(sub: MjpegSubscriber) -> AsyncIterator[bytes]:
+    """按 multipart 分片输出帧，直到 hub 关闭。"""
+    yield _FRAME_DELIMITER
+    while True:
+        frame = await sub.next_frame()
+        if frame is None:
+            return
+        yield frame.part
+
+
+def latest_frame(source: str, max_age: float = SNAPSHOT_MAX_AGE) -> Optional[MjpegFrame]:
+    """Most recent frame of a running reader, or None when no fresh stream is live."""
+    hub = _HUBS.get(source)
+    if hub is None or not hub.connected:
+        return None
+    frame = hub.latest
+    if frame is None or time.time() - frame.captured_at > max_age:
+        return None
+    return frame
+
+
+async def grab_frame(
+    source: str,
+    timeout: float = READY_TIMEOUT,
+    udid: Optional[str] = None,
+) -> Optional[MjpegFrame]:
+    """Return a fresh frame, briefly attaching a reader if none is running."""
+    frame = latest_frame(source)
+    if frame is not None:
+        return frame
+    hub, sub = subscribe(source, client="snapshot", udid=udid)
+    try:
+        if not await hub.wait_ready(timeout):
+            return None
+        return await asyncio.wait_for(sub.next_frame(), timeout=timeout)
+    except asyncio.TimeoutError:
+        return None
+    finally:
+        unsubscribe(hub, sub)
+
+
+def find_hub(source: str) -> Optional[MjpegHub]:
+    return _HUBS.get(source)
+
+
+def list_hubs(udid: Optional[str] = None) -> List[Dict[str, Any]]:
+    hubs = _HUBS.values()
+    if udid:
+        hubs = [hub for hub in hubs if hub.udid == udid]
+    return [hub.snapshot() for hub in hubs]
+
+
+async def stop_all() -> None:
+    await mjpeg_recorder.cancel_all()
+    hubs = list(_HUBS.values())
+    _HUBS.clear()
+    for hub in hubs:
+        hub.close()
+    mjpeg_recorder.close_all()
+    mjpeg_renditions.shutdown()
@@ -0,0 +1,404 @@
+import asyncio
+import contextlib
+import mmap
+import os
+import tempfile
+import time
+import uuid
+from collections import deque
+from typing import Any, Deque, Dict, Iterator, List, Optional, Tuple
+
+import core
+
+
+# 每台设备保留最近 N 秒画面；内存区在创建时一次性映射，帧字节循环覆盖写入。
+# 只在该设备有观众（即 hub 在读上游）时录制，没人观看的设备不会被录制
+RECORD_ENABLED = os.environ.get("MJPEG_RECORD", "true").strip().lower() in {"1", "true", "yes", "y"}
+RECORD_SECONDS = float(os.environ.get("MJPEG_RECORD_SECONDS", "30"))
+RECORD_BYTES = int(os.environ.get("MJPEG_RECORD_BYTES", str(64 * 1024 * 1024)))
+# 最后一个观众离开后录制内容再保留的秒数，期间仍可导出片段；0 表示立即释放
+RECORD_RETAIN = max(0.0, float(os.environ.get("MJPEG_RECORD_RETAIN", "120")))
+CLIP_DIR = os.environ.get("MJPEG_CLIP_DIR") or os.path.join(tempfile.gettempdir(), "wda-clips")
+CLIP_FPS = float(os.environ.get("MJPEG_CLIP_FPS", "15"))
+_CLIP_KEEP = max(1, int(os.environ.get("MJPEG_CLIP_KEEP", "20")))
+CLIP_FORMATS = ("mjpeg", "mp4")
+
+# 导出时每批从环形区拷贝的字节数，批间让出事件循环，避免阻塞直播观众
+_COPY_BATCH_BYTES = 1024 * 1024
+
+
+class FrameRing:
+    """Bounded ring of recent JPEG frames in one preallocated anonymous mmap.
+
+    索引项为 (采集时间, 逻辑偏移, 长度)。逻辑偏移单调递增（含回绕时跳过的尾部空间），
+    物理位置为逻辑偏移对容量取模；写入新帧时淘汰被覆盖或超出时间窗口的最旧帧。
+    """
+
+    def __init__(self, capacity: int = RECORD_BYTES, seconds: float = RECORD_SECONDS) -> None:
+        self.capacity = capacity
+        self.seconds = seconds
+        self.frames_total = 0
+        self.oversized = 0
+        self._buf: Optional[mmap.mmap] = mmap.mmap(-1, capacity)
+        self._head = 0
+        self._entries: Deque[Tuple[float, int, int]] = deque()
+
+    @property
+    def closed(self) -> bool:
+        return self._buf is None
+
+    def append(self, data: bytes, captured_at: float) -> None:
+        buf = self._buf
+        size = len(data)
+        if buf is None:
+            return
+        if size > self.capacity:
+            self.oversized += 1
+            return
+        pos = self._head % self.capacity
+        if pos + size > self.capacity:
+            # 尾部放不下，整帧从区首写入；跳过的尾部计入逻辑偏移
+            self._head += self.capacity - pos
+            pos = 0
+        start = self._head
+        entries = self._entries
+        # 新帧覆盖 [start, start+size)，对应一圈之前的数据
+        while entries and entries[0][1] < start + size - self.capacity:
+            entries.popleft()
+        buf[pos:pos + size] = data
+        self._head = start + size
+        entries.append((captured_at, start, size))
+        self.frames_total += 1
+        cutoff = captured_at - self.seconds
+        while entries and entries[0][0] < cutoff:
+            entries.popleft()
+
+    def span(self) -> Optional[Tuple[float, float]]:
+        if not self._entries:
+            return None
+        return self._entries[0][0], self._entries[-1][0]
+
+    async def copy_window(self, start: float, end: float) -> List[Tuple[float, bytes]]:
+        """Copy frames captured within [start, end], plus the frame shown at ``start``.
+
+        拷贝分批进行并在批间让出事件循环；批间可能有新帧写入，已被覆盖的帧直接跳过。
+        """
+        selected = [e for e in self._entries if e[0] <= end]
+        # 窗口起点之前的最后一帧即起点时刻屏幕上的画面
+        first = 0
+        for i, entry in enumerate(selected):
+            if entry[0] > start:
+                break
+            first = i
+        selected = selected[first:]
+        out: List[Tuple[float, bytes]] = []
+        copied = 0
+        for captured_at, offset, size in selected:
+            buf = self._buf
+            if buf is None:
+                raise RuntimeError("recorder closed")
+            entries = self._entries
+            if not entries or offset < entries[0][1]:
+                continue
+            pos = offset % self.capacity
+            out.append((captured_at, buf[pos:pos + size]))
+            copied += size
+            if copied >= _COPY_BATCH_BYTES:
+                copied = 0
+                await asyncio.sleep(0)
+        return out
+
+    def close(self) -> None:
+        buf, self._buf = self._buf, None
+        self._entries.clear()
+        if buf is not None:
+            buf.close()
+
+    def snapshot(self) -> Dict[str, Any]:
+        span = self.span()
+        stored = sum(e[2] for e in self._entries)
+        return {
+            "capacityBytes": self.capacity,
+            "windowSec": self.seconds,
+            "frames": len(self._entries),
+            "bytes": stored,
+            "framesTotal": self.frames_total,
+            "oversized": self.oversized,
+            "from": span[0] if span else None,
+            "to": span[1] if span else None,
+        }
+
+
+class _SharedRing:
+    __slots__ = ("key", "ring", "leases", "expiry")
+
+    def __init__(self, key: str) -> None:
+        self.key = key
+        self.ring = FrameRing()
+        # 第一个租约为写入方；同一设备的多个 hub 共用一个环，只有一路写入，避免重复帧
+        self.leases: List["RingLease"] = []
+        self.expiry: Optional[asyncio.TimerHandle] = None
+
+
+class RingLease:
+    """A hub's handle on its device's shared FrameRing."""
+
+    __slots__ = ("_shared",)
+
+    def __init__(self, shared: _SharedRing) -> None:
+        self._shared: Optional[_SharedRing] = shared
+
+    @property
+    def writer(self) -> bool:
+        shared = self._shared
+        return shared is not None and bool(shared.leases) and shared.leases[0] is self
+
+    def append(self, data: bytes, captured_at: float) -> None:
+        if self.writer:
+            self._shared.ring.append(data, captured_at)
+
+    def close(self) -> None:
+        shared, self._shared = self._shared, None
+        if shared is None:
+            return
+        with contextlib.suppress(ValueError):
+            shared.leases.remove(self)
+        if shared.leases:
+            return
+        if RECORD_RETAIN <= 0:
+            _drop(shared)
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            _drop(shared)
+            return
+        shared.expiry = loop.call_later(RECORD_RETAIN, _drop, shared)
+
+    def snapshot(self) -> Dict[str, Any]:
+        shared = self._shared
+        if shared is None:
+            return {}
+        return {**shared.ring.snapshot(), "key": shared.key, "writer": self.writer}
+
+
+_RINGS: Dict[str, _SharedRing] = {}
+
+
+def lease(key: str) -> RingLease:
+    """Attach to the ring of ``key`` (udid, or the source URL without one), creating it if needed."""
+    shared = _RINGS.get(key)
+    if shared is None:
+        shared = _RINGS[key] = _SharedRing(key)
+    if shared.expiry is not None:
+        shared.expiry.cancel()
+        shared.expiry = None
+    handle = RingLease(shared)
+    shared.leases.append(handle)
+    return handle
+
+
+def find_ring(key: str) -> Optional[FrameRing]:
+    """Ring of ``key`` while it is recording or still retained after the last viewer left."""
+    shared = _RINGS.get(key)
+    return shared.ring if shared is not None else None
+
+
+def _drop(shared: _SharedRing) -> None:
+    if shared.leases:
+        return
+    if _RINGS.get(shared.key) is shared:
+        del _RINGS[shared.key]
+    shared.ring.close()
+
+
+def close_all() -> None:
+    rings = list(_RINGS.values())
+    _RINGS.clear()
+    for shared in rings:
+        if shared.expiry is not None:
+            shared.expiry.cancel()
+        shared.ring.close()
+
+
+def _constant_rate(frames: List[Tuple[float, bytes]], start: float, end: float, fps: float) -> Iterator[bytes]:
+    """按固定帧率展开：每个时间点输出当时屏幕上的帧，保留被去重/停滞的时长。"""
+    if not frames:
+        return
+    count = max(1, int((end - start) * fps))
+    idx = 0
+    for i in range(count):
+        t = start + i / fps
+        while idx + 1 < len(frames) and frames[idx + 1][0] <= t:
+            idx += 1
+        yield frames[idx][1]
+
+
+class ClipJob:
+    """One background export of a recorder window to a file."""
+
+    def __init__(self, udid: Optional[str], source: str, fmt: str, start: float, end: float, fps: float) -> None:
+        self.id = uuid.uuid4().hex[:12]
+        self.udid = udid
+        self.source = source
+        self.format = fmt
+        self.start = start
+        self.end = end
+        self.fps = fps
+        self.status = "pending"
+        self.error: Optional[str] = None
+        self.frames = 0
+        self.bytes = 0
+        self.path = os.path.join(CLIP_DIR, f"{udid or 'stream'}-{int(start)}-{self.id}.{fmt}")
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.task: Optional[asyncio.Task] = None
+
+    @property
+    def media_type(self) -> str:
+        return "video/mp4" if self.format == "mp4" else "video/x-motion-jpeg"
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "udid": self.udid,
+            "format": self.format,
+            "status": self.status,
+            "error": self.error,
+            "start": self.start,
+            "end": self.end,
+            "fps": self.fps,
+            "frames": self.frames,
+            "bytes": self.bytes,
+            "file": os.path.basename(self.path),
+            "createdAt": self.created_at,
+            "finishedAt": self.finished_at,
+        }
+
+
+_CLIPS: Dict[str, ClipJob] = {}
+
+
+def get_clip(clip_id: str) -> Optional[ClipJob]:
+    return _CLIPS.get(clip_id)
+
+
+def list_clips() -> List[Dict[str, Any]]:
+    return [job.snapshot() for job in _CLIPS.values()]
+
+
+def start_clip(
+    ring: FrameRing,
+    source: str,
+    udid: Optional[str],
+    start: float,
+    end: float,
+    fmt: str = "mjpeg",
+    fps: float = CLIP_FPS,
+) -> ClipJob:
+    """Schedule an export of [start, end] from ``ring``; the returned job is updated in place."""
+    job = ClipJob(udid, source, fmt, start, end, fps)
+    _CLIPS[job.id] = job
+    _prune()
+    job.task = asyncio.create_task(_export(ring, job), name=f"mjpeg-clip-{job.id}")
+    return job
+
+
+def _prune() -> None:
+    finished = [job for job in _CLIPS.values() if job.status in ("done", "failed")]
+    excess = len(_CLIPS) - _CLIP_KEEP
+    for job in finished[:max(0, excess)]:
+        _CLIPS.pop(job.id, None)
+        with contextlib.suppress(OSError):
+            os.remove(job.path)
+
+
+async def _export(ring: FrameRing, job: ClipJob) -> None:
+    job.status = "running"
+    try:
+        frames = await ring.copy_window(job.start, job.end)
+        if not frames:
+            raise RuntimeError("no recorded frames in the requested window")
+        os.makedirs(CLIP_DIR, exist_ok=True)
+        if job.format == "mp4":
+            await _write_mp4(job, frames)
+        else:
+            await asyncio.to_thread(_write_mjpeg, job, frames)
+        job.bytes = os.path.getsize(job.path)
+        job.status = "done"
+        core.logger.info(
+            f"MJPEG clip exported: {job.path} frames={job.frames} bytes={job.bytes} "
+            f"window={job.end - job.start:.1f}s"
+        )
+    except asyncio.CancelledError:
+        job.status = "failed"
+        job.error = "cancelled"
+        raise
+    except Exception as exc:
+        job.status = "failed"
+        job.error = str(exc) or exc.__class__.__name__
+        core.logger.warning(f"MJPEG clip export failed: id={job.id} err={job.error}")
+        with contextlib.suppress(OSError):
+            os.remove(job.path)
+    finally:
+        job.finished_at = time.time()
+
+
+def _write_mjpeg(job: ClipJob, frames: List[Tuple[float, bytes]]) -> None:
+    # 原始 MJPEG（JPEG 直接拼接），ffplay/VLC 可按 -framerate 播放
+    with open(job.path, "wb") as fh:
+        for data in _constant_rate(frames, job.start, job.end, job.fps):
+            fh.write(data)
+            job.frames += 1
+
+
+async def _write_mp4(job: ClipJob, frames: List[Tuple[float, bytes]]) -> None:
+    cmd = [
+        core.FFMPEG_BIN,
+        "-hide_banner",
+        "-loglevel", "error",
+        "-y",
+        "-f", "mjpeg",
+        "-framerate", f"{job.fps:g}",
+        "-i", "pipe:0",
+        "-vf", "scale=trunc(iw/2)*2:trunc(ih/2)*2",
+        "-c:v", "libx264",
+        "-preset", "veryfast",
+        "-pix_fmt", "yuv420p",
+        "-movflags", "+faststart",
+        job.path,
+    ]
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE,
+        )
+    except FileNotFoundError:
+        raise RuntimeError(f"ffmpeg not found: {core.FFMPEG_BIN}")
+    stderr_task = asyncio.create_task(proc.stderr.read())
+    try:
+        for data in _constant_rate(frames, job.start, job.end, job.fps):
+            proc.stdin.write(data)
+            await proc.stdin.drain()
+            job.frames += 1
+        proc.stdin.close()
+        rc = await proc.wait()
+    except BaseException:
+        with contextlib.suppress(ProcessLookupError):
+            proc.kill()
+        raise
+    finally:
+        err = await stderr_task
+    if rc != 0:
+        raise RuntimeError(f"ffmpeg exited with {rc}: {err.decode(errors='replace').strip()[-300:]}")
+
+
+async def cancel_all() -> None:
+    tasks = [job.task for job in _CLIPS.values() if job.task is not None and not job.task.done()]
+    for task in tasks:
+        task.cancel()
+    for task in tasks:
+        with contextlib.suppress(asyncio.CancelledError, Exception):
+            await task
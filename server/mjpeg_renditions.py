@@ -0,0 +1,121 @@
+import asyncio
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from PIL import Image
+
+# 转码在子进程中执行，这里不导入 core，避免子进程重复探测网络等初始化
+logger = logging.getLogger("wda.web")
+
+
+FULL = "full"
+
+# 渲染档位：(缩放比例, 最大宽度, JPEG 质量)；0 表示不限制
+RENDITIONS: Dict[str, Tuple[float, int, int]] = {
+    "half": (0.5, 0, int(os.environ.get("MJPEG_HALF_QUALITY", "70"))),
+    "thumb": (1.0, int(os.environ.get("MJPEG_THUMB_WIDTH", "240")), int(os.environ.get("MJPEG_THUMB_QUALITY", "60"))),
+}
+
+_WORKERS = max(1, int(os.environ.get("MJPEG_TRANSCODE_WORKERS", str(min(4, os.cpu_count() or 1)))))
+
+_POOL: Optional[ProcessPoolExecutor] = None
+
+
+def names() -> Tuple[str, ...]:
+    return (FULL, *RENDITIONS.keys())
+
+
+def normalize(raw: Any) -> Optional[str]:
+    """Return a known rendition name (default full) or None when unknown."""
+    if raw is None or raw == "":
+        return FULL
+    name = str(raw).strip().lower()
+    if name == FULL or name in RENDITIONS:
+        return name
+    return None
+
+
+def transcode(data: bytes, scale: float, max_width: int, quality: int) -> bytes:
+    """Downscale and re-encode one JPEG; runs inside the process pool."""
+    with Image.open(BytesIO(data)) as img:
+        w, h = img.size
+        target_w = max(1, int(w * scale))
+        if max_width and target_w > max_width:
+            target_w = max_width
+        target_h = max(1, round(h * target_w / w))
+        # 借助 JPEG DCT 缩放只解码到接近目标的尺寸，省掉大部分解码开销
+        img.draft("RGB", (target_w, target_h))
+        out = img.convert("RGB")
+        if out.size != (target_w, target_h):
+            out = out.resize((target_w, target_h), Image.BILINEAR)
+        buf = BytesIO()
+        out.save(buf, "JPEG", quality=quality)
+        return buf.getvalue()
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _POOL
+    if _POOL is None:
+        _POOL = ProcessPoolExecutor(max_workers=_WORKERS)
+    return _POOL
+
+
+def shutdown() -> None:
+    global _POOL
+    pool, _POOL = _POOL, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+class RenditionWorker:
+    """Transcodes a hub's frames into one rendition, once per frame for all its viewers.
+
+    与观众信箱相同采用单槽：转码跟不上源帧率时跳过中间帧，只处理最新一帧。
+    """
+
+    def __init__(self, name: str, on_rendered: Callable[[str, Any, bytes], None]) -> None:
+        self.name = name
+        self.rendered = 0
+        self.skipped = 0
+        self._spec = RENDITIONS[name]
+        self._on_rendered = on_rendered
+        self._pending: Any = None
+        self._event = asyncio.Event()
+        self._task = asyncio.create_task(self._run(), name=f"mjpeg-rendition-{name}")
+
+    def offer(self, frame: Any) -> None:
+        if self._pending is not None:
+            self.skipped += 1
+        self._pending = frame
+        self._event.set()
+
+    def close(self) -> None:
+        self._task.cancel()
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {"rendered": self.rendered, "skipped": self.skipped}
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        scale, max_width, quality = self._spec
+        while True:
+            await self._event.wait()
+            self._event.clear()
+            frame, self._pending = self._pending, None
+            if frame is None:
+                continue
+            try:
+                data = await loop.run_in_executor(_get_pool(), transcode, frame.data, scale, max_width, quality)
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                if isinstance(exc, BrokenProcessPool):
+                    shutdown()
+                logger.warning(f"MJPEG rendition {self.name} failed for frame {frame.seq}: {exc}")
+                continue
+            self.rendered += 1
+            self._on_rendered(self.name, frame, data)
@@ -0,0 +1,146 @@
+import os
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+
+# 统计窗口（秒）：fps、码率、帧大小分布与抖动都基于最近这段时间
+STATS_WINDOW = float(os.environ.get("MJPEG_STATS_WINDOW", "10"))
+# 超过该秒数没有新帧即视为上游停滞
+STALL_SECONDS = float(os.environ.get("MJPEG_STALL_SECONDS", "3"))
+
+
+def _percentile(sorted_vals: List[int], pct: float) -> int:
+    if not sorted_vals:
+        return 0
+    idx = min(len(sorted_vals) - 1, int(round(pct / 100.0 * (len(sorted_vals) - 1))))
+    return sorted_vals[idx]
+
+
+class UpstreamStats:
+    """Rolling counters for one MJPEG upstream reader."""
+
+    def __init__(self, window: float = STATS_WINDOW) -> None:
+        self.window = window
+        self.started_at = time.time()
+        self._started_mono = time.monotonic()
+        self.frames_total = 0
+        self.bytes_in_total = 0
+        self.bytes_out_total = 0
+        self.connects = 0
+        self.reconnects = 0
+        self.duplicates = 0
+        self.last_frame_at: Optional[float] = None
+        # (monotonic 时间, 帧字节数)
+        self._frames: Deque[Tuple[float, int]] = deque()
+        # (monotonic 时间, 读取字节数)
+        self._chunks: Deque[Tuple[float, int]] = deque()
+
+    def on_connected(self) -> None:
+        # 只有成功连上过之后的再次连接才算重连；首连失败后的成功不计入
+        if self.connects:
+            self.reconnects += 1
+        self.connects += 1
+
+    def on_chunk(self, size: int) -> None:
+        now = time.monotonic()
+        self.bytes_in_total += size
+        self._chunks.append((now, size))
+        self._trim(self._chunks, now)
+
+    def on_frame(self, size: int) -> None:
+        now = time.monotonic()
+        self.frames_total += 1
+        self.last_frame_at = time.time()
+        self._frames.append((now, size))
+        self._trim(self._frames, now)
+
+    def on_bytes_out(self, size: int) -> None:
+        self.bytes_out_total += size
+
+    def _trim(self, items: Deque[Tuple[float, int]], now: float) -> None:
+        cutoff = now - self.window
+        while items and items[0][0] < cutoff:
+            items.popleft()
+
+    def snapshot(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        self._trim(self._frames, now)
+        self._trim(self._chunks, now)
+        frames = list(self._frames)
+        # 刚启动时窗口未满，按实际运行时长计算速率
+        span = max(1e-3, min(self.window, now - self._started_mono))
+        sizes = sorted(size for _, size in frames)
+        intervals = [(b[0] - a[0]) * 1000.0 for a, b in zip(frames, frames[1:])]
+        if intervals:
+            mean_iv = sum(intervals) / len(intervals)
+            jitter = (sum((iv - mean_iv) ** 2 for iv in intervals) / len(intervals)) ** 0.5
+        else:
+            mean_iv = 0.0
+            jitter = 0.0
+        last_age = time.time() - self.last_frame_at if self.last_frame_at else None
+        return {
+            "windowSec": self.window,
+            "fps": round(len(frames) / span, 2) if frames else 0.0,
+            "bytesInPerSec": round(sum(size for _, size in self._chunks) / span, 1),
+            "bytesInTotal": self.bytes_in_total,
+            "bytesOutTotal": self.bytes_out_total,
+            "framesTotal": self.frames_total,
+            "frameBytes": {
+                "min": sizes[0] if sizes else 0,
+                "p50": _percentile(sizes, 50),
+                "p90": _percentile(sizes, 90),
+                "p99": _percentile(sizes, 99),
+                "max": sizes[-1] if sizes else 0,
+                "avg": round(sum(sizes) / len(sizes), 1) if sizes else 0,
+            },
+            "intervalMs": {
+                "avg": round(mean_iv, 2),
+                "max": round(max(intervals), 2) if intervals else 0.0,
+                "jitter": round(jitter, 2),
+            },
+            "lastFrameAgeMs": round(last_age * 1000.0, 1) if last_age is not None else None,
+            "stalled": last_age is None or last_age > STALL_SECONDS,
+            "reconnects": self.reconnects,
+            "duplicatesSuppressed": self.duplicates,
+            "uptimeSec": round(time.time() - self.started_at, 1),
+        }
+
+
+class ViewerStats:
+    """Per-subscriber delivery counters: bytes out and capture-to-delivery latency."""
+
+    __slots__ = ("bytes_out", "latency_ms", "latency_max_ms", "_out", "_started_mono")
+
+    def __init__(self) -> None:
+        self._started_mono = time.monotonic()
+        self.bytes_out = 0
+        self.latency_ms = 0.0
+        self.latency_max_ms = 0.0
+        self._out: Deque[Tuple[float, int]] = deque()
+
+    def on_delivered(self, size: int, captured_at: float) -> None:
+        now = time.monotonic()
+        self.bytes_out += size
+        self._out.append((now, size))
+        cutoff = now - STATS_WINDOW
+        while self._out and self._out[0][0] < cutoff:
+            self._out.popleft()
+        latency = max(0.0, (time.time() - captured_at) * 1000.0)
+        # 指数滑动平均，避免单帧抖动
+        self.latency_ms = latency if not self.latency_ms else self.latency_ms * 0.9 + latency * 0.1
+        self.latency_max_ms = max(self.latency_max_ms, latency)
+
+    def snapshot(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        cutoff = now - STATS_WINDOW
+        while self._out and self._out[0][0] < cutoff:
+            self._out.popleft()
+        span = max(1e-3, min(STATS_WINDOW, now - self._started_mono))
+        return {
+            "bytesOut": self.bytes_out,
+            "bytesOutPerSec": round(sum(size for _, size in self._out) / span, 1),
+            "fps": round(len(self._out) / span, 2),
+            "latencyMs": round(self.latency_ms, 2),
+            "latencyMaxMs": round(self.latency_max_ms, 2),
+        }
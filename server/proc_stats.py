@@ -0,0 +1,259 @@
+import asyncio
+import os
+import shutil
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Iterable, List, Optional, Tuple
+
+try:
+    import psutil  # type: ignore
+except ImportError:  # 可选依赖
+    psutil = None
+
+
+# 滚动平均窗口（秒）
+PROC_STATS_WINDOW = float(os.environ.get("PROC_STATS_WINDOW", "60"))
+_PS_BIN = shutil.which("ps")
+
+
+def _pick_backend() -> Optional[str]:
+    """proc（Linux）> psutil（已安装时）> ps（macOS 等，无 I/O 统计）；PROC_STATS_BACKEND 可强制指定。"""
+    available = {
+        "proc": os.path.isdir("/proc/self"),
+        "psutil": psutil is not None,
+        "ps": _PS_BIN is not None,
+    }
+    wanted = os.environ.get("PROC_STATS_BACKEND", "auto").strip().lower()
+    if wanted in available:
+        return wanted if available[wanted] else None
+    return next((name for name, ok in available.items() if ok), None)
+
+
+BACKEND = _pick_backend()
+SUPPORTED = BACKEND is not None
+
+_Reading = Tuple[float, int, Optional[int], Optional[int]]
+
+_CLK_TCK = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def read_process(pid: int) -> Optional[_Reading]:
+    """Return (cpu seconds, rss bytes, read bytes, write bytes) for ``pid`` from /proc.
+
+    进程已退出或平台不支持时返回 None；/proc/<pid>/io 不可读时 I/O 两项为 None。
+    """
+    if BACKEND != "proc":
+        return None
+    try:
+        with open(f"/proc/{pid}/stat", "rb") as fh:
+            stat = fh.read()
+        with open(f"/proc/{pid}/statm", "rb") as fh:
+            statm = fh.read().split()
+    except (FileNotFoundError, ProcessLookupError, PermissionError):
+        return None
+    # comm 可能含空格和括号，从最后一个 ')' 之后开始按空格切分；utime/stime 为第 14/15 字段
+    fields = stat[stat.rfind(b")") + 2:].split()
+    cpu = (int(fields[11]) + int(fields[12])) / _CLK_TCK
+    rss = int(statm[1]) * _PAGE_SIZE
+    read_bytes: Optional[int] = None
+    write_bytes: Optional[int] = None
+    try:
+        with open(f"/proc/{pid}/io", "rb") as fh:
+            for line in fh:
+                key, _, value = line.partition(b":")
+                if key == b"read_bytes":
+                    read_bytes = int(value)
+                elif key == b"write_bytes":
+                    write_bytes = int(value)
+    except OSError:
+        pass
+    return cpu, rss, read_bytes, write_bytes
+
+
+def _read_psutil(pid: int) -> Optional[_Reading]:
+    try:
+        proc = psutil.Process(pid)
+        with proc.oneshot():
+            times = proc.cpu_times()
+            rss = proc.memory_info().rss
+            try:
+                io = proc.io_counters()  # macOS 不提供
+                read_bytes, write_bytes = io.read_bytes, io.write_bytes
+            except (AttributeError, psutil.AccessDenied):
+                read_bytes = write_bytes = None
+    except (psutil.NoSuchProcess, psutil.ZombieProcess, psutil.AccessDenied):
+        return None
+    return times.user + times.system, rss, read_bytes, write_bytes
+
+
+def _parse_ps_time(raw: str) -> float:
+    # [[dd-]hh:]mm:ss[.cc]（macOS 带小数，Linux procps 不带）
+    days = 0
+    if "-" in raw:
+        head, raw = raw.split("-", 1)
+        days = int(head)
+    seconds = 0.0
+    for part in raw.split(":"):
+        seconds = seconds * 60 + float(part)
+    return days * 86400 + seconds
+
+
+async def _read_ps(pids: List[int]) -> Dict[int, _Reading]:
+    # 一次 ps 调用覆盖本轮全部进程；异步子进程不阻塞事件循环
+    proc = await asyncio.create_subprocess_exec(
+        _PS_BIN,
+        "-o",
+        "pid=,rss=,time=",
+        "-p",
+        ",".join(str(pid) for pid in pids),
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.DEVNULL,
+    )
+    out, _ = await proc.communicate()
+    readings: Dict[int, _Reading] = {}
+    for line in out.decode(errors="replace").splitlines():
+        fields = line.split()
+        if len(fields) != 3:
+            continue
+        try:
+            # ps 的 rss 单位为 KiB
+            readings[int(fields[0])] = (_parse_ps_time(fields[2]), int(fields[1]) * 1024, None, None)
+        except ValueError:
+            continue
+    return readings
+
+
+async def read_processes(pids: Iterable[int]) -> Dict[int, _Reading]:
+    """Readings for several pids with the active backend; exited processes are absent."""
+    pids = list(pids)
+    if not pids or BACKEND is None:
+        return {}
+    if BACKEND == "ps":
+        return await _read_ps(pids)
+    reader = read_process if BACKEND == "proc" else _read_psutil
+    readings: Dict[int, _Reading] = {}
+    for pid in pids:
+        reading = reader(pid)
+        if reading is not None:
+            readings[pid] = reading
+    return readings
+
+
+class ProcessUsage:
+    """Rolling CPU / RSS / I/O rates for one child process."""
+
+    __slots__ = ("pid", "role", "window", "cpu_pct", "rss", "read_bps", "write_bps", "_last", "_samples")
+
+    def __init__(self, pid: int, role: str, window: float = PROC_STATS_WINDOW) -> None:
+        self.pid = pid
+        self.role = role
+        self.window = window
+        self.cpu_pct = 0.0
+        self.rss = 0
+        self.read_bps: Optional[float] = None
+        self.write_bps: Optional[float] = None
+        # (monotonic 时间, cpu 秒, read, write)
+        self._last: Optional[Tuple[float, float, Optional[int], Optional[int]]] = None
+        # (monotonic 时间, cpu%, rss)
+        self._samples: Deque[Tuple[float, float, int]] = deque()
+
+    def sample(self, reading: _Reading) -> None:
+        cpu, rss, read_bytes, write_bytes = reading
+        now = time.monotonic()
+        self.rss = rss
+        last = self._last
+        self._last = (now, cpu, read_bytes, write_bytes)
+        if last is None:
+            # 首次采样只建立基线
+            return
+        elapsed = max(1e-3, now - last[0])
+        self.cpu_pct = max(0.0, (cpu - last[1]) / elapsed * 100.0)
+        self.read_bps = (read_bytes - last[2]) / elapsed if read_bytes is not None and last[2] is not None else None
+        self.write_bps = (write_bytes - last[3]) / elapsed if write_bytes is not None and last[3] is not None else None
+        self._samples.append((now, self.cpu_pct, rss))
+        cutoff = now - self.window
+        while self._samples and self._samples[0][0] < cutoff:
+            self._samples.popleft()
+
+    @property
+    def samples(self) -> int:
+        return len(self._samples)
+
+    @property
+    def cpu_avg(self) -> float:
+        if not self._samples:
+            return 0.0
+        return sum(item[1] for item in self._samples) / len(self._samples)
+
+    @property
+    def rss_avg(self) -> float:
+        if not self._samples:
+            return float(self.rss)
+        return sum(item[2] for item in self._samples) / len(self._samples)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "pid": self.pid,
+            "role": self.role,
+            "cpuPct": round(self.cpu_pct, 1),
+            "cpuAvgPct": round(self.cpu_avg, 1),
+            "rssBytes": self.rss,
+            "rssAvgBytes": int(self.rss_avg),
+            "readBytesPerSec": round(self.read_bps, 1) if self.read_bps is not None else None,
+            "writeBytesPerSec": round(self.write_bps, 1) if self.write_bps is not None else None,
+            "samples": self.samples,
+        }
+
+
+class ResourceMonitor:
+    """Per-stream set of ProcessUsage keyed by pid; processes that exit are dropped."""
+
+    def __init__(self, window: float = PROC_STATS_WINDOW) -> None:
+        self.window = window
+        self.sampled_at: Optional[float] = None
+        self._procs: Dict[int, ProcessUsage] = {}
+
+    async def sample(self, processes: Iterable[Tuple[int, str]]) -> None:
+        roles = dict(processes)
+        readings = await read_processes(roles)
+        alive: Dict[int, ProcessUsage] = {}
+        for pid, reading in readings.items():
+            usage = self._procs.get(pid) or ProcessUsage(pid, roles[pid], self.window)
+            usage.sample(reading)
+            alive[pid] = usage
+        self._procs = alive
+        self.sampled_at = time.time()
+
+    def reset(self) -> None:
+        self._procs = {}
+        self.sampled_at = None
+
+    @property
+    def samples(self) -> int:
+        """Smallest sample count across tracked processes (how full the window is)."""
+        return min((usage.samples for usage in self._procs.values()), default=0)
+
+    @property
+    def cpu_avg(self) -> float:
+        return sum(usage.cpu_avg for usage in self._procs.values())
+
+    @property
+    def rss_avg(self) -> float:
+        return sum(usage.rss_avg for usage in self._procs.values())
+
+    def snapshot(self) -> Dict[str, Any]:
+        if not SUPPORTED:
+            return {"supported": False}
+        procs = list(self._procs.values())
+        return {
+            "supported": True,
+            "backend": BACKEND,
+            "windowSec": self.window,
+            "sampledAt": self.sampled_at,
+            "cpuPct": round(sum(usage.cpu_pct for usage in procs), 1),
+            "cpuAvgPct": round(self.cpu_avg, 1),
+            "rssBytes": sum(usage.rss for usage in procs),
+            "rssAvgBytes": int(self.rss_avg),
+            "processes": [usage.snapshot() for usage in procs],
+        }
@@ -1,6 +1,7 @@
 import asyncio
 import os
-from typing import Any, Dict, Optional
+import time
+from typing import Any, Dict, List, Optional, Tuple
 from fastapi import APIRouter
 from fastapi.responses import JSONResponse
 from fastapi.encoders import jsonable_encoder
@@ -9,6 +10,7 @@ import core
 import appium_driver as ad
 import httpx
 import stream_pusher
+import webdriver_client as wd
 
 router = APIRouter()
 
@@ -19,11 +21,15 @@ async def _restart_stream_async(
     session_id: str,
     base_url: str,
     mjpeg_port: int,
+    preset: Optional[str] = None,
+    ladder: Optional[Any] = None,
+    output: Optional[str] = None,
 ) -> None:
     core.logger.info(
-        "Starting stream push for udid=%s sid=%s",
+        "Starting stream push for udid=%s sid=%s preset=%s",
         udid,
         session_id,
+        preset,
     )
     try:
         push_error = await stream_pusher.start_stream(
@@ -32,6 +38,9 @@ async def _restart_stream_async(
             base_url,
             mjpeg_port,
             mode="idb",
+            preset=preset,
+            ladder=ladder,
+            output=output,
         )
         if push_error:
             core.logger.error(
@@ -58,6 +67,22 @@ def _parse_float_env(name: str, default: float) -> float:
         return default
 
 
+def _session_gone(sid: str, error: str, **extra: Any) -> JSONResponse:
+    # 会话失效：统一返回 410，前端据此重建会话
+    return JSONResponse(
+        {
+            "code": "SESSION_GONE",
+            "message": "Appium 会话已失效，请重建会话后重试",
+            "sessionId": sid,
+            "recoverable": True,
+            "action": "RECREATE_SESSION",
+            "error": error,
+            **extra,
+        },
+        status_code=410,
+    )
+
+
 @router.post("/api/appium/settings")
 async def api_appium_set(payload: Dict[str, Any]):
     base = core.APPIUM_BASE
@@ -75,17 +100,7 @@ async def api_appium_set(payload: Dict[str, Any]):
         core.logger.warning(
             f"appium settings POST invalid-session: base={base} sid={sid}"
         )
-        return JSONResponse(
-            {
-                "code": "SESSION_GONE",
-                "message": "Appium 会话已失效，请重建会话后重试",
-                "sessionId": sid,
-                "recoverable": True,
-                "action": "RECREATE_SESSION",
-                "error": str(e),
-            },
-            status_code=410,
-        )
+        return _session_gone(sid, str(e))
     except Exception as e:
         core.logger.exception(
             f"appium settings POST failed: base={base} sid={sid} settings_keys={list(settings.keys())}"
@@ -108,17 +123,7 @@ async def api_appium_get(sessionId: Optional[str] = None):
         core.logger.warning(
             f"appium settings GET invalid-session: base={base} sid={sid}"
         )
-        return JSONResponse(
-            {
-                "code": "SESSION_GONE",
-                "message": "Appium 会话已失效，请重建会话后重试",
-                "sessionId": sid,
-                "recoverable": True,
-                "action": "RECREATE_SESSION",
-                "error": str(e),
-            },
-            status_code=410,
-        )
+        return _session_gone(sid, str(e))
     except Exception as e:
         core.logger.exception(f"appium settings GET failed: base={base} sid={sid}")
         return JSONResponse({"error": str(e)}, status_code=502)
@@ -130,17 +135,28 @@ async def api_appium_sessions():
     return {"sessions": ad.list_sessions(base)}
 
 
-PRESET_CHOICES = ("1080p", "720p", "480p", "360p")
-DEFAULT_PRESET = "720p"
+@router.delete("/api/appium/sessions/{sid}")
+async def api_appium_delete_session(sid: str):
+    base = core.APPIUM_BASE
+    if ad.get_session(base, sid) is None:
+        return JSONResponse({"error": "unknown session", "sessionId": sid}, status_code=404)
+    try:
+        await ad.delete_session(base, sid)
+    except ad.AppiumInvalidSession:
+        # 上游已不存在，本地缓存已清理，按删除成功处理
+        pass
+    except Exception as e:
+        core.logger.exception(f"appium delete-session failed: base={base} sid={sid}")
+        return JSONResponse({"error": str(e)}, status_code=502)
+    return {"sessionId": sid, "deleted": True}
+
+
+PRESET_CHOICES = tuple(stream_pusher.VIDEO_PRESETS)
+DEFAULT_PRESET = stream_pusher.DEFAULT_PRESET
 
 
 def _normalize_preset(raw: Any) -> str:
-    if not raw:
-        return DEFAULT_PRESET
-    preset = str(raw).strip()
-    if preset in PRESET_CHOICES:
-        return preset
-    return DEFAULT_PRESET
+    return stream_pusher.normalize_preset(raw)
 
 
 @router.post("/api/appium/create")
@@ -154,6 +170,10 @@ async def api_appium_create(payload: Dict[str, Any]):
     no_reset = payload.get("noReset")
     new_cmd_to = payload.get("newCommandTimeout", 0)
     rtmp_stream_preset = _normalize_preset(payload.get("rtmpStreamVideoPreset"))
+    # 可选：额外推送的低码率档位，如 ["360p"]；省略时按 STREAM_PUSH_LADDER
+    rtmp_stream_ladder = payload.get("rtmpStreamLadder")
+    # 可选：rtmp | hls | both，省略时按 STREAM_PUSH_OUTPUT
+    rtmp_stream_output = payload.get("rtmpStreamOutput")
     if not udid:
         return JSONResponse({"error": "udid is required"}, status_code=400)
     # 基础能力（按推荐默认值；旧项保留为注释便于回滚/对照）
@@ -237,6 +257,9 @@ async def api_appium_create(payload: Dict[str, Any]):
                 session_id="bf033ded-3221-4fbe-af3c-67e1fd260aaa",
                 base_url=base,
                 mjpeg_port=mjpeg_port,
+                preset=rtmp_stream_preset,
+                ladder=rtmp_stream_ladder,
+                output=rtmp_stream_output,
             )
         )
         core.logger.info(caps)
@@ -254,7 +277,7 @@ async def api_appium_last_session():
     sid = core.APPIUM_LATEST.get(base)
     if not sid:
         return {"sessionId": None, "ok": False}
-    if ad.get_driver(base, sid) is not None:
+    if ad.get_session(base, sid) is not None:
         return {"sessionId": sid, "ok": True}
     try:
         del core.APPIUM_LATEST[base]
@@ -284,6 +307,18 @@ async def api_appium_session_id(udid: Optional[str] = None):
     return {"sessionId": sid, "udid": udid_clean}
 
 
+_BAD_ARGS = object()
+
+
+def _mobile_args(args: Any) -> Any:
+    # mobile: 命令只接受一个参数对象；收到数组时仅取首个元素，非法类型返回 _BAD_ARGS
+    if isinstance(args, list):
+        return args[0] if args else {}
+    if isinstance(args, dict) or args is None:
+        return args or {}
+    return _BAD_ARGS
+
+
 @router.post("/api/appium/exec-mobile")
 async def api_appium_exec_mobile(payload: Dict[str, Any]):
     """代理执行 Appium 的 mobile: 命令。
@@ -302,21 +337,13 @@ async def api_appium_exec_mobile(payload: Dict[str, Any]):
         return JSONResponse(
             {"error": "sessionId and script are required"}, status_code=400
         )
-    if isinstance(args, list):
-        args_arr = args
-    elif isinstance(args, dict) or args is None:
-        args_arr = [args or {}]
-    else:
+    args_obj = _mobile_args(args)
+    if args_obj is _BAD_ARGS:
         return JSONResponse(
             {"error": "args must be an object or array"}, status_code=400
         )
 
     try:
-        # Appium Python Client通常接受dict作为 args；若收到数组，仅取首个元素作为参数对象
-        if isinstance(args_arr, list):
-            args_obj = args_arr[0] if args_arr else {}
-        else:
-            args_obj = args_arr
         res, new_sid = await ad.exec_mobile_with_auto_recreate(
             base, sid, script, args_obj
         )
@@ -332,17 +359,7 @@ async def api_appium_exec_mobile(payload: Dict[str, Any]):
         core.logger.warning(
             f"appium exec-mobile invalid-session: base={base} sid={sid} script={script}"
         )
-        return JSONResponse(
-            {
-                "code": "SESSION_GONE",
-                "message": "Appium 会话已失效，请重建会话后重试",
-                "sessionId": sid,
-                "recoverable": True,
-                "action": "RECREATE_SESSION",
-                "error": str(e),
-            },
-            status_code=410,
-        )
+        return _session_gone(sid, str(e))
     except Exception as e:
         core.logger.exception(
             f"appium exec-mobile failed: base={base} sid={sid} script={script}"
@@ -358,7 +375,8 @@ async def api_appium_actions(payload: Dict[str, Any]):
       "sessionId": "<APPIUM_SESSION_ID>",
       "actions": [ { ... } ]
     }
-    注：此端点直接调用 Appium /session/{sid}/actions HTTP 接口以避免客户端包装差异。
+    注：与同一会话的其它命令共用一条有序队列，保证手势与 exec-mobile 按提交顺序到达设备；
+    排队期间到达的同一指针分片会合并为一次调用，移动路径按 GESTURE_TOLERANCE_PX 简化。
     """
     base = core.APPIUM_BASE
     sid = payload.get("sessionId")
@@ -367,57 +385,118 @@ async def api_appium_actions(payload: Dict[str, Any]):
         return JSONResponse(
             {"error": "sessionId and actions are required"}, status_code=400
         )
-    url = f"{base}/session/{sid}/actions"
-    client = await core.get_http_client()
     try:
-        r = await client.post(url, json={"actions": actions}, timeout=30)
-        r.raise_for_status()
-        return r.json()
-    except httpx.HTTPError as e:
-        resp = getattr(e, "response", None)
-        body_text = getattr(resp, "text", "") if resp is not None else ""
-        # 检测会话失效关键词
-        invalid = False
-        text_l = (body_text or "").lower()
-        if (
-            "invalid session id" in text_l
-            or "a session is either terminated or not started" in text_l
-        ):
-            invalid = True
-        else:
-            # 尝试解析 JSON 以提高判断准确度
-            try:
-                js = resp.json() if resp is not None else None
-            except Exception:
-                js = None
-            if isinstance(js, dict):
-                val = js.get("value") if isinstance(js.get("value"), dict) else js
-                err = (val or {}).get("error") or (val or {}).get("message")
-                if isinstance(err, str) and (
-                    "invalid session id" in err.lower()
-                    or "invalidsessionid" in err.lower()
-                ):
-                    invalid = True
-        if invalid:
+        value = await ad.submit_actions(base, sid, actions)
+        return {"value": value}
+    except ad.AppiumInvalidSession as e:
+        core.logger.warning(f"appium actions invalid-session: base={base} sid={sid}")
+        return _session_gone(sid, str(e), body=str(getattr(e.__cause__, "message", "") or ""))
+    except (wd.WebDriverError, httpx.HTTPError) as e:
+        core.logger.exception(f"appium actions failed: base={base} sid={sid} err={e}")
+        return JSONResponse(
+            {"error": str(e), "body": getattr(e, "message", "")}, status_code=502
+        )
+
+
+@router.get("/api/appium/gestures")
+async def api_appium_gestures():
+    """手势合并统计：请求数/实际调用数、移动与动作条数及各自的削减比例。"""
+    return ad.gesture_stats()
+
+
+@router.get("/api/appium/queue")
+async def api_appium_queue():
+    """各会话排队深度及每种命令的排队/执行耗时（avg/p50/p99/max，毫秒）。"""
+    return ad.queue_stats()
+
+
+# 单个批次的步骤上限，避免一次请求长时间占住会话队列
+BATCH_MAX_STEPS = int(os.environ.get("APPIUM_BATCH_MAX_STEPS", "200"))
+
+
+def _parse_batch_steps(raw: Any) -> Tuple[Optional[List[Tuple[str, Any, Any]]], Optional[str]]:
+    """Validate batch steps into (kind, script, arg) tuples; kind is "script" or "actions"."""
+    if not isinstance(raw, list) or not raw:
+        return None, "steps must be a non-empty array"
+    if len(raw) > BATCH_MAX_STEPS:
+        return None, f"too many steps: {len(raw)} > {BATCH_MAX_STEPS}"
+    steps: List[Tuple[str, Any, Any]] = []
+    for index, step in enumerate(raw):
+        if not isinstance(step, dict):
+            return None, f"steps[{index}] must be an object"
+        if "actions" in step:
+            if not isinstance(step["actions"], list):
+                return None, f"steps[{index}].actions must be an array"
+            steps.append(("actions", None, step["actions"]))
+            continue
+        script = step.get("script")
+        if not isinstance(script, str) or not script.strip():
+            return None, f"steps[{index}] needs script or actions"
+        args_obj = _mobile_args(step.get("args"))
+        if args_obj is _BAD_ARGS:
+            return None, f"steps[{index}].args must be an object or array"
+        steps.append(("script", script, args_obj))
+    return steps, None
+
+
+def _encode_steps(results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    for item in results:
+        if "value" in item:
             try:
-                # 清理本地缓存，避免后续继续使用失效会话
-                ad.invalidate_session(base, sid)
+                item["value"] = jsonable_encoder(item["value"])
             except Exception:
-                pass
-            core.logger.warning(
-                f"appium actions invalid-session: base={base} sid={sid} url={url}"
-            )
-            return JSONResponse(
-                {
-                    "code": "SESSION_GONE",
-                    "message": "Appium 会话已失效，请重建会话后重试",
-                    "sessionId": sid,
-                    "recoverable": True,
-                    "action": "RECREATE_SESSION",
-                    "error": str(e),
-                    "body": body_text,
-                },
-                status_code=410,
-            )
-        core.logger.exception(f"appium actions failed: url={url} err={e}")
-        return JSONResponse({"error": str(e), "body": body_text}, status_code=502)
+                item["value"] = str(item["value"])
+    return results
+
+
+@router.post("/api/appium/batch")
+async def api_appium_batch(payload: Dict[str, Any]):
+    """在同一会话上顺序执行一组 mobile: 脚本与 W3C Actions，一次往返返回全部结果。
+    请求体示例：
+    {
+      "sessionId": "<APPIUM_SESSION_ID>",
+      "steps": [
+        { "script": "mobile: activateApp", "args": { "bundleId": "..." } },
+        { "actions": [ { "type": "pointer", ... } ] }
+      ],
+      "continueOnError": false
+    }
+    默认遇到首个失败步骤即停止，其后步骤不执行；continueOnError=true 时继续执行。
+    会话失效时无论是否 continueOnError 都会停止，返回 410 并附带已执行步骤的结果。
+    整个批次在会话队列中只占一条命令，同一会话的其它请求不会插入到步骤之间。
+    """
+    base = core.APPIUM_BASE
+    sid = payload.get("sessionId")
+    if not sid:
+        return JSONResponse({"error": "sessionId is required"}, status_code=400)
+    steps, err = _parse_batch_steps(payload.get("steps"))
+    if steps is None:
+        return JSONResponse({"error": err}, status_code=400)
+    continue_on_error = bool(payload.get("continueOnError"))
+    if ad.get_session(base, sid) is None and any(kind == "script" for kind, _, _ in steps):
+        # 后端未登记该会话（如重启后），脚本步骤必然全部失败，直接按会话失效返回
+        return _session_gone(
+            sid, "unknown session; create it via /api/appium/create in this backend", completed=0, steps=[]
+        )
+
+    started = time.monotonic()
+    try:
+        results = await ad.run_batch(base, sid, steps, continue_on_error)
+    except ad.AppiumInvalidSession as e:
+        results = _encode_steps(getattr(e, "steps", []))
+        core.logger.warning(
+            f"appium batch invalid-session: base={base} sid={sid} step={len(results) - 1}/{len(steps)}"
+        )
+        return _session_gone(sid, str(e), completed=max(0, len(results) - 1), steps=results)
+    results = _encode_steps(results)
+
+    failed = sum(1 for item in results if not item["ok"])
+    return {
+        "sessionId": sid,
+        "ok": failed == 0 and len(results) == len(steps),
+        "completed": len(results),
+        "failed": failed,
+        "skipped": len(steps) - len(results),
+        "totalMs": round((time.monotonic() - started) * 1000.0, 2),
+        "steps": results,
+    }
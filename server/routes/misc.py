@@ -1,54 +1,45 @@
-from typing import Any, Optional, Tuple
+from typing import Optional, Tuple
 
-import asyncio
-from io import BytesIO
-
-from PIL import Image
 from fastapi import APIRouter
 from fastapi.responses import JSONResponse
 
 import core
 import appium_driver as ad
+import mjpeg_hub
+import webdriver_client as wd
 
 router = APIRouter()
 
 
 def _is_invalid_session(exc: Exception) -> bool:
-    if ad.InvalidSessionIdException is not None and isinstance(exc, ad.InvalidSessionIdException):
+    if isinstance(exc, ad.AppiumInvalidSession):
         return True
-    msg = str(exc) or exc.__class__.__name__
-    return "InvalidSessionId" in msg or "terminated" in msg or "session" in msg and "not started" in msg
-
-
-async def _get_window_size_via_driver(driver: Any) -> Optional[Tuple[int, int]]:
-    def _inner() -> Optional[Tuple[int, int]]:
-        size = driver.get_window_size()
-        if isinstance(size, dict):
-            w = int(size.get("width", 0))
-            h = int(size.get("height", 0))
-        else:
-            w = int(getattr(size, "width", 0))
-            h = int(getattr(size, "height", 0))
-        if w and h:
-            return w, h
-        return None
-
-    return await asyncio.to_thread(_inner)
+    return isinstance(exc, wd.WebDriverError) and exc.invalid_session
 
 
-async def _get_screenshot_size_via_driver(driver: Any) -> Optional[Tuple[int, int]]:
-    def _inner() -> Optional[Tuple[int, int]]:
-        png_bytes = driver.get_screenshot_as_png()
-        if not png_bytes:
-            return None
-        with Image.open(BytesIO(png_bytes)) as img:
-            return img.size
+def _get_frame_size_via_stream(base: str, sid: str) -> Optional[Tuple[int, int]]:
+    """从运行中的 MJPEG 读取器取最近一帧尺寸；无直播时返回 None。
 
-    return await asyncio.to_thread(_inner)
+    先找该会话设备自己的 MJPEG（mjpegServerPort），再看全局 MJPEG。
+    注意：帧尺寸受 mjpegScalingFactor 影响，默认 100 时与截图像素一致。
+    """
+    sources = []
+    udid = ad.get_udid_by_session(base, sid)
+    port = ad.get_mjpeg_port(base, udid) if udid else None
+    if port:
+        sources.append(core.build_mjpeg_url(base, port))
+    if core.MJPEG_URL:
+        sources.append(core.MJPEG_URL)
+    for source in sources:
+        frame = mjpeg_hub.latest_frame(source)
+        if frame is not None and frame.size:
+            return frame.size
+    return None
 
 
 @router.get("/api/device-info")
-async def device_info(noShot: bool = False):
+async def device_info(noShot: bool = False, refresh: bool = False):
+    """窗口尺寸（点）与画面像素尺寸。几何信息按会话缓存，refresh=true 强制重新获取。"""
     base = core.APPIUM_BASE.rstrip("/") if core.APPIUM_BASE else None
     if not base:
         return JSONResponse({"error": "APPIUM_BASE is not configured"}, status_code=503)
@@ -57,28 +48,35 @@ async def device_info(noShot: bool = False):
     if not sid:
         return JSONResponse({"error": "No Appium session found. Please create a session first."}, status_code=503)
 
-    driver = ad.get_driver(base, sid)
-    if driver is None:
+    if ad.get_session(base, sid) is None:
         return JSONResponse({"error": "Appium session is not active. Please recreate the session."}, status_code=503)
 
     try:
-        size_pt = await _get_window_size_via_driver(driver)
+        # 直播帧已在内存中，优先使用；仅在无直播时才需要截图像素尺寸（每个会话至多一次）
+        frame_px = _get_frame_size_via_stream(base, sid)
+        want_shot = not frame_px and not (noShot or core.SKIP_SCREENSHOT_SIZE)
+        geometry = await ad.get_geometry(base, sid, refresh=refresh, screenshot=want_shot)
+        if frame_px and geometry.landscape is not None and frame_px[0] != frame_px[1]:
+            if (frame_px[0] > frame_px[1]) != geometry.landscape:
+                # 直播帧方向与缓存的窗口尺寸不一致，说明设备已旋转
+                geometry = await ad.get_geometry(base, sid, refresh=True, screenshot=False)
+
+        size_pt = geometry.size_pt
         size_px = None
-        if not (noShot or core.SKIP_SCREENSHOT_SIZE):
-            try:
-                px = await _get_screenshot_size_via_driver(driver)
-                if px:
-                    size_px = {"w": int(px[0]), "h": int(px[1])}
-            except Exception as screenshot_err:
-                if _is_invalid_session(screenshot_err):
-                    ad.invalidate_session(base, sid)
-                    return JSONResponse({"error": "Appium session has expired. Please recreate the session."}, status_code=503)
-                core.logger.info(f"device-info: skip screenshot size due to: {screenshot_err}")
+        size_px_source = None
+        if frame_px:
+            size_px = {"w": int(frame_px[0]), "h": int(frame_px[1])}
+            size_px_source = "stream"
+        elif geometry.size_px:
+            size_px = {"w": int(geometry.size_px[0]), "h": int(geometry.size_px[1])}
+            size_px_source = "screenshot"
 
         return {
             "sessionId": sid,
             "size_pt": {"w": size_pt[0], "h": size_pt[1]} if size_pt else None,
             "size_px": size_px,
+            "size_px_source": size_px_source,
+            "geometry_updated_at": geometry.updated_at,
         }
     except Exception as exc:
         if _is_invalid_session(exc):
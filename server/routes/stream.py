@@ -1,89 +1,566 @@
-from typing import Optional
+import asyncio
+import contextlib
+import math
+import os
+import struct
+import time
+from typing import Any, Dict, List, Optional, Tuple
 
-from fastapi import APIRouter
-from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi import APIRouter, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
 
 import core
+import appium_driver as ad
+import mjpeg_hub
+import mjpeg_recorder
+import mjpeg_renditions
+import stream_pusher
 
 router = APIRouter()
 
+# 二进制帧头（大端）：版本、udid 字节长度、序号、采集时间戳（秒）、宽、高；其后依次为 udid 与 JPEG
+WS_FRAME_HEADER = struct.Struct(">BBIdHH")
+WS_FRAME_VERSION = 1
+_WS_DEFAULT_WINDOW = max(0, int(os.environ.get("STREAM_WS_WINDOW", "2")))
+_WS_ACK_TIMEOUT = float(os.environ.get("STREAM_WS_ACK_TIMEOUT", "5"))
 
-@router.get("/stream")
-async def stream():
-    if not core.MJPEG_URL:
-        return JSONResponse({"error": "MJPEG not configured. Set env MJPEG=http://host:port[/path]"}, status_code=503)
-    core.logger.info(f"MJPEG URL: {core.MJPEG_URL}")
-    candidates = (
-        "",
-        "/mjpeg",
-        "/mjpeg/",
-        "/mjpeg/0",
-        "/mjpeg/1",
-        "/stream.mjpeg",
-        "/video",
-        "/stream",
-        "/mjpegstream",
-        "/",
-    )
-    chosen_url: Optional[str] = None
-    chosen_ctype: Optional[str] = None
-    last_err: Optional[Exception] = None
 
-    client = await core.get_http_client()
-    for path in candidates:
-        url = f"{core.MJPEG_URL}{path}"
-        try:
-            async with client.stream("GET", url, timeout=None) as upstream:
-                ctype = upstream.headers.get("Content-Type", "")
-                if not ctype.lower().startswith("multipart/x-mixed-replace"):
-                    continue
-                chosen_url = url
-                chosen_ctype = ctype
-                break
-        except Exception as e:
-            last_err = e
-            continue
-
-    if not chosen_url or not chosen_ctype:
-        msg = f"MJPEG connect failed for {core.MJPEG_URL}: {last_err}"
+def _resolve_source(udid: Optional[str]) -> Tuple[Optional[str], Optional[Tuple[int, Dict[str, Any]]]]:
+    """Map a device to its MJPEG source; without udid use the global MJPEG env.
+
+    设备的 MJPEG 地址来自会话注册表：Appium 主机 + 创建会话时分配的 mjpegServerPort。
+    失败时返回 (None, (status_code, body))。
+    """
+    udid_clean = (udid or "").strip()
+    if not udid_clean:
+        if not core.MJPEG_URL:
+            return None, (503, {"error": "MJPEG not configured. Set env MJPEG=http://host:port[/path] or pass udid"})
+        return core.MJPEG_URL, None
+
+    base = core.APPIUM_BASE
+    if not ad.get_session_by_udid(base, udid_clean):
+        return None, (404, {"error": "Appium session not found for udid", "udid": udid_clean})
+    port = ad.get_mjpeg_port(base, udid_clean)
+    if not port:
+        return None, (
+            404,
+            {"error": "mjpegServerPort unknown for udid; recreate the session via /api/appium/create", "udid": udid_clean},
+        )
+    return core.build_mjpeg_url(base, port), None
+
+
+async def _stream_response(request: Request, udid: Optional[str], rendition: Optional[str]):
+    name = mjpeg_renditions.normalize(rendition)
+    if name is None:
+        return JSONResponse(
+            {"error": f"unknown rendition {rendition!r}", "renditions": list(mjpeg_renditions.names())},
+            status_code=400,
+        )
+    source, err = _resolve_source(udid)
+    if err is not None:
+        return JSONResponse(err[1], status_code=err[0])
+    core.logger.info(f"MJPEG URL: {source} udid={udid or '-'}")
+
+    # 同一来源的所有观众共享一个上游连接（见 mjpeg_hub），每台设备各有一个 hub
+    client_host = request.client.host if request.client else None
+    hub, sub = mjpeg_hub.subscribe(source, client=client_host, udid=udid, rendition=name)
+    if not await hub.wait_ready():
+        mjpeg_hub.unsubscribe(hub, sub)
+        msg = f"MJPEG connect failed for {source}: {hub.error}"
         core.logger.error(msg)
         return JSONResponse({"error": msg}, status_code=502)
 
-    core.logger.info(f"MJPEG proxy connected: {chosen_url} ctype={chosen_ctype}")
-
-    # 规范化 boundary 参数：部分上游会在 boundary 值前误带 "--"，浏览器可能无法解析
-    ctype_out = chosen_ctype
-    try:
-        ct = chosen_ctype
-        parts = [p.strip() for p in ct.split(";")]
-        base = parts[0].lower()
-        params = parts[1:]
-        boundary_val = None
-        rest = []
-        for p in params:
-            if p.lower().startswith("boundary="):
-                boundary_val = p.split("=", 1)[1].strip().strip('"')
-            else:
-                rest.append(p)
-        if base.startswith("multipart/x-mixed-replace") and boundary_val:
-            if boundary_val.startswith("--"):
-                boundary_val = boundary_val[2:]
-            # 重新拼装 Content-Type
-            ctype_out = "multipart/x-mixed-replace; boundary=" + boundary_val
-            if rest:
-                ctype_out += "; " + "; ".join(rest)
-    except Exception:
-        ctype_out = chosen_ctype
+    core.logger.info(
+        f"MJPEG proxy attached: {hub.url} upstream_ctype={hub.upstream_content_type} "
+        f"rendition={name} viewers={hub.subscriber_count}"
+    )
 
     async def body():
-        client2 = await core.get_http_client()
-        async with client2.stream("GET", chosen_url, timeout=None) as upstream2:
-            async for chunk in upstream2.aiter_raw():
-                yield chunk
+        try:
+            async for part in mjpeg_hub.iter_parts(sub):
+                yield part
+        finally:
+            mjpeg_hub.unsubscribe(hub, sub)
 
     return StreamingResponse(body(), headers={
-        "Content-Type": ctype_out,
+        "Content-Type": mjpeg_hub.FRAME_CONTENT_TYPE,
         "Cache-Control": "no-cache, no-store",
         "Pragma": "no-cache",
         "X-Content-Type-Options": "nosniff",
     })
+
+
+async def _frame_response(udid: Optional[str]):
+    source, err = _resolve_source(udid)
+    if err is not None:
+        return JSONResponse(err[1], status_code=err[0])
+    frame = await mjpeg_hub.grab_frame(source, udid=udid)
+    if frame is None:
+        return JSONResponse({"error": f"No MJPEG frame available from {source}"}, status_code=503)
+    headers = {
+        "Cache-Control": "no-cache, no-store",
+        "Pragma": "no-cache",
+        "X-Frame-Seq": str(frame.seq),
+        "X-Frame-Timestamp": f"{frame.captured_at:.3f}",
+    }
+    size = frame.size
+    if size:
+        headers["X-Frame-Width"] = str(size[0])
+        headers["X-Frame-Height"] = str(size[1])
+    return Response(content=frame.data, media_type="image/jpeg", headers=headers)
+
+
+@router.get("/stream")
+async def stream(request: Request, udid: Optional[str] = None, rendition: Optional[str] = None):
+    """MJPEG 直播；rendition 可选 full（默认）/half/thumb，由后端统一转码后共享。"""
+    return await _stream_response(request, udid, rendition)
+
+
+# 注意：frame.jpg 需在 /stream/{udid} 之前注册，避免被当作 udid 匹配
+@router.get("/stream/frame.jpg")
+async def stream_frame(udid: Optional[str] = None):
+    """返回最近一帧 JPEG；没有运行中的读取器时临时拉取一帧。"""
+    return await _frame_response(udid)
+
+
+@router.get("/stream/{udid}/frame.jpg")
+async def stream_device_frame(udid: str):
+    return await _frame_response(udid)
+
+
+@router.get("/stream/{udid}")
+async def stream_device(request: Request, udid: str, rendition: Optional[str] = None):
+    return await _stream_response(request, udid, rendition)
+
+
+@router.get("/api/stream/viewers")
+async def stream_viewers():
+    """各 MJPEG 来源当前观众及其已送达/丢弃帧数。"""
+    return {"hubs": mjpeg_hub.list_hubs()}
+
+
+@router.get("/api/stream/stats")
+async def stream_stats(udid: Optional[str] = None):
+    """上游 fps、码率、帧大小分布、帧间抖动与停滞状态，以及每个观众的队列深度、丢帧与延迟。"""
+    udid_clean = (udid or "").strip()
+    hubs = mjpeg_hub.list_hubs(udid_clean or None)
+    if udid_clean and not hubs:
+        return JSONResponse({"error": "No live MJPEG stream for udid", "udid": udid_clean}, status_code=404)
+    return {"hubs": hubs}
+
+
+@router.get("/api/stream/stats/{udid}")
+async def stream_device_stats(udid: str):
+    return await stream_stats(udid)
+
+
+@router.get("/api/stream/push")
+async def stream_push_status():
+    """各设备 RTMP 推流管线的守护状态：starting/live/degraded/backoff/failed 及重启次数。"""
+    return {"streams": stream_pusher.list_streams()}
+
+
+# 需在 /api/stream/push/{udid} 之前注册
+@router.get("/api/stream/push/allocation")
+async def stream_push_allocation():
+    """编码槽位预算、已分配情况、排队设备及每路的准入结果（admitted/downgraded/idb/queued）。"""
+    return stream_pusher.allocation()
+
+
+@router.get("/api/stream/push/{udid}")
+async def stream_push_device_status(udid: str):
+    status = stream_pusher.get_stream(udid)
+    if status is None:
+        return JSONResponse({"error": "No stream push for udid", "udid": udid}, status_code=404)
+    return status
+
+
+@router.get("/api/stream/push/{udid}/metrics")
+async def stream_push_device_metrics(udid: str):
+    """ffmpeg -progress 解析出的帧数、fps、码率、速度与丢帧。"""
+    metrics = stream_pusher.get_metrics(udid)
+    if metrics is None:
+        return JSONResponse({"error": "No stream push for udid", "udid": udid}, status_code=404)
+    return metrics
+
+
+@router.post("/api/stream/clips")
+async def stream_clip_create(payload: Dict[str, Any]):
+    """从内存录制中导出一段画面，后台写文件，立即返回任务。
+    请求体示例：
+    {
+      "udid": "<UDID>",          // 省略则使用全局 MJPEG 源
+      "seconds": 10,             // 导出最近 N 秒；或给出 start/end（epoch 秒）
+      "format": "mp4",           // mjpeg（默认）| mp4（需 ffmpeg）
+      "fps": 15
+    }
+    """
+    raw_udid = payload.get("udid")
+    if raw_udid is not None and not isinstance(raw_udid, str):
+        return JSONResponse({"error": "udid must be a string"}, status_code=400)
+    udid = (raw_udid or "").strip() or None
+    fmt = str(payload.get("format") or "mjpeg").strip().lower()
+    if fmt not in mjpeg_recorder.CLIP_FORMATS:
+        return JSONResponse(
+            {"error": f"unknown format {fmt!r}", "formats": list(mjpeg_recorder.CLIP_FORMATS)},
+            status_code=400,
+        )
+    try:
+        fps = float(payload.get("fps") or mjpeg_recorder.CLIP_FPS)
+        seconds = float(payload.get("seconds") or 10)
+        end = float(payload["end"]) if payload.get("end") is not None else time.time()
+        start = float(payload["start"]) if payload.get("start") is not None else end - seconds
+    except (TypeError, ValueError):
+        return JSONResponse({"error": "start/end/seconds/fps must be numbers"}, status_code=400)
+    if not 0 < fps <= 60 or end <= start:
+        return JSONResponse({"error": "require 0 < fps <= 60 and start < end"}, status_code=400)
+
+    # 录制按设备保存，会话已失效但录制仍在保留期内时照样可以导出
+    source = udid
+    if udid is None:
+        source, err = _resolve_source(None)
+        if err is not None:
+            return JSONResponse(err[1], status_code=err[0])
+    ring = mjpeg_recorder.find_ring(source)
+    if ring is None or ring.span() is None:
+        if udid is not None:
+            _, err = _resolve_source(udid)
+            if err is not None:
+                return JSONResponse(err[1], status_code=err[0])
+        return JSONResponse(
+            {
+                "error": "No recorded frames; a device is only recorded while it has at least one viewer, "
+                f"and the recording is kept for {mjpeg_recorder.RECORD_RETAIN:.0f}s after the last viewer leaves",
+                "udid": udid,
+            },
+            status_code=404,
+        )
+    first, last = ring.span()
+    # 静止画面被去重后最后一帧可能较早，结束时间按当前时刻截断即可
+    start, end = max(start, first), min(end, time.time())
+    if end <= start:
+        return JSONResponse(
+            {"error": "Requested window is outside the recorded range", "from": first, "to": last},
+            status_code=416,
+        )
+    job = mjpeg_recorder.start_clip(ring, source, udid, start, end, fmt=fmt, fps=fps)
+    return JSONResponse(job.snapshot(), status_code=202)
+
+
+@router.get("/api/stream/clips")
+async def stream_clip_list():
+    return {"clips": mjpeg_recorder.list_clips()}
+
+
+@router.get("/api/stream/clips/{clip_id}")
+async def stream_clip_status(clip_id: str):
+    job = mjpeg_recorder.get_clip(clip_id)
+    if job is None:
+        return JSONResponse({"error": "clip not found", "id": clip_id}, status_code=404)
+    return job.snapshot()
+
+
+@router.get("/api/stream/clips/{clip_id}/file")
+async def stream_clip_file(clip_id: str):
+    job = mjpeg_recorder.get_clip(clip_id)
+    if job is None:
+        return JSONResponse({"error": "clip not found", "id": clip_id}, status_code=404)
+    if job.status != "done":
+        return JSONResponse(job.snapshot(), status_code=409)
+    return FileResponse(job.path, media_type=job.media_type, filename=os.path.basename(job.path))
+
+
+_HLS_MEDIA_TYPES = {
+    ".m3u8": "application/vnd.apple.mpegurl",
+    ".mp4": "video/mp4",
+    ".m4s": "video/iso.segment",
+}
+
+
+@router.get("/hls/{udid}/{name}")
+async def stream_hls_file(udid: str, name: str):
+    """本地 fMP4 HLS 输出（STREAM_PUSH_OUTPUT=hls/both）：播放列表不缓存；分片与 init 的文件名带每次启动的代号、不会复用，可长缓存。"""
+    path = stream_pusher.hls_file(udid, name)
+    if path is None:
+        return JSONResponse({"error": "HLS file not found", "udid": udid, "name": name}, status_code=404)
+    ext = os.path.splitext(name)[1]
+    if ext == ".m3u8":
+        cache = "no-cache, no-store"
+    else:
+        cache = "public, max-age=3600, immutable"
+    return FileResponse(
+        path,
+        media_type=_HLS_MEDIA_TYPES[ext],
+        headers={"Cache-Control": cache, "Access-Control-Allow-Origin": "*"},
+    )
+
+
+class _WsChannel:
+    """One device subscription multiplexed on a /ws/stream socket.
+
+    流控：未确认帧数达到 window 时暂停发送（window=0 关闭流控）；fps>0 时按目标帧率限速。
+    暂停期间的新帧在观众信箱中被最新帧覆盖，不会堆积。
+    """
+
+    def __init__(
+        self,
+        conn: "_WsConnection",
+        udid: str,
+        hub: mjpeg_hub.MjpegHub,
+        sub: mjpeg_hub.MjpegSubscriber,
+        fps: float,
+        window: int,
+    ) -> None:
+        self.conn = conn
+        self.udid = udid
+        self.hub = hub
+        self.sub = sub
+        self.fps = fps
+        self.window = window
+        self.sent = 0
+        self.acked = 0
+        self.ack_timeouts = 0
+        self._udid_bytes = udid.encode("utf-8")[:255]
+        self._inflight: Dict[int, float] = {}
+        self._ack_event = asyncio.Event()
+        self._task = asyncio.create_task(self._pump(), name=f"ws-stream-{udid or 'default'}")
+
+    def configure(self, fps: Optional[float], window: Optional[int]) -> None:
+        if fps is not None:
+            self.fps = fps
+        if window is not None:
+            self.window = window
+        self._ack_event.set()
+
+    def ack(self, seq: int) -> None:
+        # 累积确认：seq 及之前的在途帧全部视为已确认
+        for s in [s for s in self._inflight if s <= seq]:
+            del self._inflight[s]
+            self.acked += 1
+        self._ack_event.set()
+
+    def close(self) -> None:
+        self._task.cancel()
+        mjpeg_hub.unsubscribe(self.hub, self.sub)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "udid": self.udid,
+            "fps": self.fps,
+            "window": self.window,
+            "sent": self.sent,
+            "acked": self.acked,
+            "inflight": len(self._inflight),
+            "ackTimeouts": self.ack_timeouts,
+            "dropped": self.sub.dropped,
+        }
+
+    async def _pump(self) -> None:
+        next_at = 0.0
+        try:
+            while True:
+                if self.fps > 0:
+                    delay = next_at - time.monotonic()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                while self.window > 0 and len(self._inflight) >= self.window:
+                    self._ack_event.clear()
+                    try:
+                        await asyncio.wait_for(self._ack_event.wait(), timeout=_WS_ACK_TIMEOUT)
+                    except asyncio.TimeoutError:
+                        # 客户端长时间未确认：视为丢失，避免通道永久停滞
+                        self.ack_timeouts += 1
+                        self._inflight.clear()
+                frame = await self.sub.next_frame()
+                if frame is None:
+                    await self.conn.send_json({"type": "stream.ended", "udid": self.udid, "error": self.hub.error})
+                    return
+                size = frame.size or (0, 0)
+                header = WS_FRAME_HEADER.pack(
+                    WS_FRAME_VERSION,
+                    len(self._udid_bytes),
+                    frame.seq & 0xFFFFFFFF,
+                    frame.captured_at,
+                    min(size[0], 0xFFFF),
+                    min(size[1], 0xFFFF),
+                )
+                await self.conn.send_bytes(header + self._udid_bytes + frame.data)
+                self.sent += 1
+                if self.window > 0:
+                    self._inflight[frame.seq & 0xFFFFFFFF] = time.monotonic()
+                if self.fps > 0:
+                    next_at = time.monotonic() + 1.0 / self.fps
+        except asyncio.CancelledError:
+            raise
+        except Exception as exc:
+            core.logger.info(f"ws-stream channel {self.udid or 'default'} stopped: {exc}")
+
+
+class _WsConnection:
+    """All channels of one browser socket; sends are serialized by a lock."""
+
+    def __init__(self, websocket: WebSocket) -> None:
+        self.websocket = websocket
+        self.channels: Dict[str, _WsChannel] = {}
+        self._send_lock = asyncio.Lock()
+        self._pending: set = set()
+        # 同一 udid 的订阅串行处理，避免并发订阅各建一个通道、其中一个无人管理
+        # udid -> [锁, 使用者数]；使用者归零时删除，避免字典随 udid 增长
+        self._subscribe_locks: Dict[str, List[Any]] = {}
+
+    async def send_bytes(self, data: bytes) -> None:
+        async with self._send_lock:
+            await self.websocket.send_bytes(data)
+
+    async def send_json(self, message: Dict[str, Any]) -> None:
+        async with self._send_lock:
+            await self.websocket.send_json(message)
+
+    def close(self) -> None:
+        for task in self._pending:
+            task.cancel()
+        for channel in self.channels.values():
+            channel.close()
+        self.channels.clear()
+
+    def dispatch(self, message: Dict[str, Any]) -> None:
+        # ack 直接处理；其余消息（订阅可能要等上游连接）放到任务里，避免阻塞后续 ack
+        if message.get("type") == "stream.ack":
+            channel = self.channels.get(str(message.get("udid") or "").strip())
+            if channel is not None:
+                with contextlib.suppress(Exception):
+                    channel.ack(int(message.get("seq")))
+            return
+        task = asyncio.create_task(self.handle(message), name=f"ws-stream-msg-{message.get('id')}")
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+
+    async def _subscribe(
+        self,
+        message: Dict[str, Any],
+        udid: str,
+        fps: Optional[float],
+        window: Optional[int],
+        reply: Dict[str, Any],
+    ) -> None:
+        rendition = mjpeg_renditions.normalize(message.get("rendition"))
+        if rendition is None:
+            reply.update(ok=False, error={"code": "bad_request", "message": f"unknown rendition; use one of {list(mjpeg_renditions.names())}"})
+            await self.send_json(reply)
+            return
+        source, err = _resolve_source(udid)
+        if err is not None:
+            reply.update(ok=False, status=err[0], error=err[1])
+            await self.send_json(reply)
+            return
+        previous = self.channels.pop(udid, None)
+        if previous is not None:
+            previous.close()
+        client_host = self.websocket.client.host if self.websocket.client else None
+        hub, sub = mjpeg_hub.subscribe(source, client=f"ws:{client_host}", udid=udid or None, rendition=rendition)
+        try:
+            ready = await hub.wait_ready()
+        except asyncio.CancelledError:
+            # 连接关闭会取消挂起的订阅：此时也要退订，否则 hub 与上游连接一直不释放
+            mjpeg_hub.unsubscribe(hub, sub)
+            raise
+        if not ready:
+            mjpeg_hub.unsubscribe(hub, sub)
+            reply.update(ok=False, status=502, error={"error": f"MJPEG connect failed for {source}: {hub.error}"})
+            await self.send_json(reply)
+            return
+        channel = _WsChannel(
+            self,
+            udid,
+            hub,
+            sub,
+            fps if fps is not None else 0.0,
+            window if window is not None else _WS_DEFAULT_WINDOW,
+        )
+        self.channels[udid] = channel
+        reply.update(ok=True, data={**channel.snapshot(), "rendition": rendition, "headerSize": WS_FRAME_HEADER.size})
+        await self.send_json(reply)
+
+    async def handle(self, message: Dict[str, Any]) -> None:
+        msg_type = message.get("type")
+        msg_id = message.get("id")
+        udid = str(message.get("udid") or "").strip()
+        reply: Dict[str, Any] = {"id": msg_id, "type": msg_type, "udid": udid}
+
+        try:
+            fps = _parse_fps(message.get("fps"))
+            window = _parse_window(message.get("window"))
+        except (TypeError, ValueError, OverflowError) as exc:
+            reply.update(ok=False, error={"code": "bad_request", "message": str(exc)})
+            await self.send_json(reply)
+            return
+
+        if msg_type == "stream.subscribe":
+            entry = self._subscribe_locks.setdefault(udid, [asyncio.Lock(), 0])
+            entry[1] += 1
+            try:
+                async with entry[0]:
+                    await self._subscribe(message, udid, fps, window, reply)
+            finally:
+                entry[1] -= 1
+                if not entry[1]:
+                    self._subscribe_locks.pop(udid, None)
+            return
+        if msg_type == "stream.config":
+            channel = self.channels.get(udid)
+            if channel is None:
+                reply.update(ok=False, error={"code": "not_subscribed", "message": "subscribe first"})
+            else:
+                channel.configure(fps, window)
+                reply.update(ok=True, data=channel.snapshot())
+        elif msg_type == "stream.unsubscribe":
+            channel = self.channels.pop(udid, None)
+            if channel is not None:
+                channel.close()
+            reply.update(ok=True)
+        elif msg_type == "stream.stats":
+            reply.update(ok=True, data=[c.snapshot() for c in self.channels.values()])
+        else:
+            reply.update(ok=False, error={"code": "unknown_type", "message": f"Unsupported message type: {msg_type}"})
+        await self.send_json(reply)
+
+
+def _parse_fps(raw: Any) -> Optional[float]:
+    if raw is None:
+        return None
+    fps = float(raw)
+    if not math.isfinite(fps) or fps < 0 or fps > 120:
+        raise ValueError("fps must be between 0 and 120 (0 = source rate)")
+    return fps
+
+
+def _parse_window(raw: Any) -> Optional[int]:
+    if raw is None:
+        return None
+    window = int(raw)
+    if window < 0 or window > 64:
+        raise ValueError("window must be between 0 and 64 (0 = no ack flow control)")
+    return window
+
+
+@router.websocket("/ws/stream")
+async def stream_ws(websocket: WebSocket):
+    """多路复用的二进制画面通道：一个浏览器连接可同时订阅多台设备。
+
+    文本消息（JSON）：stream.subscribe {udid, fps, window, rendition} / stream.config /
+    stream.unsubscribe / stream.ack {udid, seq}（不回复）/ stream.stats。
+    二进制消息：WS_FRAME_HEADER + udid + JPEG。
+    """
+    await websocket.accept()
+    conn = _WsConnection(websocket)
+    try:
+        while True:
+            message = await websocket.receive_json()
+            if isinstance(message, dict):
+                conn.dispatch(message)
+    except WebSocketDisconnect:
+        pass
+    except Exception as exc:
+        core.logger.info(f"ws-stream connection closed: {exc}")
+    finally:
+        conn.close()
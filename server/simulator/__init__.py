@@ -0,0 +1,9 @@
+"""Stand-in devices for load and latency benchmarking without real iPhones.
+
+- mjpeg: 合成 MJPEG 服务（帧大小/帧率/分隔符怪癖可配）
+- idb:   假 ``idb video-stream``，输出 H.264 Annex-B
+- wda:   最小 Appium/WDA HTTP 服务（/session、/actions、/execute/sync），延迟可配
+- bench: 以 N 台模拟设备驱动 /stream、stream_pusher 与 appium 路由，输出吞吐与延迟分位数
+
+在 server 目录下运行，例如：python -m simulator.bench --devices 8 --duration 30
+"""
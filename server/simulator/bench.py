@@ -0,0 +1,331 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from simulator.mjpeg import QUIRKS, MjpegSimulator, read_stamp
+from simulator.serving import SimServer, free_port
+from simulator.wda import WdaSimulator
+
+_SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _percentile(sorted_vals: List[float], pct: float) -> float:
+    if not sorted_vals:
+        return 0.0
+    idx = min(len(sorted_vals) - 1, int(round(pct / 100.0 * (len(sorted_vals) - 1))))
+    return sorted_vals[idx]
+
+
+class Series:
+    """Latency samples (ms) plus counters for one benchmarked operation."""
+
+    def __init__(self) -> None:
+        self.latencies: List[float] = []
+        self.errors = 0
+        self.bytes = 0
+
+    def add(self, latency_ms: float, size: int = 0) -> None:
+        self.latencies.append(latency_ms)
+        self.bytes += size
+
+    def summary(self, duration: float) -> Dict[str, Any]:
+        vals = sorted(self.latencies)
+        span = max(1e-3, duration)
+        return {
+            "count": len(vals),
+            "perSec": round(len(vals) / span, 2),
+            "errors": self.errors,
+            "bytesPerSec": round(self.bytes / span, 1),
+            "latencyMs": {
+                "avg": round(sum(vals) / len(vals), 2) if vals else 0.0,
+                "p50": round(_percentile(vals, 50), 2),
+                "p90": round(_percentile(vals, 90), 2),
+                "p99": round(_percentile(vals, 99), 2),
+                "max": round(vals[-1], 2) if vals else 0.0,
+            },
+        }
+
+
+def _write_idb_wrapper(directory: str) -> str:
+    # stream_pusher 以 IDB_BIN 为可执行文件直接调用，这里生成一个转到 simulator.idb 的脚本
+    path = os.path.join(directory, "idb")
+    with open(path, "w") as fh:
+        fh.write(
+            "#!/bin/sh\n"
+            f'PYTHONPATH="{_SERVER_DIR}${{PYTHONPATH:+:$PYTHONPATH}}" exec "{sys.executable}" -m simulator.idb "$@"\n'
+        )
+    os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+    return path
+
+
+async def _view(client: httpx.AsyncClient, base: str, udid: str, series: Series, stop: asyncio.Event) -> None:
+    """Read /stream/{udid} and record generation → delivery latency from the frame stamps."""
+    import mjpeg_hub
+
+    while not stop.is_set():
+        try:
+            async with client.stream("GET", f"{base}/stream/{udid}", timeout=None) as resp:
+                if resp.status_code != 200:
+                    series.errors += 1
+                    await asyncio.sleep(0.5)
+                    continue
+                _, boundary = mjpeg_hub.normalize_content_type(resp.headers.get("content-type"))
+                parser = mjpeg_hub.MjpegFrameParser(boundary)
+                async for chunk in resp.aiter_bytes():
+                    for frame in parser.feed(chunk):
+                        stamp = read_stamp(frame)
+                        if stamp is not None:
+                            series.add((time.time() - stamp[1]) * 1000.0, len(frame))
+                    if stop.is_set():
+                        return
+        except httpx.HTTPError:
+            series.errors += 1
+            await asyncio.sleep(0.5)
+
+
+def _tap_actions(x: int, y: int) -> List[Dict[str, Any]]:
+    return [
+        {
+            "type": "pointer",
+            "id": "finger1",
+            "parameters": {"pointerType": "touch"},
+            "actions": [
+                {"type": "pointerMove", "duration": 0, "x": x, "y": y},
+                {"type": "pointerDown", "button": 0},
+                {"type": "pause", "duration": 50},
+                {"type": "pointerUp", "button": 0},
+            ],
+        }
+    ]
+
+
+async def _drive(
+    client: httpx.AsyncClient,
+    base: str,
+    sid: str,
+    rate: float,
+    series: Dict[str, Series],
+    stop: asyncio.Event,
+) -> None:
+    """Issue commands at ``rate`` per second, alternating W3C actions and mobile: execute."""
+    interval = 1.0 / rate
+    next_at = time.monotonic()
+    index = 0
+    while not stop.is_set():
+        if index % 2 == 0:
+            name, path, body = "actions", "/api/appium/actions", {"sessionId": sid, "actions": _tap_actions(100, 200)}
+        else:
+            name, path, body = "exec-mobile", "/api/appium/exec-mobile", {
+                "sessionId": sid,
+                "script": "mobile: deviceInfo",
+                "args": {},
+            }
+        started = time.perf_counter()
+        try:
+            resp = await client.post(f"{base}{path}", json=body)
+            if resp.status_code >= 400:
+                series[name].errors += 1
+            else:
+                series[name].add((time.perf_counter() - started) * 1000.0)
+        except httpx.HTTPError:
+            series[name].errors += 1
+        index += 1
+        next_at += interval
+        delay = next_at - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        else:
+            # 跟不上目标速率时不追赶，避免突发
+            next_at = time.monotonic()
+
+
+async def _start_backend(args: argparse.Namespace, wda_url: str, tmpdir: str) -> SimServer:
+    # 必须在导入后端模块前设置，core/stream_pusher 在导入时读取环境变量
+    os.environ["APPIUM_BASE"] = wda_url
+    os.environ["ENABLE_STREAM_PUSH"] = "true" if args.push else "false"
+    os.environ["IDB_BIN"] = _write_idb_wrapper(tmpdir)
+    os.environ["IDB_PIPE_MODE"] = args.push_pipe
+    os.environ["SIM_IDB_FRAME_BYTES"] = str(args.idb_frame_bytes)
+    import core
+    import main
+
+    if not args.verbose:
+        # 后端逐请求的访问日志会淹没报告
+        core.logger.setLevel(logging.WARNING)
+    return await SimServer(main.app, args.port or free_port()).start()
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    wda = WdaSimulator(args.latency_ms, args.jitter_ms, width=args.width, height=args.height)
+    servers: List[SimServer] = [await SimServer(wda.app, free_port()).start()]
+    wda_url = servers[0].url
+    devices: List[Dict[str, Any]] = []
+    for i in range(args.devices):
+        sim = MjpegSimulator(args.width, args.height, args.fps, args.frame_bytes, args.quirk)
+        server = await SimServer(sim.app, free_port()).start()
+        servers.append(server)
+        devices.append({"udid": f"SIM-{i:04d}", "port": server.port, "sim": sim})
+
+    tmpdir = tempfile.mkdtemp(prefix="wda-sim-")
+    backend: Optional[SimServer] = None
+    if args.backend:
+        base = args.backend.rstrip("/")
+        print(f"using external backend {base}; it must run with APPIUM_BASE={wda_url}", file=sys.stderr)
+    else:
+        backend = await _start_backend(args, wda_url, tmpdir)
+        base = backend.url
+
+    series = {name: Series() for name in ("create", "stream", "actions", "exec-mobile")}
+    stop = asyncio.Event()
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    async with httpx.AsyncClient(timeout=30, limits=limits) as client:
+        for device in devices:
+            started = time.perf_counter()
+            resp = await client.post(
+                f"{base}/api/appium/create",
+                json={"udid": device["udid"], "mjpegServerPort": device["port"]},
+            )
+            if resp.status_code >= 400:
+                series["create"].errors += 1
+                print(f"create {device['udid']} failed: {resp.status_code} {resp.text[:200]}", file=sys.stderr)
+                continue
+            series["create"].add((time.perf_counter() - started) * 1000.0)
+            device["sid"] = resp.json().get("sessionId")
+
+        tasks: List[asyncio.Task] = []
+        for device in devices:
+            for _ in range(args.viewers):
+                tasks.append(asyncio.create_task(_view(client, base, device["udid"], series["stream"], stop)))
+            if device.get("sid") and args.rate > 0:
+                tasks.append(asyncio.create_task(_drive(client, base, device["sid"], args.rate, series, stop)))
+
+        started = time.monotonic()
+        await asyncio.sleep(args.duration)
+        elapsed = time.monotonic() - started
+        stop.set()
+        _, pending = await asyncio.wait(tasks, timeout=5)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        queue = (await client.get(f"{base}/api/appium/queue")).json().get("commands", {})
+        gestures = (await client.get(f"{base}/api/appium/gestures")).json()
+        push: List[Dict[str, Any]] = []
+        if args.push:
+            resp = await client.get(f"{base}/api/stream/push")
+            push = [
+                {
+                    key: item.get(key)
+                    for key in ("udid", "state", "pipe", "restarts", "bytesPerSec", "lastError")
+                }
+                for item in resp.json().get("streams", [])
+            ]
+
+    if backend is not None:
+        await backend.stop()
+    for server in servers:
+        await server.stop()
+    shutil.rmtree(tmpdir, ignore_errors=True)
+
+    return {
+        "config": {
+            key: getattr(args, key)
+            for key in ("devices", "viewers", "duration", "fps", "frame_bytes", "quirk", "rate", "latency_ms", "jitter_ms", "push")
+        },
+        "elapsedSec": round(elapsed, 2),
+        "create": series["create"].summary(elapsed),
+        "stream": {
+            **series["stream"].summary(elapsed),
+            "framesGenerated": sum(device["sim"].frames_sent for device in devices),
+            "fpsPerViewer": round(
+                len(series["stream"].latencies) / max(1e-3, elapsed) / max(1, args.devices * args.viewers), 2
+            ),
+        },
+        "actions": series["actions"].summary(elapsed),
+        "exec-mobile": series["exec-mobile"].summary(elapsed),
+        "wdaRequests": dict(wda.requests),
+        "queue": queue,
+        "gestures": gestures,
+        "push": push,
+    }
+
+
+def _print_report(report: Dict[str, Any]) -> None:
+    cfg = report["config"]
+    print(
+        f"devices={cfg['devices']} viewers/device={cfg['viewers']} fps={cfg['fps']:g} "
+        f"rate={cfg['rate']:g}/s wda={cfg['latency_ms']:g}±{cfg['jitter_ms']:g}ms "
+        f"quirks={','.join(cfg['quirk']) or '-'} elapsed={report['elapsedSec']}s"
+    )
+    print(f"{'operation':<12} {'count':>7} {'per sec':>9} {'errors':>6} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for name in ("create", "stream", "actions", "exec-mobile"):
+        s = report[name]
+        lat = s["latencyMs"]
+        print(
+            f"{name:<12} {s['count']:>7} {s['perSec']:>9} {s['errors']:>6} "
+            f"{lat['p50']:>8} {lat['p90']:>8} {lat['p99']:>8} {lat['max']:>8}"
+        )
+    for kind, q in report["queue"].items():
+        print(
+            f"queue {kind}: n={q['count']} wait p50/p99={q['waitMs']['p50']}/{q['waitMs']['p99']}ms "
+            f"exec p50/p99={q['execMs']['p50']}/{q['execMs']['p99']}ms"
+        )
+    g = report["gestures"]
+    if g.get("requests"):
+        print(
+            f"gestures: {g['requests']} requests -> {g['calls']} calls "
+            f"(calls -{g['callReduction']:.0%}, moves -{g['moveReduction']:.0%})"
+        )
+    stream = report["stream"]
+    print(
+        f"stream: {stream['fpsPerViewer']} fps/viewer, {stream['bytesPerSec'] / 1e6:.2f} MB/s delivered, "
+        f"{stream['framesGenerated']} frames generated"
+    )
+    for item in report["push"]:
+        print(
+            f"push {item['udid']}: {item['state']} pipe={item['pipe']} restarts={item['restarts']} "
+            f"bytes/s={item['bytesPerSec']} err={item['lastError'] or '-'}"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the backend against simulated devices")
+    parser.add_argument("--devices", type=int, default=4)
+    parser.add_argument("--viewers", type=int, default=1, help="/stream readers per device")
+    parser.add_argument("--duration", type=float, default=20.0)
+    parser.add_argument("--fps", type=float, default=15.0)
+    parser.add_argument("--width", type=int, default=390)
+    parser.add_argument("--height", type=int, default=844)
+    parser.add_argument("--frame-bytes", type=int, default=60000, help="pad each MJPEG frame to this size")
+    parser.add_argument("--quirk", action="append", default=[], choices=QUIRKS)
+    parser.add_argument("--rate", type=float, default=5.0, help="appium commands per second per device")
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="simulated WDA latency")
+    parser.add_argument("--jitter-ms", type=float, default=5.0)
+    parser.add_argument("--push", action="store_true", help="start stream_pusher with the simulated idb")
+    parser.add_argument("--push-pipe", choices=("tap", "direct"), default="tap")
+    parser.add_argument("--idb-frame-bytes", type=int, default=6000)
+    parser.add_argument("--backend", default="", help="benchmark an already running backend instead")
+    parser.add_argument("--port", type=int, default=0, help="port for the in-process backend")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    parser.add_argument("--verbose", action="store_true", help="keep the in-process backend's INFO logs")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        _print_report(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""Fake ``idb video-stream`` writing H.264 Annex-B to stdout.
+
+用法与真实 idb 一致（stream_pusher 通过 IDB_BIN 调用）：
+  python -m simulator.idb video-stream --udid X --fps 30 --format h264
+
+默认输出结构合法的合成 NAL 序列（每个 GOP 以 SPS/PPS/IDR 开头，其后为 P 片），
+用于压测 idb → ffmpeg 的传输链路（tap/direct），内容本身不可解码。
+需要 ffmpeg 真正解码/转码时，用 --input 循环回放一段从真机录下的 .h264。
+其余参数可由环境变量给出：SIM_IDB_FRAME_BYTES、SIM_IDB_GOP、SIM_IDB_INPUT、SIM_IDB_EXIT_AFTER。
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from typing import Iterator, List
+
+START_CODE = b"\x00\x00\x00\x01"
+
+# nal_unit_type：1 非 IDR 片，5 IDR 片，7 SPS，8 PPS（nal_ref_idc=3）
+_NAL_SLICE = 0x41
+_NAL_IDR = 0x65
+_NAL_SPS = 0x67
+_NAL_PPS = 0x68
+# Baseline profile 3.1 的 SPS/PPS 头部；仅用于让解析器识别出参数集
+_SPS_BODY = bytes([0x42, 0xC0, 0x1F, 0xDA, 0x01, 0x40, 0x16, 0xE8, 0x40])
+_PPS_BODY = bytes([0xCE, 0x3C, 0x80])
+
+
+def _payload(size: int) -> bytes:
+    # 不含 0x00，天然避开起始码与防竞争字节
+    return bytes(random.randint(1, 255) for _ in range(min(size, 4096))) * (size // 4096 + 1)
+
+
+def synthetic_access_units(frame_bytes: int, gop: int) -> Iterator[bytes]:
+    body = _payload(frame_bytes)[:frame_bytes]
+    idr = _payload(frame_bytes * 4)[: frame_bytes * 4]
+    index = 0
+    while True:
+        if index % gop == 0:
+            yield (
+                START_CODE + bytes([_NAL_SPS]) + _SPS_BODY
+                + START_CODE + bytes([_NAL_PPS]) + _PPS_BODY
+                + START_CODE + bytes([_NAL_IDR]) + idr
+            )
+        else:
+            yield START_CODE + bytes([_NAL_SLICE]) + body
+        index += 1
+
+
+def split_access_units(data: bytes) -> List[bytes]:
+    """Split an Annex-B file into per-picture chunks for paced replay.
+
+    片（类型 1/5）之后再遇到片或 AUD/SEI/SPS/PPS 即视为新一帧开始；多 slice 帧会被拆开，
+    只影响回放节奏，不影响码流本身。
+    """
+    units: List[bytes] = []
+    start = 0
+    seen_slice = False
+    pos = data.find(b"\x00\x00\x01")
+    while pos != -1 and pos + 3 < len(data):
+        nal_type = data[pos + 3] & 0x1F
+        if seen_slice and nal_type in (1, 5, 6, 7, 8, 9):
+            # 4 字节起始码的前导 0x00 归下一帧
+            cut = pos - 1 if data[pos - 1] == 0 else pos
+            units.append(data[start:cut])
+            start = cut
+            seen_slice = False
+        if nal_type in (1, 5):
+            seen_slice = True
+        pos = data.find(b"\x00\x00\x01", pos + 3)
+    units.append(data[start:])
+    return [unit for unit in units if unit]
+
+
+def file_access_units(path: str) -> Iterator[bytes]:
+    with open(path, "rb") as fh:
+        units = split_access_units(fh.read())
+    if not units:
+        raise SystemExit(f"no H.264 access units in {path}")
+    while True:
+        yield from units
+
+
+def main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(prog="idb")
+    parser.add_argument("command")
+    parser.add_argument("--udid", default="")
+    parser.add_argument("--fps", type=float, default=30.0)
+    parser.add_argument("--format", default="h264")
+    parser.add_argument("--frame-bytes", type=int, default=int(os.environ.get("SIM_IDB_FRAME_BYTES", "6000")))
+    parser.add_argument("--gop", type=int, default=int(os.environ.get("SIM_IDB_GOP", "60")))
+    parser.add_argument("--input", default=os.environ.get("SIM_IDB_INPUT", ""))
+    parser.add_argument("--exit-after", type=float, default=float(os.environ.get("SIM_IDB_EXIT_AFTER", "0")))
+    args, _unknown = parser.parse_known_args(argv)
+    if args.command != "video-stream":
+        print(f"simulated idb only supports video-stream, got {args.command!r}", file=sys.stderr)
+        return 2
+    if args.format != "h264":
+        print(f"simulated idb only supports --format h264, got {args.format!r}", file=sys.stderr)
+        return 2
+
+    units = file_access_units(args.input) if args.input else synthetic_access_units(args.frame_bytes, args.gop)
+    out = sys.stdout.buffer
+    interval = 1.0 / args.fps
+    started = next_at = time.monotonic()
+    print(f"simulated video-stream udid={args.udid} fps={args.fps:g}", file=sys.stderr, flush=True)
+    try:
+        for unit in units:
+            out.write(unit)
+            out.flush()
+            # --exit-after 用于模拟设备断开，验证守护重启
+            if args.exit_after and time.monotonic() - started >= args.exit_after:
+                print("simulated disconnect", file=sys.stderr, flush=True)
+                return 1
+            next_at += interval
+            delay = next_at - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+    except (BrokenPipeError, KeyboardInterrupt):
+        return 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,147 @@
+import argparse
+import asyncio
+import struct
+import time
+from io import BytesIO
+from typing import AsyncIterator, Iterable, Optional, Tuple
+
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+from PIL import Image
+
+
+# 分隔符怪癖，与 mjpeg_hub 的解析/规范化分支一一对应：
+#   dash-boundary  Content-Type 的 boundary 值自带 "--"（WDA 的实际行为）
+#   no-boundary    Content-Type 不声明 boundary，需从正文嗅探
+#   no-length      分段头不带 Content-Length，只能按下一个分隔符切帧
+#   split          每段拆成小块写出，考验跨 chunk 拼接
+QUIRKS = ("dash-boundary", "no-boundary", "no-length", "split")
+BOUNDARY = "BoundaryString"
+_SPLIT_CHUNK = 1024
+
+# 帧内时间戳：SOI 之后插入一个 COM 段，内容为 魔数 + 序号 + 生成时刻（epoch 秒）
+_STAMP_MAGIC = b"WDASIM"
+_STAMP = struct.Struct(">6sId")
+_COM_MAX = 65533
+
+
+def make_template(width: int, height: int, quality: int = 70) -> bytes:
+    img = Image.new("RGB", (width, height), (48, 96, 160))
+    buf = BytesIO()
+    img.save(buf, format="JPEG", quality=quality)
+    return buf.getvalue()
+
+
+def stamp_frame(template: bytes, seq: int, size: int = 0) -> bytes:
+    """Template JPEG with a COM stamp; COM padding grows the frame to ``size`` bytes."""
+    stamp = _STAMP.pack(_STAMP_MAGIC, seq & 0xFFFFFFFF, time.time())
+    segments = [b"\xff\xfe" + struct.pack(">H", len(stamp) + 2) + stamp]
+    pad = size - len(template) - len(segments[0])
+    while pad > 4:
+        chunk = min(_COM_MAX, pad - 4)
+        segments.append(b"\xff\xfe" + struct.pack(">H", chunk + 2) + bytes(chunk))
+        pad -= chunk + 4
+    return template[:2] + b"".join(segments) + template[2:]
+
+
+def read_stamp(frame: bytes) -> Optional[Tuple[int, float]]:
+    """Return (seq, generated_at) from a stamped frame, or None for foreign JPEGs."""
+    if frame[2:4] != b"\xff\xfe" or len(frame) < 6 + _STAMP.size:
+        return None
+    magic, seq, generated_at = _STAMP.unpack_from(frame, 6)
+    if magic != _STAMP_MAGIC:
+        return None
+    return seq, generated_at
+
+
+def content_type(quirks: Iterable[str]) -> str:
+    if "no-boundary" in quirks:
+        return "multipart/x-mixed-replace"
+    boundary = f"--{BOUNDARY}" if "dash-boundary" in quirks else BOUNDARY
+    return f"multipart/x-mixed-replace; boundary={boundary}"
+
+
+def encode_part(frame: bytes, quirks: Iterable[str]) -> bytes:
+    head = f"--{BOUNDARY}\r\nContent-Type: image/jpeg\r\n"
+    if "no-length" not in quirks:
+        head += f"Content-Length: {len(frame)}\r\n"
+    return head.encode() + b"\r\n" + frame + b"\r\n\r\n"
+
+
+class MjpegSimulator:
+    """Synthetic WDA-style MJPEG server for one simulated device."""
+
+    def __init__(
+        self,
+        width: int = 390,
+        height: int = 844,
+        fps: float = 15.0,
+        frame_bytes: int = 0,
+        quirks: Iterable[str] = (),
+    ) -> None:
+        unknown = set(quirks) - set(QUIRKS)
+        if unknown:
+            raise ValueError(f"unknown quirks: {sorted(unknown)}")
+        self.fps = fps
+        self.frame_bytes = frame_bytes
+        self.quirks = frozenset(quirks)
+        self.template = make_template(width, height)
+        self.frames_sent = 0
+        self.clients = 0
+        self.app = FastAPI()
+        self.app.add_api_route("/{path:path}", self._stream, methods=["GET"])
+
+    async def _parts(self) -> AsyncIterator[bytes]:
+        interval = 1.0 / self.fps
+        seq = 0
+        next_at = time.monotonic()
+        self.clients += 1
+        try:
+            while True:
+                part = encode_part(stamp_frame(self.template, seq, self.frame_bytes), self.quirks)
+                if "split" in self.quirks:
+                    for offset in range(0, len(part), _SPLIT_CHUNK):
+                        yield part[offset:offset + _SPLIT_CHUNK]
+                else:
+                    yield part
+                seq += 1
+                self.frames_sent += 1
+                # 按绝对时间对齐，避免发送耗时累积成帧率漂移
+                next_at += interval
+                await asyncio.sleep(max(0.0, next_at - time.monotonic()))
+        finally:
+            self.clients -= 1
+
+    async def _stream(self, path: str = ""):
+        return StreamingResponse(self._parts(), headers={"Content-Type": content_type(self.quirks)})
+
+
+def main() -> None:
+    from simulator.serving import SimServer
+
+    parser = argparse.ArgumentParser(description="Synthetic MJPEG server")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--width", type=int, default=390)
+    parser.add_argument("--height", type=int, default=844)
+    parser.add_argument("--fps", type=float, default=15.0)
+    parser.add_argument("--frame-bytes", type=int, default=0, help="pad each JPEG to this size")
+    parser.add_argument("--quirk", action="append", default=[], choices=QUIRKS)
+    args = parser.parse_args()
+
+    async def run() -> None:
+        sim = MjpegSimulator(args.width, args.height, args.fps, args.frame_bytes, args.quirk)
+        server = await SimServer(sim.app, args.port).start()
+        print(f"MJPEG simulator on {server.url} quirks={sorted(sim.quirks) or '-'}")
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await server.stop()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
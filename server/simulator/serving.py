@@ -0,0 +1,54 @@
+import asyncio
+import contextlib
+import socket
+from typing import Any, Optional
+
+import uvicorn
+
+
+def free_port(host: str = "127.0.0.1") -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind((host, 0))
+        return sock.getsockname()[1]
+
+
+class SimServer:
+    """One uvicorn server running as a task on the caller's event loop."""
+
+    def __init__(self, app: Any, port: int, host: str = "127.0.0.1") -> None:
+        self.host = host
+        self.port = port
+        # 长连接（MJPEG）不会自行结束，关停时最多等 1 秒
+        config = uvicorn.Config(
+            app,
+            host=host,
+            port=port,
+            log_level="warning",
+            lifespan="on",
+            access_log=False,
+            timeout_graceful_shutdown=1,
+        )
+        self._server = uvicorn.Server(config)
+        # 多个服务共用一个进程，信号由调用方（bench）统一处理
+        self._server.capture_signals = contextlib.nullcontext  # type: ignore[method-assign]
+        self._server.install_signal_handlers = lambda: None  # type: ignore[method-assign]
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    async def start(self) -> "SimServer":
+        self._task = asyncio.create_task(self._server.serve(), name=f"sim-server-{self.port}")
+        while not self._server.started:
+            if self._task.done():
+                self._task.result()
+                raise RuntimeError(f"server on port {self.port} exited during startup")
+            await asyncio.sleep(0.02)
+        return self
+
+    async def stop(self) -> None:
+        self._server.should_exit = True
+        if self._task is not None:
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
@@ -0,0 +1,210 @@
+import argparse
+import asyncio
+import base64
+import random
+import time
+import uuid
+from collections import Counter
+from io import BytesIO
+from typing import Any, Dict, Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+from PIL import Image
+
+
+def _invalid_session(sid: str) -> JSONResponse:
+    # 与 Appium 返回体一致，后端据此识别会话失效
+    return JSONResponse(
+        {
+            "value": {
+                "error": "invalid session id",
+                "message": f"A session is either terminated or not started (id={sid})",
+                "stacktrace": "",
+            }
+        },
+        status_code=404,
+    )
+
+
+class WdaSimulator:
+    """Minimal Appium/WDA HTTP server: sessions, W3C actions and execute/sync.
+
+    每个请求先按 latency_ms ± jitter_ms 随机休眠，模拟真机上 WDA 的处理耗时。
+    窗口尺寸以点为单位，截图按 scale 倍像素生成。
+    """
+
+    def __init__(
+        self,
+        latency_ms: float = 20.0,
+        jitter_ms: float = 5.0,
+        width: int = 390,
+        height: int = 844,
+        scale: int = 3,
+    ) -> None:
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.width = width
+        self.height = height
+        self.scale = scale
+        self.sessions: Dict[str, Dict[str, Any]] = {}
+        self.requests: Counter = Counter()
+        self._screenshot: Optional[str] = None
+        app = FastAPI()
+        app.middleware("http")(self._delay)
+        app.add_api_route("/status", self.status, methods=["GET"])
+        app.add_api_route("/session", self.create_session, methods=["POST"])
+        app.add_api_route("/session/{sid}", self.get_session, methods=["GET"])
+        app.add_api_route("/session/{sid}", self.delete_session, methods=["DELETE"])
+        app.add_api_route("/session/{sid}/actions", self.actions, methods=["POST", "DELETE"])
+        app.add_api_route("/session/{sid}/execute/sync", self.execute, methods=["POST"])
+        app.add_api_route("/session/{sid}/window/rect", self.window_rect, methods=["GET"])
+        app.add_api_route("/session/{sid}/window/size", self.window_rect, methods=["GET"])
+        app.add_api_route("/session/{sid}/screenshot", self.screenshot, methods=["GET"])
+        app.add_api_route("/session/{sid}/orientation", self.orientation, methods=["GET", "POST"])
+        app.add_api_route("/session/{sid}/appium/settings", self.settings, methods=["GET", "POST"])
+        self.app = app
+
+    async def _delay(self, request: Request, call_next):
+        self.requests[f"{request.method} {_route_kind(request.url.path)}"] += 1
+        delay = self.latency_ms + random.uniform(-self.jitter_ms, self.jitter_ms)
+        if delay > 0:
+            await asyncio.sleep(delay / 1000.0)
+        return await call_next(request)
+
+    async def status(self):
+        return {"value": {"ready": True, "message": "simulated WDA", "build": {"version": "sim"}}}
+
+    async def create_session(self, payload: Dict[str, Any]):
+        caps = dict((payload.get("capabilities") or {}).get("alwaysMatch") or {})
+        for first in (payload.get("capabilities") or {}).get("firstMatch") or []:
+            caps.update(first or {})
+        sid = str(uuid.uuid4())
+        udid = caps.get("appium:udid") or caps.get("udid")
+        self.sessions[sid] = {
+            "caps": caps,
+            "udid": udid,
+            "orientation": "PORTRAIT",
+            "settings": {},
+            "createdAt": time.time(),
+            "actions": 0,
+        }
+        return {"value": {"sessionId": sid, "capabilities": {**caps, "udid": udid}}}
+
+    async def get_session(self, sid: str):
+        session = self.sessions.get(sid)
+        if session is None:
+            return _invalid_session(sid)
+        return {"value": session["caps"]}
+
+    async def delete_session(self, sid: str):
+        if self.sessions.pop(sid, None) is None:
+            return _invalid_session(sid)
+        return {"value": None}
+
+    async def actions(self, sid: str, request: Request):
+        session = self.sessions.get(sid)
+        if session is None:
+            return _invalid_session(sid)
+        if request.method == "POST":
+            body = await request.json()
+            for source in body.get("actions") or []:
+                session["actions"] += len(source.get("actions") or [])
+        return {"value": None}
+
+    async def execute(self, sid: str, payload: Dict[str, Any]):
+        session = self.sessions.get(sid)
+        if session is None:
+            return _invalid_session(sid)
+        script = str(payload.get("script") or "")
+        if script in ("mobile: deviceInfo", "mobile: getDeviceInfo"):
+            value: Any = {
+                "udid": session["udid"],
+                "model": "iPhone (simulated)",
+                "platformVersion": "17.0",
+                "orientation": session["orientation"],
+            }
+        elif script == "mobile: viewportRect":
+            value = {"left": 0, "top": 0, "width": self.width * self.scale, "height": self.height * self.scale}
+        elif script == "mobile: deviceScreenInfo":
+            value = {"scale": self.scale, "statusBarSize": {"width": self.width, "height": 47}}
+        else:
+            value = None
+        return {"value": value}
+
+    def _size(self, session: Dict[str, Any]) -> tuple[int, int]:
+        if session["orientation"] == "LANDSCAPE":
+            return self.height, self.width
+        return self.width, self.height
+
+    async def window_rect(self, sid: str):
+        session = self.sessions.get(sid)
+        if session is None:
+            return _invalid_session(sid)
+        width, height = self._size(session)
+        return {"value": {"x": 0, "y": 0, "width": width, "height": height}}
+
+    async def screenshot(self, sid: str):
+        if sid not in self.sessions:
+            return _invalid_session(sid)
+        if self._screenshot is None:
+            buf = BytesIO()
+            Image.new("RGB", (self.width * self.scale, self.height * self.scale), (32, 32, 32)).save(buf, format="PNG")
+            self._screenshot = base64.b64encode(buf.getvalue()).decode()
+        return {"value": self._screenshot}
+
+    async def orientation(self, sid: str, request: Request):
+        session = self.sessions.get(sid)
+        if session is None:
+            return _invalid_session(sid)
+        if request.method == "POST":
+            body = await request.json()
+            session["orientation"] = str(body.get("orientation") or "PORTRAIT").upper()
+            return {"value": None}
+        return {"value": session["orientation"]}
+
+    async def settings(self, sid: str, request: Request):
+        session = self.sessions.get(sid)
+        if session is None:
+            return _invalid_session(sid)
+        if request.method == "POST":
+            body = await request.json()
+            session["settings"].update(body.get("settings") or {})
+            return {"value": None}
+        return {"value": session["settings"]}
+
+
+def _route_kind(path: str) -> str:
+    # /session/<sid>/actions → /session/:sid/actions，便于按命令类型计数
+    parts = path.strip("/").split("/")
+    if len(parts) >= 2 and parts[0] == "session":
+        parts[1] = ":sid"
+    return "/" + "/".join(parts)
+
+
+def main() -> None:
+    from simulator.serving import SimServer
+
+    parser = argparse.ArgumentParser(description="Simulated Appium/WDA server")
+    parser.add_argument("--port", type=int, default=4723)
+    parser.add_argument("--latency-ms", type=float, default=20.0)
+    parser.add_argument("--jitter-ms", type=float, default=5.0)
+    args = parser.parse_args()
+
+    async def run() -> None:
+        sim = WdaSimulator(args.latency_ms, args.jitter_ms)
+        server = await SimServer(sim.app, args.port).start()
+        print(f"WDA simulator on {server.url} latency={args.latency_ms:g}±{args.jitter_ms:g}ms")
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await server.stop()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,19 @@
 import asyncio
 import contextlib
+import functools
 import os
-from typing import Dict, Optional
-from urllib.parse import urlencode, urlparse
+import re
+import shutil
+import tempfile
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, List, Optional, Sequence, Tuple
+from urllib.parse import urlencode
 
 import core
+import proc_stats
 
 
-FFMPEG_BIN = os.environ.get("FFMPEG_BIN", "ffmpeg")
 RTMP_BASE = os.environ.get(
     "RTMP_PUSH_BASE", "rtmp://127.0.0.1:1935").rstrip("/")
 RTMP_USER = os.environ.get("RTMP_PUSH_USER", "encoder")
@@ -19,19 +25,259 @@ _STREAM_MODE = os.environ.get("STREAM_PUSH_MODE", "mjpeg").strip().lower()
 if _STREAM_MODE not in {"idb", "mjpeg"}:
     _STREAM_MODE = "idb"
 IDB_BIN = os.environ.get("IDB_BIN", "idb")
+# 输出目标：rtmp 推到 RTMP_PUSH_BASE；hls 在本地写 fMP4 分片由后端 /hls/{udid}/ 提供；both 两者同时（tee 复用一次编码）
+_PUSH_OUTPUT = os.environ.get("STREAM_PUSH_OUTPUT", "rtmp").strip().lower()
+if _PUSH_OUTPUT not in {"rtmp", "hls", "both"}:
+    _PUSH_OUTPUT = "rtmp"
+# HLS 分片目录，优先放在 tmpfs（/dev/shm）避免磁盘写入
+HLS_ROOT = os.environ.get("HLS_DIR") or os.path.join(
+    "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(), "wda-hls"
+)
+_HLS_SEGMENT_SECONDS = float(os.environ.get("HLS_SEGMENT_SECONDS", "1"))
+_HLS_LIST_SIZE = int(os.environ.get("HLS_LIST_SIZE", "6"))
+HLS_PLAYLIST = "index.m3u8"
+# idb → ffmpeg 的数据通道：tap 经 Python 转发并统计字节速率；direct 用 OS 管道直连，数据不进入事件循环
+_IDB_PIPE_MODE = os.environ.get("IDB_PIPE_MODE", "tap").strip().lower()
+if _IDB_PIPE_MODE not in {"tap", "direct"}:
+    _IDB_PIPE_MODE = "tap"
 
 
 _STREAM_READER_LIMIT = 4 * 1024 * 1024  # 4MB
 _STREAM_READ_CHUNK = 64 * 1024
 _STREAM_LOG_MAX_SEGMENT = 512 * 1024
 
+# 守护进程：退出或停滞后按指数退避重启整条推流管线
+_RESTART_BASE = float(os.environ.get("STREAM_RESTART_BASE", "1"))
+_RESTART_MAX = float(os.environ.get("STREAM_RESTART_MAX", "60"))
+# 连续失败次数上限，超过后进入 failed；0 表示不限
+_RESTART_LIMIT = int(os.environ.get("STREAM_RESTART_LIMIT", "10"))
+# 连续运行超过该秒数视为恢复稳定，失败计数清零
+_STABLE_SECONDS = float(os.environ.get("STREAM_STABLE_SECONDS", "30"))
+# 无数据超过 degraded 秒标记为 degraded，超过 stall 秒判定停滞并重启
+_DEGRADED_SECONDS = float(os.environ.get("STREAM_DEGRADED_SECONDS", "3"))
+_STALL_SECONDS = float(os.environ.get("STREAM_STALL_SECONDS", "15"))
+_HEALTH_INTERVAL = 1.0
+
+# 资源采样：每隔 N 秒从 /proc 读取各子进程 CPU/RSS/IO（0 关闭）。
+# 滚动平均超过阈值（CPU 为单核百分比之和，RSS 为 MB，0 表示不限）时按 action 处理：
+# downgrade 去掉阶梯/主档降一级后重启，restart 原样重启，log 仅告警
+_RESOURCE_INTERVAL = float(os.environ.get("STREAM_RESOURCE_INTERVAL", "5"))
+_CPU_LIMIT = float(os.environ.get("STREAM_CPU_LIMIT", "0"))
+_RSS_LIMIT_MB = float(os.environ.get("STREAM_RSS_LIMIT_MB", "0"))
+_RESOURCE_ACTION = os.environ.get("STREAM_RESOURCE_ACTION", "downgrade").strip().lower()
+if _RESOURCE_ACTION not in {"downgrade", "restart", "log"}:
+    _RESOURCE_ACTION = "downgrade"
+# 至少积累这么多次采样才判定超限，避免启动瞬间的峰值误触发
+_RESOURCE_MIN_SAMPLES = max(1, int(os.environ.get("STREAM_RESOURCE_MIN_SAMPLES", "3")))
+
+# 每路推流在一个窗口内最多输出的 ffmpeg 日志行数，超出部分只计数
+_LOG_RATE_LINES = int(os.environ.get("FFMPEG_LOG_RATE_LINES", "20"))
+_LOG_RATE_WINDOW = float(os.environ.get("FFMPEG_LOG_RATE_WINDOW", "10"))
+
+STATE_QUEUED = "queued"
+STATE_STARTING = "starting"
+STATE_LIVE = "live"
+STATE_DEGRADED = "degraded"
+STATE_BACKOFF = "backoff"
+STATE_FAILED = "failed"
+
+
+class FfmpegProgress:
+    """Latest ``-progress`` block reported by one ffmpeg process."""
+
+    __slots__ = (
+        "frame", "fps", "bitrate_kbps", "total_size", "out_time_sec", "speed",
+        "dup_frames", "drop_frames", "updates", "updated_at", "_pending",
+    )
+
+    def __init__(self) -> None:
+        self.frame = 0
+        self.fps = 0.0
+        self.bitrate_kbps: Optional[float] = None
+        self.total_size = 0
+        self.out_time_sec = 0.0
+        self.speed: Optional[float] = None
+        self.dup_frames = 0
+        self.drop_frames = 0
+        self.updates = 0
+        self.updated_at: Optional[float] = None
+        self._pending: Dict[str, str] = {}
+
+    def feed(self, line: str) -> bool:
+        """Consume one ``key=value`` line; return True when a block completes."""
+        key, sep, value = line.partition("=")
+        if not sep:
+            return False
+        key = key.strip()
+        value = value.strip()
+        if key != "progress":
+            self._pending[key] = value
+            return False
+        block, self._pending = self._pending, {}
+        self.frame = _parse_int(block.get("frame"), self.frame)
+        self.fps = _parse_float(block.get("fps"), self.fps) or 0.0
+        if "bitrate" in block:
+            self.bitrate_kbps = _parse_float(block["bitrate"].replace("kbits/s", ""), None)
+        self.total_size = _parse_int(block.get("total_size"), self.total_size)
+        out_us = _parse_int(block.get("out_time_us") or block.get("out_time_ms"), 0)
+        self.out_time_sec = out_us / 1_000_000 if out_us > 0 else self.out_time_sec
+        if "speed" in block:
+            self.speed = _parse_float(block["speed"].rstrip("x"), None)
+        self.dup_frames = _parse_int(block.get("dup_frames"), self.dup_frames)
+        self.drop_frames = _parse_int(block.get("drop_frames"), self.drop_frames)
+        self.updates += 1
+        self.updated_at = time.time()
+        return True
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "frame": self.frame,
+            "fps": self.fps,
+            "bitrateKbps": self.bitrate_kbps,
+            "totalSize": self.total_size,
+            "outTimeSec": round(self.out_time_sec, 3),
+            "speed": self.speed,
+            "dupFrames": self.dup_frames,
+            "dropFrames": self.drop_frames,
+            "updatedAt": self.updated_at,
+        }
+
+
+def _parse_int(raw: Optional[str], default: int) -> int:
+    try:
+        return int(raw) if raw not in (None, "", "N/A") else default
+    except ValueError:
+        return default
+
+
+def _parse_float(raw: Optional[str], default: Optional[float]) -> Optional[float]:
+    try:
+        return float(raw) if raw not in (None, "", "N/A") else default
+    except ValueError:
+        return default
+
 
 class _StreamState:
-    __slots__ = ("processes", "tasks")
+    """One device's push pipeline plus its supervisor bookkeeping."""
+
+    __slots__ = (
+        "udid", "session_id", "mode", "pipe", "processes", "tasks", "spawn", "supervisor",
+        "state", "state_since", "restarts", "failures", "last_error", "started_at",
+        "spawned_at", "last_activity", "bytes_forwarded", "bytes_per_sec", "next_retry_at",
+        "progress", "renditions", "requested", "admission", "cost", "output", "hls_dir",
+        "outputs", "resources", "resource_breach", "resource_actions", "resource_restarts", "_resource_sampled",
+        "_resource_error", "_rate_started", "_rate_bytes",
+    )
 
-    def __init__(self, processes: list[asyncio.subprocess.Process], tasks: list[asyncio.Task]):
-        self.processes = processes
-        self.tasks = tasks
+    def __init__(
+        self,
+        udid: str,
+        session_id: str,
+        mode: str,
+        spawn: Callable[["_StreamState"], Awaitable[Optional[str]]],
+        pipe: Optional[str] = None,
+    ):
+        self.udid = udid
+        self.session_id = session_id
+        self.mode = mode
+        # 仅 idb 模式有效：tap / direct
+        self.pipe = pipe
+        self.processes: list[asyncio.subprocess.Process] = []
+        self.tasks: list[asyncio.Task] = []
+        self.spawn = spawn
+        self.supervisor: Optional[asyncio.Task] = None
+        self.state = STATE_STARTING
+        self.state_since = time.time()
+        self.restarts = 0
+        self.failures = 0
+        self.last_error: Optional[str] = None
+        self.started_at = time.time()
+        self.spawned_at = time.monotonic()
+        # None 表示尚未观察到输出
+        self.last_activity: Optional[float] = None
+        self.bytes_forwarded = 0
+        self.bytes_per_sec = 0.0
+        self.progress = FfmpegProgress()
+        self.renditions: list[str] = []
+        self.requested: Dict[str, Any] = {}
+        self.admission = "admitted"
+        self.cost = 0.0
+        self.output = "rtmp"
+        self.hls_dir: Optional[str] = None
+        # 与 spawn 绑定的同一个列表，资源降档时原地修改
+        self.outputs: list["_Output"] = []
+        self.resources = proc_stats.ResourceMonitor()
+        self.resource_breach: Optional[str] = None
+        self.resource_actions = 0
+        # 未能降档的连续超限重启次数；完整窗口内未超限时清零
+        self.resource_restarts = 0
+        self._resource_sampled = 0.0
+        self._resource_error: Optional[str] = None
+        self.next_retry_at: Optional[float] = None
+        self._rate_started = time.monotonic()
+        self._rate_bytes = 0
+
+    def set_state(self, state: str) -> None:
+        if state != self.state:
+            self.state = state
+            self.state_since = time.time()
+
+    def mark_activity(self, size: int = 0) -> None:
+        now = time.monotonic()
+        self.last_activity = now
+        if not size:
+            return
+        self.bytes_forwarded += size
+        # 按约 1 秒的分桶计算转发速率
+        self._rate_bytes += size
+        elapsed = now - self._rate_started
+        if elapsed >= 1.0:
+            self.bytes_per_sec = self._rate_bytes / elapsed
+            self._rate_started = now
+            self._rate_bytes = 0
+
+    @property
+    def tapped(self) -> bool:
+        return self.mode == "idb" and self.pipe != "direct"
+
+    def snapshot(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        return {
+            "udid": self.udid,
+            "sessionId": self.session_id,
+            "mode": self.mode,
+            "pipe": self.pipe,
+            "renditions": self.renditions,
+            "admission": self.admission,
+            "encodeCost": self.cost,
+            "output": self.output,
+            "hls": f"/hls/{self.udid}/{HLS_PLAYLIST}" if self.hls_dir else None,
+            "state": self.state,
+            "stateSince": self.state_since,
+            "restarts": self.restarts,
+            "consecutiveFailures": self.failures,
+            "lastError": self.last_error,
+            "startedAt": self.started_at,
+            "lastActivityAgeSec": round(now - self.last_activity, 2) if self.last_activity is not None else None,
+            # direct 管道下数据不经过 Python，无法统计
+            "bytesForwarded": self.bytes_forwarded if self.tapped else None,
+            "bytesPerSec": round(self.bytes_per_sec, 1) if self.tapped else None,
+            "nextRetryInSec": round(max(0.0, self.next_retry_at - now), 2) if self.next_retry_at else None,
+            "pids": [proc.pid for proc in self.processes if proc.returncode is None],
+            "ffmpeg": self.progress.snapshot(),
+            "resources": {
+                **self.resources.snapshot(),
+                "actions": self.resource_actions,
+                "restarts": self.resource_restarts,
+            },
+        }
+
+    async def sample_resources(self) -> None:
+        roles = ("idb", "ffmpeg") if self.mode == "idb" else ("ffmpeg",)
+        await self.resources.sample(
+            (proc.pid, role) for proc, role in zip(self.processes, roles) if proc.returncode is None
+        )
+        self._resource_sampled = time.monotonic()
 
 
 def _build_ffmpeg_log_flags() -> list[str]:
@@ -45,17 +291,263 @@ def _build_ffmpeg_log_flags() -> list[str]:
 
     if _FFMPEG_LOG_LEVEL in {"trace", "verbose"}:
         log_flags.extend(["-report", "-stats", "-benchmark"])
+    else:
+        # 进度改由 -progress 通道输出，stderr 不再打印 frame= 状态行
+        log_flags.append("-nostats")
+
+    # 机器可读的进度（key=value 块）写到 stdout，由 _pump_logs 解析
+    log_flags.extend(["-progress", "pipe:1"])
 
     return log_flags
 
 
 _STREAMS: Dict[str, _StreamState] = {}
-_LOCK = asyncio.Lock()
+# 每台设备一把锁：某台设备停止较慢（_terminate_process 最长约 8 秒）时不阻塞其他设备的启停
+_LOCKS: Dict[str, "_DeviceLock"] = {}
+# stop_all 的整体期限（秒），超时后对剩余进程直接 SIGKILL
+_SHUTDOWN_DEADLINE = float(os.environ.get("STREAM_SHUTDOWN_DEADLINE", "10"))
+
 
+class _DeviceLock:
+    __slots__ = ("lock", "users")
+
+    def __init__(self) -> None:
+        self.lock = asyncio.Lock()
+        # 持有者 + 等待者；归零时从 _LOCKS 删除，字典不随推过流的 udid 无限增长
+        self.users = 0
+
+
+@contextlib.asynccontextmanager
+async def _lock_for(udid: str) -> AsyncIterator[None]:
+    entry = _LOCKS.get(udid)
+    if entry is None:
+        entry = _LOCKS[udid] = _DeviceLock()
+    entry.users += 1
+    try:
+        async with entry.lock:
+            yield
+    finally:
+        entry.users -= 1
+        if not entry.users and _LOCKS.get(udid) is entry:
+            del _LOCKS[udid]
+
+
+class VideoProfile:
+    """Encoder settings for one rtmpStreamVideoPreset."""
+
+    __slots__ = ("name", "width", "fps", "crf", "maxrate_kbps")
+
+    def __init__(self, name: str, width: int, fps: int, crf: int, maxrate_kbps: int):
+        self.name = name
+        self.width = width
+        self.fps = fps
+        self.crf = crf
+        self.maxrate_kbps = maxrate_kbps
+
+    def filter_chain(self) -> str:
+        return (
+            f"fps={self.fps},scale={self.width}:-2:flags=lanczos+accurate_rnd+full_chroma_int,"
+            "scale=in_range=pc:out_range=tv,format=yuv420p"
+        )
 
-def _build_output_url(udid: str, session_id: str) -> tuple[str, str]:
-    """生成推流输出地址及脱敏版本"""
-    output_url = f"{RTMP_BASE}/iphone/{udid}"
+    def encoder_args(self) -> list[str]:
+        gop = str(self.fps * 2)  # keyframe every 2 seconds
+        return [
+            "-c:v",
+            "libx264",
+            "-preset",
+            "veryfast",
+            "-tune",
+            "zerolatency",
+            "-profile:v",
+            "high",
+            "-g",
+            gop,
+            "-x264-params",
+            f"bframes=0:keyint={gop}:min-keyint={gop}",
+            "-crf",
+            str(self.crf),
+            # CRF 受 VBV 上限约束，避免画面剧烈变化时码率冲垮 RTMP 链路
+            "-maxrate",
+            f"{self.maxrate_kbps}k",
+            "-bufsize",
+            f"{self.maxrate_kbps * 2}k",
+            "-color_range",
+            "tv",
+            "-color_primaries",
+            "bt709",
+            "-color_trc",
+            "bt709",
+            "-colorspace",
+            "bt709",
+        ]
+
+    @property
+    def cost(self) -> float:
+        """编码开销（槽位）：按像素数 × 帧率折算，720p@30fps 记为 1。"""
+        return round((self.width / 720) ** 2 * self.fps / 30, 3)
+
+    def describe(self) -> str:
+        return f"{self.name}({self.width}w/{self.fps}fps/CRF{self.crf}/≤{self.maxrate_kbps}k)"
+
+
+# 与 /api/appium/create 的 rtmpStreamVideoPreset 取值一致；宽度对应竖屏短边
+VIDEO_PRESETS: Dict[str, VideoProfile] = {
+    "1080p": VideoProfile("1080p", 1080, 30, 20, 8000),
+    "720p": VideoProfile("720p", 720, 30, 18, 5000),
+    "480p": VideoProfile("480p", 480, 30, 23, 1800),
+    "360p": VideoProfile("360p", 360, 24, 26, 900),
+}
+DEFAULT_PRESET = "720p"
+# 额外的低码率档位（逗号分隔，如 "360p"），与主档共用一次解码，经 split 滤镜分路推到 <udid>_<preset>
+_LADDER = os.environ.get("STREAM_PUSH_LADDER", "")
+
+
+# 编码准入：本机可同时承担的 libx264 编码槽位，默认按 CPU 核数的一半估算
+_ENCODE_BUDGET = float(os.environ.get("STREAM_ENCODE_BUDGET", str(max(1, (os.cpu_count() or 2) // 2))))
+# 超出预算时的处理：downgrade 去掉阶梯并逐级降档；idb 改走 idb 直通 copy；queue 排队等待槽位
+_ADMISSION_POLICY = os.environ.get("STREAM_ADMISSION_POLICY", "downgrade").strip().lower()
+if _ADMISSION_POLICY not in {"downgrade", "idb", "queue"}:
+    _ADMISSION_POLICY = "downgrade"
+
+
+class _EncodeBudget:
+    """Tracks encode slots per udid; queued requests are admitted FIFO as slots free up."""
+
+    def __init__(self, capacity: float):
+        self.capacity = capacity
+        self.allocations: Dict[str, float] = {}
+        self._waiters: Deque[Tuple[str, float, asyncio.Future]] = deque()
+
+    @property
+    def used(self) -> float:
+        return sum(self.allocations.values())
+
+    def fits(self, cost: float) -> bool:
+        # 单路开销超过总预算时，只要当前空闲也允许运行，避免永远排不上
+        used = self.used
+        return cost <= 0 or used + cost <= self.capacity + 1e-9 or used <= 0
+
+    def can_admit(self, cost: float) -> bool:
+        """Whether a new request would run now: it fits and nobody is queued ahead of it.
+
+        不占编码槽的（idb 直通）无需排队。
+        """
+        return cost <= 0 or (not self._waiters and self.fits(cost))
+
+    def allocate(self, udid: str, cost: float) -> None:
+        if cost > 0:
+            self.allocations[udid] = cost
+
+    async def acquire(self, udid: str, cost: float) -> None:
+        if self.can_admit(cost):
+            self.allocate(udid, cost)
+            return
+        future = asyncio.get_running_loop().create_future()
+        entry = (udid, cost, future)
+        self._waiters.append(entry)
+        try:
+            await future
+        except asyncio.CancelledError:
+            with contextlib.suppress(ValueError):
+                self._waiters.remove(entry)
+            if future.done() and not future.cancelled():
+                self.release(udid)
+            raise
+
+    def release(self, udid: str) -> None:
+        if self.allocations.pop(udid, None) is None:
+            return
+        self._drain()
+
+    def resize(self, udid: str, cost: float) -> None:
+        """Shrink a running stream's allocation in place and admit waiters that now fit."""
+        if udid not in self.allocations:
+            return
+        if cost > 0:
+            self.allocations[udid] = cost
+        else:
+            self.allocations.pop(udid)
+        self._drain()
+
+    def _drain(self) -> None:
+        while self._waiters and self.fits(self._waiters[0][1]):
+            waiter_udid, cost, future = self._waiters.popleft()
+            if future.done():
+                continue
+            self.allocate(waiter_udid, cost)
+            future.set_result(None)
+
+
+_BUDGET = _EncodeBudget(_ENCODE_BUDGET)
+
+
+def normalize_preset(raw: Any) -> str:
+    preset = str(raw or "").strip().lower()
+    return preset if preset in VIDEO_PRESETS else DEFAULT_PRESET
+
+
+def _normalize_ladder(primary: str, raw: Any) -> list[str]:
+    if raw is None:
+        raw = _LADDER
+    if isinstance(raw, str):
+        raw = raw.split(",")
+    ladder: list[str] = []
+    for item in raw or []:
+        name = str(item).strip().lower()
+        if name in VIDEO_PRESETS and name != primary and name not in ladder:
+            ladder.append(name)
+    return ladder
+
+
+def _encode_cost(mode: str, names: Sequence[str]) -> float:
+    # idb 模式主档为直通 copy，只有阶梯档位需要编码
+    encoded = names if mode == "mjpeg" else names[1:]
+    return round(sum(VIDEO_PRESETS[name].cost for name in encoded), 3)
+
+
+def _plan_admission(mode: str, names: list[str]) -> tuple[str, list[str], str]:
+    """Return (mode, renditions, admission) for a new stream under the current budget."""
+    if _BUDGET.can_admit(_encode_cost(mode, names)):
+        return mode, names, "admitted"
+    if _ADMISSION_POLICY == "idb":
+        return "idb", names[:1], "idb"
+    if _ADMISSION_POLICY == "downgrade":
+        order = list(VIDEO_PRESETS)
+        for name in order[order.index(names[0]):]:
+            if _BUDGET.can_admit(_encode_cost(mode, [name])):
+                return mode, [name], "downgraded"
+    return mode, names, "queued"
+
+
+def allocation() -> Dict[str, Any]:
+    """Current encode-slot allocation across devices."""
+    used = _BUDGET.used
+    return {
+        "budget": _BUDGET.capacity,
+        "used": round(used, 3),
+        "available": round(max(0.0, _BUDGET.capacity - used), 3),
+        "policy": _ADMISSION_POLICY,
+        "queued": [state.udid for state in _STREAMS.values() if state.state == STATE_QUEUED],
+        "streams": [
+            {
+                "udid": state.udid,
+                "mode": state.mode,
+                "renditions": state.renditions,
+                "requested": state.requested,
+                "admission": state.admission,
+                "cost": state.cost,
+                "allocated": _BUDGET.allocations.get(state.udid, 0.0),
+                "state": state.state,
+            }
+            for state in _STREAMS.values()
+        ],
+    }
+
+
+def _build_output_url(udid: str, session_id: str, suffix: str = "") -> tuple[str, str]:
+    """生成推流输出地址及脱敏版本；suffix 用于阶梯档位的独立推流路径"""
+    output_url = f"{RTMP_BASE}/iphone/{udid}{f'_{suffix}' if suffix else ''}"
     credentials = {"user": RTMP_USER, "pass": RTMP_PASS}
     if credentials["user"] or credentials["pass"]:
         query = urlencode(credentials)
@@ -67,6 +559,101 @@ def _build_output_url(udid: str, session_id: str) -> tuple[str, str]:
     return output_url, sanitized_output
 
 
+_FLV_OUTPUT_ARGS = [
+    "-rtmp_live",
+    "live",
+    "-rtmp_buffer",
+    "100",
+    "-flvflags",
+    "no_duration_filesize",
+    "-f",
+    "flv",
+]
+
+
+def _hls_options(hls_dir: str, generation: str) -> list[tuple[str, str]]:
+    # 分片在关键帧处切分，实际时长取 hls_time 与 GOP（2 秒）中较大者。
+    # 文件名带每次启动的代号：重启/降档后序号从 0 重新开始，旧名字不会被复用，分片才能长期缓存
+    return [
+        ("hls_time", f"{_HLS_SEGMENT_SECONDS:g}"),
+        ("hls_list_size", str(_HLS_LIST_SIZE)),
+        ("hls_flags", "delete_segments+independent_segments+omit_endlist+program_date_time"),
+        ("hls_segment_type", "fmp4"),
+        ("hls_fmp4_init_filename", f"{generation}_init.mp4"),
+        ("hls_segment_filename", os.path.join(hls_dir, f"{generation}_seg_%05d.m4s")),
+    ]
+
+
+def _prepare_hls_dir(hls_dir: str) -> None:
+    # 每次（重新）启动清空旧分片，避免播放器拿到上一轮的序号
+    shutil.rmtree(hls_dir, ignore_errors=True)
+    os.makedirs(hls_dir, exist_ok=True)
+
+
+class _Output:
+    """One output: encoder profile, RTMP URLs and, for the primary, an optional HLS directory."""
+
+    __slots__ = ("profile", "url", "sanitized", "hls_dir", "rtmp")
+
+    def __init__(
+        self,
+        profile: VideoProfile,
+        url: str,
+        sanitized: str,
+        hls_dir: Optional[str] = None,
+        rtmp: bool = True,
+    ):
+        self.profile = profile
+        self.url = url
+        self.sanitized = sanitized
+        self.hls_dir = hls_dir
+        self.rtmp = rtmp
+
+    def sink_args(self, flv_args: Sequence[str] = _FLV_OUTPUT_ARGS) -> list[str]:
+        """Muxer arguments and target; RTMP + HLS share one encode through the tee muxer."""
+        if self.hls_dir is None:
+            return [*flv_args, self.url]
+        options = _hls_options(self.hls_dir, f"g{time.time_ns() // 1_000_000}")
+        playlist = os.path.join(self.hls_dir, HLS_PLAYLIST)
+        if not self.rtmp:
+            hls_args: list[str] = []
+            for key, value in options:
+                hls_args.extend([f"-{key}", value])
+            return [*hls_args, "-f", "hls", playlist]
+        hls_opts = ":".join(f"{key}={value}" for key, value in options)
+        spec = (
+            f"[f=flv:flvflags=no_duration_filesize:onfail=ignore]{self.url}"
+            f"|[f=hls:onfail=ignore:{hls_opts}]{playlist}"
+        )
+        # tee 的从属 flv/fmp4 需要全局头（SPS/PPS 放在 extradata 中）
+        return ["-flags", "+global_header", "-f", "tee", spec]
+
+    def args(self) -> list[str]:
+        return [*self.profile.encoder_args(), *self.sink_args()]
+
+
+def _split_graph(source: str, outputs: list[_Output], start: int = 0) -> str:
+    """[source] → split → 每档各自缩放，输出标签依次为 [v<start>]、[v<start+1>]…"""
+    if len(outputs) == 1:
+        return f"[{source}]{outputs[0].profile.filter_chain()}[v{start}]"
+    pads = "".join(f"[s{i}]" for i in range(len(outputs)))
+    branches = ";".join(
+        f"[s{i}]{output.profile.filter_chain()}[v{start + i}]" for i, output in enumerate(outputs)
+    )
+    return f"[{source}]split={len(outputs)}{pads};{branches}"
+
+
+def _sanitize_cmd(cmd: list[str], outputs: list[_Output]) -> list[str]:
+    # tee 规格中 URL 只是参数的一部分，按子串替换
+    sanitized = []
+    for arg in cmd:
+        for output in outputs:
+            if output.url in arg:
+                arg = arg.replace(output.url, output.sanitized)
+        sanitized.append(arg)
+    return sanitized
+
+
 def current_mode() -> str:
     return _STREAM_MODE
 
@@ -82,7 +669,16 @@ async def start_stream(
     mjpeg_port: int,
     *,
     mode: Optional[str] = None,
+    pipe: Optional[str] = None,
+    preset: Optional[str] = None,
+    ladder: Optional[Sequence[str]] = None,
+    output: Optional[str] = None,
 ) -> Optional[str]:
+    """Start (or replace) the push pipeline for ``udid``.
+
+    preset 选择主档编码参数（idb 模式主档为直通 copy，不受影响）；ladder 为额外档位，
+    省略时取 STREAM_PUSH_LADDER。output 为 rtmp / hls / both，省略时取 STREAM_PUSH_OUTPUT。
+    """
     if not ENABLE_PUSH:
         core.logger.info("Stream push disabled; skip launch")
         return None
@@ -91,39 +687,137 @@ async def start_stream(
     if selected_mode not in {"idb", "mjpeg"}:
         selected_mode = "idb"
 
-    output_url, sanitized_output_url = _build_output_url(udid, session_id)
+    selected_output = (output or _PUSH_OUTPUT).strip().lower()
+    if selected_output not in {"rtmp", "hls", "both"}:
+        selected_output = "rtmp"
+    primary = normalize_preset(preset)
+    # 仅本地 HLS 时阶梯档位无处可推，忽略
+    requested_names = [primary] if selected_output == "hls" else [primary, *_normalize_ladder(primary, ladder)]
+    hls_dir = os.path.join(HLS_ROOT, re.sub(r"[^\w.-]", "_", udid)) if selected_output != "rtmp" else None
 
-    if selected_mode == "idb":
-        return await _start_stream_with_idb(
-            udid=udid,
-            session_id=session_id,
-            output_url=output_url,
-            sanitized_output=sanitized_output_url,
-        )
+    async with _lock_for(udid):
+        # 先停旧流释放其槽位，再按当前预算决定档位
+        await _stop_stream_unlocked(udid)
+        admitted_mode, names, admission = _plan_admission(selected_mode, requested_names)
+        if admission != "admitted":
+            core.logger.warning(
+                "\033[1;33m⚖️  编码预算不足\033[0m | 设备: %s | 请求: %s %s | 处理: %s → %s %s | 已用/预算: %.2f/%.2f",
+                udid,
+                selected_mode,
+                ",".join(requested_names),
+                admission,
+                admitted_mode,
+                ",".join(names),
+                _BUDGET.used,
+                _BUDGET.capacity,
+            )
+
+        outputs = [
+            _Output(
+                VIDEO_PRESETS[names[0]],
+                *_build_output_url(udid, session_id),
+                hls_dir=hls_dir,
+                rtmp=selected_output != "hls",
+            )
+        ]
+        for name in names[1:]:
+            outputs.append(_Output(VIDEO_PRESETS[name], *_build_output_url(udid, session_id, suffix=name)))
+
+        selected_pipe = None
+        if admitted_mode == "idb":
+            spawn = functools.partial(_spawn_idb, outputs=outputs)
+            selected_pipe = (pipe or _IDB_PIPE_MODE).strip().lower()
+            if selected_pipe not in {"tap", "direct"}:
+                selected_pipe = "tap"
+        else:
+            spawn = functools.partial(
+                _spawn_mjpeg,
+                base_url=base_url,
+                mjpeg_port=mjpeg_port,
+                outputs=outputs,
+            )
+
+        state = _StreamState(udid, session_id, admitted_mode, spawn, pipe=selected_pipe)
+        state.renditions = names
+        state.requested = {"mode": selected_mode, "renditions": requested_names}
+        state.admission = admission
+        state.cost = _encode_cost(admitted_mode, names)
+        state.output = selected_output
+        state.hls_dir = hls_dir
+        state.outputs = outputs
+
+        if admission == "queued":
+            state.set_state(STATE_QUEUED)
+            _STREAMS[udid] = state
+            _start_supervisor(state, _admit_and_supervise(state))
+            return None
+
+        _BUDGET.allocate(udid, state.cost)
+        # 首次启动失败（如可执行文件不存在）直接返回错误，不进入守护重试
+        error = await spawn(state)
+        if error:
+            await _teardown(state)
+            _BUDGET.release(udid)
+            return error
+        _STREAMS[udid] = state
+        _start_supervisor(state, _supervise(state))
+    return None
+
+
+def _start_supervisor(state: _StreamState, coro: Awaitable[None]) -> None:
+    state.supervisor = asyncio.create_task(coro, name=f"stream-supervisor-{state.udid}")
+    state.supervisor.add_done_callback(functools.partial(_supervisor_done, state))
 
-    return await _start_stream_with_mjpeg(
-        udid=udid,
-        session_id=session_id,
-        base_url=base_url,
-        mjpeg_port=mjpeg_port,
-        output_url=output_url,
-        sanitized_output=sanitized_output_url,
+
+def _supervisor_done(state: _StreamState, task: asyncio.Task) -> None:
+    # 兜底：守护任务意外退出后没人再重启或检测卡顿，标记为 failed 并结束残留进程
+    if task.cancelled() or task.exception() is None:
+        return
+    exc = task.exception()
+    core.logger.error(
+        "\033[1;31m💥 推流守护异常退出\033[0m | 设备: %s | %r", state.udid, exc, exc_info=exc
     )
+    state.last_error = f"supervisor: {exc!r}"
+    state.next_retry_at = None
+    state.set_state(STATE_FAILED)
+    for proc in state.processes:
+        if proc.returncode is None:
+            with contextlib.suppress(ProcessLookupError):
+                proc.kill()
+    _BUDGET.release(state.udid)
+
+
+async def _admit_and_supervise(state: _StreamState) -> None:
+    """Wait for encode slots, then launch and supervise like a directly admitted stream."""
+    await _BUDGET.acquire(state.udid, state.cost)
+    core.logger.info("\033[1;36m⚖️  编码槽位就绪\033[0m | 设备: %s | 开销: %.2f", state.udid, state.cost)
+    state.set_state(STATE_STARTING)
+    state.spawned_at = time.monotonic()
+    error = await state.spawn(state)
+    if error:
+        await _teardown(state)
+        _BUDGET.release(state.udid)
+        state.last_error = error
+        state.set_state(STATE_FAILED)
+        return
+    await _supervise(state)
 
 
-async def _start_stream_with_mjpeg(
+async def _spawn_mjpeg(
+    state: _StreamState,
     *,
-    udid: str,
-    session_id: str,
     base_url: str,
     mjpeg_port: int,
-    output_url: str,
-    sanitized_output: str,
+    outputs: list["_Output"],
 ) -> Optional[str]:
-    input_url = _build_mjpeg_url(base_url, mjpeg_port)
+    udid = state.udid
+    session_id = state.session_id
+    input_url = core.build_mjpeg_url(base_url, mjpeg_port)
     log_flags = _build_ffmpeg_log_flags()
+    if outputs[0].hls_dir:
+        _prepare_hls_dir(outputs[0].hls_dir)
     cmd = [
-        FFMPEG_BIN,
+        core.FFMPEG_BIN,
         *log_flags,
         "-fflags",
         "nobuffer",
@@ -139,99 +833,70 @@ async def _start_stream_with_mjpeg(
         "mjpeg",
         "-i",
         input_url,
-        "-sws_flags",
-        "lanczos+accurate_rnd+full_chroma_int",
-        "-vf",
-        "fps=30,scale=720:-2,scale=in_range=pc:out_range=tv,format=yuv420p", # 720p, 30fps, yuv420p
-        "-c:v",
-        "libx264",
-        "-preset",
-        "veryfast",
-        "-tune",
-        "zerolatency",
-        "-profile:v",
-        "high",
-        "-g",
-        "60", # keyframe every 2 seconds at 30fps
-        "-x264-params",
-        "bframes=0:keyint=50:min-keyint=50",
-        "-crf",
-        "18",
-        "-color_range",
-        "tv",
-        "-color_primaries",
-        "bt709",
-        "-color_trc",
-        "bt709",
-        "-colorspace",
-        "bt709",
-        "-rtmp_live",
-        "live",
-        "-rtmp_buffer",
-        "100",
-        "-flvflags",
-        "no_duration_filesize",
-        "-f",
-        "flv",
-        output_url,
     ]
+    if len(outputs) == 1:
+        # tee 不会自动选流（推断不出编码器），必须显式 -map
+        cmd.extend(["-map", "0:v", "-vf", outputs[0].profile.filter_chain(), *outputs[0].args()])
+    else:
+        # 一次解码，split 成多路分别缩放编码，各自推到独立 RTMP 路径
+        cmd.extend(["-filter_complex", _split_graph("0:v", outputs)])
+        for index, output in enumerate(outputs):
+            cmd.extend(["-map", f"[v{index}]", *output.args()])
 
-    async with _LOCK:
-        await _stop_stream_unlocked(udid)
-        try:
-            proc = await asyncio.create_subprocess_exec(
-                *cmd,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE,
-                limit=_STREAM_READER_LIMIT,
-            )
-        except FileNotFoundError:
-            core.logger.error("\033[1;31m💥 FFMPEG 可执行文件未找到\033[0m | 路径: %s", FFMPEG_BIN)
-            return "ffmpeg not found"
-        except Exception as exc:  # noqa: BLE001
-            core.logger.exception("\033[1;31m💥 FFMPEG 启动失败\033[0m | 设备: %s | 错误: %s", udid, str(exc))
-            return str(exc)
-
-        ffmpeg_task = asyncio.create_task(
-            _pump_logs(udid, proc),
-            name=f"ffmpeg-log-{udid}",
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            limit=_STREAM_READER_LIMIT,
         )
-        _STREAMS[udid] = _StreamState([proc], [ffmpeg_task])
+    except FileNotFoundError:
+        core.logger.error("\033[1;31m💥 FFMPEG 可执行文件未找到\033[0m | 路径: %s", core.FFMPEG_BIN)
+        return "ffmpeg not found"
+    except Exception as exc:  # noqa: BLE001
+        core.logger.exception("\033[1;31m💥 FFMPEG 启动失败\033[0m | 设备: %s | 错误: %s", udid, str(exc))
+        return str(exc)
+    state.processes.append(proc)
+
+    ffmpeg_task = asyncio.create_task(
+        _pump_logs(udid, proc, state),
+        name=f"ffmpeg-log-{udid}",
+    )
+    state.tasks.append(ffmpeg_task)
 
-        core.logger.info(
-            "\033[1;36m🚀 FFMPEG 推流启动\033[0m | 设备: %s | 会话: %s | 输入: %s | 输出: %s | PID: %s",
-            udid,
-            session_id,
-            input_url,
-            output_url,
-            proc.pid,
-        )
+    core.logger.info(
+        "\033[1;36m🚀 FFMPEG 推流启动\033[0m | 设备: %s | 会话: %s | 输入: %s | 输出: %s | PID: %s",
+        udid,
+        session_id,
+        input_url,
+        ", ".join(output.sanitized for output in outputs),
+        proc.pid,
+    )
+
+    core.logger.info(
+        "\033[1;36m📊 FFMPEG 推流参数\033[0m | 档位: %s | 编码器: libx264 | 硬件加速: 关闭 | 调试级别: %s",
+        ", ".join(output.profile.describe() for output in outputs),
+        _FFMPEG_LOG_LEVEL.upper(),
+    )
 
+    if _FFMPEG_LOG_LEVEL in {"debug", "trace", "verbose"}:
         core.logger.info(
-            "\033[1;36m📊 FFMPEG 推流参数\033[0m | 输出: 720p | 帧率: 30 | 编码器: libx264 | 码控: CRF18 | 硬件加速: 关闭 | 调试级别: %s",
+            "\033[1;33m🔍 FFMPEG 调试模式已启用\033[0m | 日志级别: %s | 将显示详细的编码和硬件加速信息",
             _FFMPEG_LOG_LEVEL.upper(),
         )
 
-        if _FFMPEG_LOG_LEVEL in {"debug", "trace", "verbose"}:
-            core.logger.info(
-                "\033[1;33m🔍 FFMPEG 调试模式已启用\033[0m | 日志级别: %s | 将显示详细的编码和硬件加速信息",
-                _FFMPEG_LOG_LEVEL.upper(),
-            )
-
-        sanitized_cmd = cmd.copy()
-        sanitized_cmd[-1] = sanitized_output
-        core.logger.info("\033[1;36m🔧 FFMPEG 完整命令\033[0m | %s", " ".join(sanitized_cmd))
+    core.logger.info("\033[1;36m🔧 FFMPEG 完整命令\033[0m | %s", " ".join(_sanitize_cmd(cmd, outputs)))
 
     return None
 
 
-async def _start_stream_with_idb(
+async def _spawn_idb(
+    state: _StreamState,
     *,
-    udid: str,
-    session_id: str,
-    output_url: str,
-    sanitized_output: str,
+    outputs: list[_Output],
 ) -> Optional[str]:
+    udid = state.udid
+    session_id = state.session_id
     log_flags = _build_ffmpeg_log_flags()
     idb_cmd = [
         IDB_BIN,
@@ -247,7 +912,7 @@ async def _start_stream_with_idb(
     ]
 
     ffmpeg_cmd = [
-        FFMPEG_BIN,
+        core.FFMPEG_BIN,
         *log_flags,
         "-hide_banner",
         "-re",
@@ -259,27 +924,40 @@ async def _start_stream_with_idb(
         "h264",
         "-i",
         "pipe:0",
+    ]
+    # 主档直通 copy；阶梯档位解码一次后经 split 分路重新编码
+    extras = outputs[1:]
+    if extras:
+        ffmpeg_cmd.extend(["-filter_complex", _split_graph("0:v", extras, start=1)])
+    # 显式映射主档：有 filter_complex 时不会自动选流，tee 输出也从不自动选流
+    ffmpeg_cmd.extend([
+        "-map",
+        "0:v",
         "-c:v",
         "copy",
         "-bsf:v",
         "dump_extra",
         "-an",
-        "-flvflags",
-        "no_duration_filesize",
         "-flush_packets",
         "1",
-        "-f",
-        "flv",
-        output_url,
-    ]
-
-    async with _LOCK:
-        await _stop_stream_unlocked(udid)
-
+        *outputs[0].sink_args(["-flvflags", "no_duration_filesize", "-f", "flv"]),
+    ])
+    if outputs[0].hls_dir:
+        _prepare_hls_dir(outputs[0].hls_dir)
+    for index, output in enumerate(extras, start=1):
+        ffmpeg_cmd.extend(["-map", f"[v{index}]", "-an", *output.args()])
+
+    # direct：idb 的 stdout 直接接到 ffmpeg 的 stdin；父进程在两者启动后关闭自己持有的两端，
+    # 这样任一端退出时另一端能收到 EOF / SIGPIPE
+    read_fd: Optional[int] = None
+    write_fd: Optional[int] = None
+    if not state.tapped:
+        read_fd, write_fd = os.pipe()
+    try:
         try:
             idb_proc = await asyncio.create_subprocess_exec(
                 *idb_cmd,
-                stdout=asyncio.subprocess.PIPE,
+                stdout=write_fd if write_fd is not None else asyncio.subprocess.PIPE,
                 stderr=asyncio.subprocess.PIPE,
                 limit=_STREAM_READER_LIMIT,
             )
@@ -289,60 +967,62 @@ async def _start_stream_with_idb(
         except Exception as exc:  # noqa: BLE001
             core.logger.exception("\033[1;31m💥 IDB 视频流启动失败\033[0m | 设备: %s | 错误: %s", udid, str(exc))
             return str(exc)
+        state.processes.append(idb_proc)
 
         try:
             ffmpeg_proc = await asyncio.create_subprocess_exec(
                 *ffmpeg_cmd,
-                stdin=asyncio.subprocess.PIPE,
+                stdin=read_fd if read_fd is not None else asyncio.subprocess.PIPE,
                 stdout=asyncio.subprocess.PIPE,
                 stderr=asyncio.subprocess.PIPE,
                 limit=_STREAM_READER_LIMIT,
             )
         except FileNotFoundError:
-            await _terminate_process(idb_proc)
-            core.logger.error("\033[1;31m💥 FFMPEG 可执行文件未找到\033[0m | 路径: %s", FFMPEG_BIN)
+            core.logger.error("\033[1;31m💥 FFMPEG 可执行文件未找到\033[0m | 路径: %s", core.FFMPEG_BIN)
             return "ffmpeg not found"
         except Exception as exc:  # noqa: BLE001
-            await _terminate_process(idb_proc)
             core.logger.exception("\033[1;31m💥 FFMPEG 启动失败\033[0m | 设备: %s | 错误: %s", udid, str(exc))
             return str(exc)
+        state.processes.append(ffmpeg_proc)
+    finally:
+        for fd in (read_fd, write_fd):
+            if fd is not None:
+                os.close(fd)
 
-        pipe_task = asyncio.create_task(
-            _pipe_stream(udid, idb_proc.stdout, ffmpeg_proc.stdin),
+    if state.tapped:
+        state.tasks.append(asyncio.create_task(
+            _pipe_stream(udid, idb_proc.stdout, ffmpeg_proc.stdin, state),
             name=f"idb-forward-{udid}",
-        )
-        idb_log_task = asyncio.create_task(
-            _pump_idb_logs(udid, idb_proc),
-            name=f"idb-log-{udid}",
-        )
-        ffmpeg_log_task = asyncio.create_task(
-            _pump_logs(udid, ffmpeg_proc),
-            name=f"ffmpeg-log-{udid}",
-        )
+        ))
+    idb_log_task = asyncio.create_task(
+        _pump_idb_logs(udid, idb_proc),
+        name=f"idb-log-{udid}",
+    )
+    ffmpeg_log_task = asyncio.create_task(
+        _pump_logs(udid, ffmpeg_proc, state),
+        name=f"ffmpeg-log-{udid}",
+    )
 
-        _STREAMS[udid] = _StreamState(
-            [idb_proc, ffmpeg_proc],
-            [pipe_task, idb_log_task, ffmpeg_log_task],
-        )
+    state.tasks.extend([idb_log_task, ffmpeg_log_task])
 
-        core.logger.info(
-            "\033[1;36m🚀 IDB 推流启动\033[0m | 设备: %s | 会话: %s | 输出: %s | IDB PID: %s | FFMPEG PID: %s",
-            udid,
-            session_id,
-            output_url,
-            idb_proc.pid,
-            ffmpeg_proc.pid,
-        )
+    core.logger.info(
+        "\033[1;36m🚀 IDB 推流启动\033[0m | 设备: %s | 会话: %s | 输出: %s | IDB PID: %s | FFMPEG PID: %s",
+        udid,
+        session_id,
+        ", ".join(output.sanitized for output in outputs),
+        idb_proc.pid,
+        ffmpeg_proc.pid,
+    )
 
-        core.logger.info(
-            "\033[1;36m📊 IDB 推流参数\033[0m | 帧率: 30 | 编码器: copy | 调试级别: %s",
-            _FFMPEG_LOG_LEVEL.upper(),
-        )
+    core.logger.info(
+        "\033[1;36m📊 IDB 推流参数\033[0m | 帧率: 30 | 编码器: copy | 阶梯: %s | 管道: %s | 调试级别: %s",
+        ", ".join(output.profile.describe() for output in extras) or "-",
+        state.pipe,
+        _FFMPEG_LOG_LEVEL.upper(),
+    )
 
-        sanitized_ffmpeg_cmd = ffmpeg_cmd.copy()
-        sanitized_ffmpeg_cmd[-1] = sanitized_output
-        core.logger.info("\033[1;36m🔧 IDB 命令\033[0m | %s", " ".join(idb_cmd))
-        core.logger.info("\033[1;36m🔧 FFMPEG 完整命令\033[0m | %s", " ".join(sanitized_ffmpeg_cmd))
+    core.logger.info("\033[1;36m🔧 IDB 命令\033[0m | %s", " ".join(idb_cmd))
+    core.logger.info("\033[1;36m🔧 FFMPEG 完整命令\033[0m | %s", " ".join(_sanitize_cmd(ffmpeg_cmd, outputs)))
 
     return None
 
@@ -380,6 +1060,7 @@ async def _pipe_stream(
     udid: str,
     source: Optional[asyncio.StreamReader],
     target: Optional[asyncio.StreamWriter],
+    state: Optional[_StreamState] = None,
 ) -> None:
     if source is None or target is None:
         return
@@ -389,6 +1070,8 @@ async def _pipe_stream(
             chunk = await source.read(_STREAM_READ_CHUNK)
             if not chunk:
                 break
+            if state is not None:
+                state.mark_activity(len(chunk))
             try:
                 target.write(chunk)
                 await target.drain()
@@ -448,111 +1131,345 @@ async def _pump_idb_logs(udid: str, proc: asyncio.subprocess.Process) -> None:
         core.logger.exception("\033[1;31m💥 IDB 日志泵异常\033[0m | 设备: %s", udid)
 
 
+async def _watch(state: _StreamState) -> str:
+    """Poll the pipeline until a process exits or output stalls; return the reason.
+
+    存活信号：tap 管道的转发字节，以及 ffmpeg -progress 中递增的帧计数。
+    """
+    while True:
+        await asyncio.sleep(_HEALTH_INTERVAL)
+        for proc in state.processes:
+            if proc.returncode is not None:
+                return f"pid {proc.pid} exited with code {proc.returncode}"
+        now = time.monotonic()
+        last = state.last_activity if state.last_activity is not None else state.spawned_at
+        idle = now - last
+        if idle > _STALL_SECONDS:
+            return f"no output for {idle:.0f}s"
+        if _RESOURCE_INTERVAL > 0 and now - state._resource_sampled >= _RESOURCE_INTERVAL:
+            try:
+                await state.sample_resources()
+                breach = _check_resources(state)
+                state._resource_error = None
+                if breach is None and state.resources.samples >= _RESOURCE_MIN_SAMPLES:
+                    state.resource_restarts = 0
+            except Exception as exc:
+                # 采样失败（如 ps 无法启动）只跳过本轮，不能让守护任务退出；同一错误只告警一次
+                state._resource_sampled = now
+                breach = None
+                if state._resource_error != repr(exc):
+                    state._resource_error = repr(exc)
+                    core.logger.warning(
+                        "\033[1;33m⚠️ 推流资源采样失败\033[0m | 设备: %s | %r", state.udid, exc
+                    )
+            if breach:
+                state.resource_breach = breach
+                return breach
+        if state.last_activity is None:
+            continue
+        state.set_state(STATE_DEGRADED if idle > _DEGRADED_SECONDS else STATE_LIVE)
+
+
+def _check_resources(state: _StreamState) -> Optional[str]:
+    """Return a breach description when rolling averages exceed the limits; ``log`` only warns."""
+    monitor = state.resources
+    if monitor.samples < _RESOURCE_MIN_SAMPLES:
+        return None
+    breach = None
+    if _CPU_LIMIT > 0 and monitor.cpu_avg > _CPU_LIMIT:
+        breach = f"cpu {monitor.cpu_avg:.0f}% > {_CPU_LIMIT:.0f}%"
+    elif _RSS_LIMIT_MB > 0 and monitor.rss_avg > _RSS_LIMIT_MB * 1024 * 1024:
+        breach = f"rss {monitor.rss_avg / 1048576:.0f}MB > {_RSS_LIMIT_MB:.0f}MB"
+    if breach is None:
+        return None
+    if _RESOURCE_ACTION == "log":
+        core.logger.warning("\033[1;33m🔥 推流资源超限\033[0m | 设备: %s | %s", state.udid, breach)
+        # 清空窗口，下一轮重新积累后才再次告警
+        monitor.reset()
+        return None
+    return breach
+
+
+def _downgrade(state: _StreamState) -> bool:
+    """Drop ladder renditions, else step the encoded primary down one preset; False when already minimal."""
+    outputs = state.outputs
+    if len(outputs) > 1:
+        del outputs[1:]
+    elif state.mode == "mjpeg":
+        order = list(VIDEO_PRESETS)
+        index = order.index(outputs[0].profile.name)
+        if index + 1 >= len(order):
+            return False
+        outputs[0].profile = VIDEO_PRESETS[order[index + 1]]
+    else:
+        # idb 主档为直通 copy，没有可降的编码
+        return False
+    state.renditions = [output.profile.name for output in outputs]
+    state.cost = _encode_cost(state.mode, state.renditions)
+    _BUDGET.resize(state.udid, state.cost)
+    return True
+
+
+async def _respawn(state: _StreamState) -> Optional[str]:
+    state.restarts += 1
+    state.set_state(STATE_STARTING)
+    state.spawned_at = time.monotonic()
+    state.last_activity = None
+    state.progress = FfmpegProgress()
+    state.resources.reset()
+    reason = await state.spawn(state)
+    if reason:
+        await _teardown(state)
+    return reason
+
+
+async def _supervise(state: _StreamState) -> None:
+    """Keep one device's pipeline running: restart on exit/stall with exponential backoff."""
+    udid = state.udid
+    while True:
+        reason: Optional[str] = await _watch(state)
+        state.set_state(STATE_BACKOFF)
+        await _teardown(state)
+        breach, state.resource_breach = state.resource_breach, None
+        # 超限前的运行时长只说明负载持续了一个窗口，不代表管线已恢复稳定
+        if not breach and time.monotonic() - state.spawned_at >= _STABLE_SECONDS:
+            state.failures = 0
+        if breach:
+            state.resource_actions += 1
+            downgraded = _RESOURCE_ACTION == "downgrade" and _downgrade(state)
+            # 首次超限或确实降了档：立即重启，不退避；降无可降仍反复超限则按故障退避，受 STREAM_RESTART_LIMIT 约束
+            immediate = downgraded or not state.resource_restarts
+            core.logger.warning(
+                "\033[1;33m🔥 推流资源超限\033[0m | 设备: %s | %s | 处理: %s | 档位: %s",
+                udid,
+                breach,
+                "downgrade" if downgraded else "restart" if immediate else "backoff",
+                ",".join(state.renditions),
+            )
+            state.last_error = f"resource: {breach}"
+            if not downgraded:
+                state.resource_restarts += 1
+            reason = await _respawn(state) if immediate else state.last_error
+        # 重启本身失败（如设备断开导致 idb 起不来）同样计入连续失败并继续退避
+        while reason:
+            state.failures += 1
+            state.last_error = reason
+            if _RESTART_LIMIT and state.failures > _RESTART_LIMIT:
+                state.set_state(STATE_FAILED)
+                state.next_retry_at = None
+                _BUDGET.release(udid)
+                core.logger.error(
+                    "\033[1;31m💥 推流守护放弃重启\033[0m | 设备: %s | 连续失败: %d | 原因: %s",
+                    udid,
+                    _RESTART_LIMIT,
+                    reason,
+                )
+                return
+            delay = min(_RESTART_MAX, _RESTART_BASE * (2 ** (state.failures - 1)))
+            state.set_state(STATE_BACKOFF)
+            state.next_retry_at = time.monotonic() + delay
+            core.logger.warning(
+                "\033[1;33m🔁 推流管线中断\033[0m | 设备: %s | 原因: %s | %.1fs 后第 %d 次重启",
+                udid,
+                reason,
+                delay,
+                state.restarts + 1,
+            )
+            await asyncio.sleep(delay)
+            state.next_retry_at = None
+            reason = await _respawn(state)
+
+
+async def _teardown(state: _StreamState) -> None:
+    tasks = [task for task in state.tasks if task is not None]
+    state.tasks = []
+
+    for task in tasks:
+        task.cancel()
+
+    # 并发终止；全部结束后才清空列表，中途被取消时剩余进程仍留在 state 中，由下一次清理接手
+    processes = list(state.processes)
+    if processes:
+        await asyncio.gather(*(_terminate_process(proc) for proc in processes), return_exceptions=True)
+    state.processes = [proc for proc in state.processes if proc not in processes]
+
+    if tasks:
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def get_stream(udid: str) -> Optional[Dict[str, Any]]:
+    state = _STREAMS.get(udid)
+    return state.snapshot() if state is not None else None
+
+
+_HLS_FILE_RE = re.compile(r"^(?:index\.m3u8|g\d+_init\.mp4|g\d+_seg_\d+\.m4s)$")
+
+
+def hls_file(udid: str, name: str) -> Optional[str]:
+    """Path of a playlist/segment for a device pushing HLS, or None when unknown."""
+    state = _STREAMS.get(udid)
+    if state is None or not state.hls_dir or not _HLS_FILE_RE.match(name):
+        return None
+    path = os.path.join(state.hls_dir, name)
+    return path if os.path.isfile(path) else None
+
+
+def get_metrics(udid: str) -> Optional[Dict[str, Any]]:
+    """Latest ffmpeg progress for one device's push, or None when not pushing."""
+    state = _STREAMS.get(udid)
+    if state is None:
+        return None
+    return {"udid": udid, "state": state.state, "bytesPerSec": state.snapshot()["bytesPerSec"], **state.progress.snapshot()}
+
+
+def list_streams() -> List[Dict[str, Any]]:
+    return [state.snapshot() for state in _STREAMS.values()]
+
+
 async def stop_stream(udid: str) -> None:
-    async with _LOCK:
+    async with _lock_for(udid):
         await _stop_stream_unlocked(udid)
 
 
-async def stop_all() -> None:
-    async with _LOCK:
-        keys = list(_STREAMS.keys())
-    for udid in keys:
-        await stop_stream(udid)
+async def stop_all(deadline: Optional[float] = None) -> None:
+    """Stop every device concurrently; processes still alive at the deadline are killed."""
+    deadline = _SHUTDOWN_DEADLINE if deadline is None else deadline
+    states = list(_STREAMS.values())
+    if not states:
+        return
+    tasks = [asyncio.create_task(stop_stream(state.udid)) for state in states]
+    _, pending = await asyncio.wait(tasks, timeout=deadline)
+    if not pending:
+        return
+    killed = 0
+    for state in states:
+        for proc in state.processes:
+            if proc.returncode is None:
+                with contextlib.suppress(ProcessLookupError):
+                    proc.kill()
+                    killed += 1
+    for task in pending:
+        task.cancel()
+    await asyncio.gather(*pending, return_exceptions=True)
+    core.logger.warning(
+        "\033[1;33m⏱️  推流停止超时\033[0m | 期限: %.1fs | 未完成设备: %d | 强制结束进程: %d",
+        deadline,
+        len(pending),
+        killed,
+    )
 
 
 async def _stop_stream_unlocked(udid: str) -> None:
     state = _STREAMS.pop(udid, None)
     if not state:
         return
-    tasks = [task for task in state.tasks if task is not None]
-    processes = [proc for proc in state.processes if proc is not None]
+    supervisor = state.supervisor
+    if supervisor is not None:
+        supervisor.cancel()
+        with contextlib.suppress(asyncio.CancelledError, Exception):
+            await supervisor
 
-    for task in tasks:
-        task.cancel()
+    await _teardown(state)
+    _BUDGET.release(udid)
+    if state.hls_dir:
+        shutil.rmtree(state.hls_dir, ignore_errors=True)
 
-    for proc in processes:
-        await _terminate_process(proc)
+    core.logger.info("\033[1;33m⏹️  推流停止\033[0m | 设备: %s", udid)
 
-    if tasks:
-        await asyncio.gather(*tasks, return_exceptions=True)
 
-    core.logger.info("\033[1;33m⏹️  推流停止\033[0m | 设备: %s", udid)
+# FFmpeg 日志分级：单个预编译正则，按 error > warning > info 的优先级取第一个命中的分组
+_LOG_CLASSIFIER = re.compile(
+    rb"^(?=.*?(?P<error>error|failed|invalid|timeout|connection|not found|permission|cannot|unable|broken|corrupt))?"
+    rb"(?=.*?(?P<warning>warning|deprecated|unknown))?"
+    rb"(?=.*?(?P<info>Stream #|Input #|Output #|starting|stopped|initialized|Encoder:|decoder|Detected"
+    rb"|Successfully|Completed|Finished|Connected|Streaming|Recording|Using cpu capabilities"
+    rb"|libx264|h264_videotoolbox|hardware acceleration))?",
+    re.IGNORECASE | re.DOTALL,
+)
 
 
-async def _pump_logs(
-    udid: str,
-    proc: asyncio.subprocess.Process,
-) -> None:
+def _classify_log(line: bytes) -> int:
+    match = _LOG_CLASSIFIER.match(line)
+    if match.group("error"):
+        return 40
+    if match.group("warning"):
+        return 30
+    if match.group("info"):
+        return 20
+    return 10
 
-    # FFmpeg日志消息过滤模式
-    ERROR_PATTERNS = [
-        b"error", b"Error", b"ERROR",
-        b"failed", b"Failed", b"FAILED",
-        b"invalid", b"Invalid", b"INVALID",
-        b"timeout", b"Timeout", b"TIMEOUT",
-        b"connection", b"Connection", b"CONNECTION",
-        b"not found", b"Not found", b"NOT FOUND",
-        b"permission", b"Permission", b"PERMISSION",
-        b"cannot", b"Cannot", b"CANNOT",
-        b"unable", b"Unable", b"UNABLE",
-        b"broken", b"Broken", b"BROKEN",
-        b"corrupt", b"Corrupt", b"CORRUPT",
-    ]
 
-    WARNING_PATTERNS = [
-        b"warning", b"Warning", b"WARNING",
-        b"deprecated", b"Deprecated", b"DEPRECATED",
-        b"unknown", b"Unknown", b"UNKNOWN",
-    ]
+class _LogLimiter:
+    """Fixed-window line budget per stream; suppressed lines are counted and summarized."""
+
+    __slots__ = ("_window_start", "_lines", "suppressed")
+
+    def __init__(self) -> None:
+        self._window_start = time.monotonic()
+        self._lines = 0
+        self.suppressed = 0
+
+    def allow(self) -> bool:
+        now = time.monotonic()
+        if now - self._window_start >= _LOG_RATE_WINDOW:
+            self._window_start = now
+            self._lines = 0
+        if _LOG_RATE_LINES <= 0 or self._lines < _LOG_RATE_LINES:
+            self._lines += 1
+            return True
+        self.suppressed += 1
+        return False
+
+    def drain_suppressed(self) -> int:
+        count, self.suppressed = self.suppressed, 0
+        return count
 
-    INFO_PATTERNS = [
-        b"Stream #", b"frame=", b"fps=", b"q=", b"size=", b"time=", b"bitrate=",
-        b"starting", b"Starting", b"STARTING",
-        b"stopped", b"Stopped", b"STOPPED",
-        b"initialized", b"Initialized", b"INITIALIZED",
-        b"Encoder:", b"decoder", b"Detected",
-        b"Input #", b"Output #",
-        b"Successfully", b"Completed", b"Finished",
-        b"Connected", b"Streaming", b"Recording",
-        b"Using cpu capabilities", b"libx264", b"h264_videotoolbox",
-        b"Selected hardware acceleration", b"Hardware acceleration",
-    ]
 
-    def _should_log_as_error(line: bytes) -> bool:
-        return any(pattern in line for pattern in ERROR_PATTERNS)
+async def _pump_logs(
+    udid: str,
+    proc: asyncio.subprocess.Process,
+    state: Optional[_StreamState] = None,
+) -> None:
+    limiter = _LogLimiter()
+    progress = state.progress if state is not None else FfmpegProgress()
 
-    def _should_log_as_warning(line: bytes) -> bool:
-        return any(pattern in line for pattern in WARNING_PATTERNS)
+    def _emit(raw: bytes, *, truncated: bool = False) -> None:
+        level = _classify_log(raw)
+        # 其他日志只在调试模式下输出
+        if level == 10 and not core.logger.isEnabledFor(10):
+            return
+        if not limiter.allow():
+            return
+        suppressed = limiter.drain_suppressed()
+        text = raw.decode(errors="ignore").rstrip()
+        if truncated:
+            text = f"{text} [truncated]"
+        if suppressed:
+            text = f"{text} (前一窗口抑制 {suppressed} 行)"
+        if level == 40:
+            core.logger.error("\033[1;31mFFMPEG\033[0m [%s] %s", udid, text)
+        elif level == 30:
+            core.logger.warning("\033[1;33mFFMPEG\033[0m [%s] %s", udid, text)
+        elif level == 20:
+            core.logger.info("\033[1;36mFFMPEG\033[0m [%s] %s", udid, text)
+        else:
+            core.logger.debug("\033[1;90mFFMPEG\033[0m [%s] %s", udid, text)
 
-    def _should_log_as_info(line: bytes) -> bool:
-        return any(pattern in line for pattern in INFO_PATTERNS)
+    def _on_progress(raw: bytes, *, truncated: bool = False) -> None:
+        frame_before = progress.frame
+        if progress.feed(raw.decode(errors="ignore")) and state is not None and progress.frame > frame_before:
+            state.mark_activity()
 
-    async def _read(stream, prefix):
+    async def _read(stream, on_line):
         if stream is None:
             return
         buffer = bytearray()
 
-        def _emit(raw: bytes, *, truncated: bool = False) -> None:
-            text = raw.decode(errors="ignore").rstrip()
-            if truncated:
-                text = f"{text} [truncated]"
-
-            # 根据内容决定日志级别和格式
-            if _should_log_as_error(raw):
-                core.logger.error("\033[1;31mFFMPEG\033[0m [%s %s] %s", udid, prefix, text)
-            elif _should_log_as_warning(raw):
-                core.logger.warning("\033[1;33mFFMPEG\033[0m [%s %s] %s", udid, prefix, text)
-            elif _should_log_as_info(raw):
-                core.logger.info("\033[1;36mFFMPEG\033[0m [%s %s] %s", udid, prefix, text)
-            # 其他日志只在调试模式下输出
-            elif core.logger.isEnabledFor(10):  # DEBUG level
-                core.logger.debug("\033[1;90mFFMPEG\033[0m [%s %s] %s", udid, prefix, text)
-
         while True:
             chunk = await stream.read(_STREAM_READ_CHUNK)
             if not chunk:
                 if buffer:
-                    _emit(bytes(buffer))
+                    on_line(bytes(buffer))
                 break
             buffer.extend(chunk)
 
@@ -562,16 +1479,20 @@ async def _pump_logs(
                     if len(buffer) >= _STREAM_LOG_MAX_SEGMENT:
                         segment = bytes(buffer[:_STREAM_LOG_MAX_SEGMENT])
                         del buffer[:_STREAM_LOG_MAX_SEGMENT]
-                        _emit(segment, truncated=True)
+                        on_line(segment, truncated=True)
                     break
 
-                line = bytes(buffer[:newline_index])
+                line = bytes(buffer[:newline_index]).rstrip(b"\r")
                 del buffer[: newline_index + 1]
-                _emit(line)
+                if line:
+                    on_line(line)
 
     try:
-        await asyncio.gather(_read(proc.stdout, "stdout"), _read(proc.stderr, "stderr"))
+        await asyncio.gather(_read(proc.stdout, _on_progress), _read(proc.stderr, _emit))
         return_code = await proc.wait()
+        suppressed = limiter.drain_suppressed()
+        if suppressed:
+            core.logger.info("\033[1;90mFFMPEG\033[0m [%s] 日志限流共抑制 %d 行", udid, suppressed)
         if return_code != 0:
             core.logger.error("\033[1;31m💥 FFMPEG 进程异常退出\033[0m | 设备: %s | 退出码: %d", udid, return_code)
         else:
@@ -581,12 +1502,3 @@ async def _pump_logs(
         raise
     except Exception:
         core.logger.exception("\033[1;31m💥 FFMPEG 日志泵异常\033[0m | 设备: %s", udid)
-    finally:
-        pass
-
-
-def _build_mjpeg_url(base_url: str, port: int) -> str:
-    parsed = urlparse(base_url)
-    host = parsed.hostname or "127.0.0.1"
-    scheme = parsed.scheme or "http"
-    return f"{scheme}://{host}:{port}"
@@ -0,0 +1,75 @@
+import asyncio
+import os
+import sys
+from typing import Any, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import appium_driver as ad  # noqa: E402
+
+BASE = "http://appium.test"
+
+
+class _StubSession:
+    """Records commands in the order they reach the device."""
+
+    def __init__(self) -> None:
+        self.calls: List[Any] = []
+
+    async def execute_script(self, script: str, *args: Any) -> None:
+        self.calls.append(("exec", script))
+        await asyncio.sleep(0.01)
+
+    async def perform_actions(self, actions: Any, timeout: Any = None) -> None:
+        self.calls.append(("actions", [a["x"] for a in actions[0]["actions"] if a["type"] == "pointerMove"]))
+        await asyncio.sleep(0.01)
+
+
+def _chunk(x: int) -> List[Any]:
+    return [{
+        "type": "pointer",
+        "id": "finger1",
+        "parameters": {"pointerType": "touch"},
+        "actions": [{"type": "pointerMove", "duration": 0, "origin": "pointer", "x": x, "y": 0}],
+    }]
+
+
+def test_chunk_does_not_overtake_queued_exec() -> None:
+    async def scenario() -> List[Any]:
+        session = _StubSession()
+        ad._SESSIONS[ad._key(BASE, "s1")] = session
+        try:
+            await asyncio.gather(
+                ad.exec_mobile(BASE, "s1", "mobile: first", {}),
+                ad.submit_actions(BASE, "s1", _chunk(1)),
+                ad.exec_mobile(BASE, "s1", "mobile: tap", {}),
+                ad.submit_actions(BASE, "s1", _chunk(2)),
+            )
+        finally:
+            ad._SESSIONS.pop(ad._key(BASE, "s1"), None)
+        return session.calls
+
+    assert asyncio.run(scenario()) == [
+        ("exec", "mobile: first"),
+        ("actions", [1]),
+        ("exec", "mobile: tap"),
+        ("actions", [2]),
+    ]
+
+
+def test_adjacent_chunks_still_merge() -> None:
+    async def scenario() -> List[Any]:
+        session = _StubSession()
+        ad._SESSIONS[ad._key(BASE, "s2")] = session
+        try:
+            await asyncio.gather(
+                ad.exec_mobile(BASE, "s2", "mobile: first", {}),
+                ad.submit_actions(BASE, "s2", _chunk(1)),
+                ad.submit_actions(BASE, "s2", _chunk(2)),
+            )
+        finally:
+            ad._SESSIONS.pop(ad._key(BASE, "s2"), None)
+        return session.calls
+
+    # 两段共线的相对移动合并为一次调用并简化成一段
+    assert asyncio.run(scenario()) == [("exec", "mobile: first"), ("actions", [3])]
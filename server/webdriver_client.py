@@ -0,0 +1,137 @@
+import base64
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+import core
+
+
+# 创建会话会等待 WDA 构建/启动，远比普通命令慢
+_CREATE_TIMEOUT = float(os.environ.get("APPIUM_CREATE_TIMEOUT", "300"))
+
+
+class WebDriverError(Exception):
+    """W3C error response (or an unparseable reply) from Appium/WDA."""
+
+    def __init__(self, status: int, error: str, message: str) -> None:
+        super().__init__(f"{error}: {message}" if message else error)
+        self.status = status
+        self.error = error
+        self.message = message
+
+    @property
+    def invalid_session(self) -> bool:
+        text = f"{self.error} {self.message}".lower()
+        return (
+            "invalid session id" in text
+            or "invalidsessionid" in text
+            or "a session is either terminated or not started" in text
+        )
+
+
+def _unwrap(resp: httpx.Response) -> Any:
+    """Return the W3C ``value`` of a response, raising WebDriverError on errors."""
+    try:
+        body = resp.json()
+    except ValueError:
+        raise WebDriverError(resp.status_code, "unknown error", resp.text[:300].strip())
+    value = body.get("value") if isinstance(body, dict) else None
+    if isinstance(value, dict) and value.get("error"):
+        raise WebDriverError(resp.status_code, str(value["error"]), str(value.get("message") or ""))
+    if resp.status_code >= 400:
+        raise WebDriverError(resp.status_code, "unknown error", resp.text[:300].strip())
+    return value
+
+
+def _legacy_caps(capabilities: Dict[str, Any]) -> Dict[str, Any]:
+    # 去命名空间（如 appium:udid -> udid），供仍按 JSONWP desiredCapabilities 解析的旧服务端使用
+    return {
+        (key.split(":", 1)[1] if isinstance(key, str) and key.startswith("appium:") else key): value
+        for key, value in capabilities.items()
+    }
+
+
+class WebDriverSession:
+    """One Appium session driven over the shared pooled httpx client.
+
+    不持有连接或线程，创建成本只有一个对象；所有命令直接 await HTTP 请求。
+    """
+
+    __slots__ = ("base", "session_id", "capabilities")
+
+    def __init__(self, base: str, session_id: str, capabilities: Optional[Dict[str, Any]] = None) -> None:
+        self.base = base.rstrip("/")
+        self.session_id = session_id
+        self.capabilities = capabilities or {}
+
+    @property
+    def url(self) -> str:
+        return f"{self.base}/session/{self.session_id}"
+
+    async def command(
+        self,
+        method: str,
+        path: str = "",
+        payload: Optional[Dict[str, Any]] = None,
+        timeout: Optional[float] = None,
+    ) -> Any:
+        client = await core.get_http_client()
+        kwargs: Dict[str, Any] = {}
+        if payload is not None:
+            kwargs["json"] = payload
+        if timeout is not None:
+            kwargs["timeout"] = timeout
+        resp = await client.request(method, f"{self.url}{path}", **kwargs)
+        return _unwrap(resp)
+
+    async def execute_script(self, script: str, *args: Any) -> Any:
+        return await self.command("POST", "/execute/sync", {"script": script, "args": list(args)})
+
+    async def perform_actions(self, actions: List[Dict[str, Any]], timeout: Optional[float] = None) -> Any:
+        return await self.command("POST", "/actions", {"actions": actions}, timeout)
+
+    async def get_settings(self) -> Dict[str, Any]:
+        return await self.command("GET", "/appium/settings") or {}
+
+    async def update_settings(self, settings: Dict[str, Any]) -> None:
+        await self.command("POST", "/appium/settings", {"settings": settings})
+
+    async def get_window_rect(self) -> Dict[str, Any]:
+        return await self.command("GET", "/window/rect") or {}
+
+    async def get_window_size(self) -> Tuple[int, int]:
+        rect = await self.get_window_rect()
+        return int(rect.get("width", 0)), int(rect.get("height", 0))
+
+    async def get_screenshot_as_base64(self) -> str:
+        return await self.command("GET", "/screenshot") or ""
+
+    async def get_screenshot_as_png(self) -> bytes:
+        return base64.b64decode(await self.get_screenshot_as_base64())
+
+    async def quit(self) -> None:
+        await self.command("DELETE")
+
+
+async def create_session(base: str, capabilities: Dict[str, Any]) -> WebDriverSession:
+    """POST /session with W3C alwaysMatch caps (plus legacy desiredCapabilities)."""
+    b = base.rstrip("/")
+    client = await core.get_http_client()
+    payload = {
+        "capabilities": {"alwaysMatch": dict(capabilities), "firstMatch": [{}]},
+        "desiredCapabilities": _legacy_caps(capabilities),
+    }
+    resp = await client.post(f"{b}/session", json=payload, timeout=_CREATE_TIMEOUT)
+    value = _unwrap(resp)
+    body = resp.json()
+    # W3C: value={sessionId, capabilities}；JSONWP: 顶层 sessionId，value 为 capabilities
+    if isinstance(value, dict) and value.get("sessionId"):
+        sid = str(value["sessionId"])
+        caps = value.get("capabilities") or {}
+    else:
+        sid = str(body.get("sessionId") or "")
+        caps = value if isinstance(value, dict) else {}
+    if not sid:
+        raise WebDriverError(resp.status_code, "session not created", "no sessionId in response")
+    return WebDriverSession(b, sid, caps)
@@ -18,6 +18,7 @@ _DEFAULT_MESSAGE_ROUTES: Dict[str, Dict[str, str]] = {
     "discovery.devices.list": {"method": "GET", "path": "/api/discovery/devices"},
     "appium.exec.mobile": {"method": "POST", "path": "/api/appium/exec-mobile"},
     "appium.actions.execute": {"method": "POST", "path": "/api/appium/actions"},
+    "appium.batch.execute": {"method": "POST", "path": "/api/appium/batch"},
 }
 
 
@@ -0,0 +1,191 @@
+import { reactive } from 'vue';
+
+// 与后端 routes/stream.py 的 WS_FRAME_HEADER 保持一致：>BBIdHH（大端，共 18 字节）
+const HEADER_SIZE = 18;
+const FRAME_VERSION = 1;
+const RECONNECT_BASE = 1500;
+const RECONNECT_MAX = 15000;
+
+function toWsUrl(httpBase) {
+  const base = String(httpBase || '').replace(/\/+$/, '');
+  if (/^wss?:\/\//i.test(base)) return `${base}/ws/stream`;
+  if (/^https:\/\//i.test(base)) return `wss://${base.slice('https://'.length)}/ws/stream`;
+  if (/^http:\/\//i.test(base)) return `ws://${base.slice('http://'.length)}/ws/stream`;
+  const proto = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
+  return `${proto}//${base || window.location.host}/ws/stream`;
+}
+
+export function parseFrame(buffer) {
+  if (!(buffer instanceof ArrayBuffer) || buffer.byteLength < HEADER_SIZE) return null;
+  const view = new DataView(buffer);
+  const version = view.getUint8(0);
+  if (version !== FRAME_VERSION) return null;
+  const udidLen = view.getUint8(1);
+  const seq = view.getUint32(2);
+  const capturedAt = view.getFloat64(6);
+  const width = view.getUint16(14);
+  const height = view.getUint16(16);
+  const udid = new TextDecoder().decode(new Uint8Array(buffer, HEADER_SIZE, udidLen));
+  const jpeg = new Blob([new Uint8Array(buffer, HEADER_SIZE + udidLen)], { type: 'image/jpeg' });
+  return { udid, seq, capturedAt, width, height, jpeg };
+}
+
+/**
+ * 后端 /ws/stream 的多路复用客户端：一个连接订阅多台设备的画面。
+ * 每收到一帧先回调 onFrame，再发送 stream.ack 作为流控确认。
+ */
+export function createStreamSocket(httpBase) {
+  const state = reactive({
+    status: 'idle',
+    url: toWsUrl(httpBase),
+  });
+
+  // udid -> { options, onFrame }
+  const subscriptions = new Map();
+  let socket = null;
+  let counter = 0;
+  let reconnectDelay = RECONNECT_BASE;
+  let reconnectTimer = null;
+
+  function nextId() {
+    counter = (counter + 1) % 1_000_000_000;
+    return `stream-${Date.now()}-${counter}`;
+  }
+
+  function sendJson(message) {
+    if (!socket || socket.readyState !== WebSocket.OPEN) return false;
+    try {
+      socket.send(JSON.stringify(message));
+      return true;
+    } catch (err) {
+      console.warn('[stream-socket] send failed', err);
+      return false;
+    }
+  }
+
+  function sendSubscribe(udid, entry) {
+    sendJson({ id: nextId(), type: 'stream.subscribe', udid, ...entry.options });
+  }
+
+  function handleMessage(event) {
+    if (typeof event.data === 'string') {
+      let message;
+      try {
+        message = JSON.parse(event.data);
+      } catch (_err) {
+        return;
+      }
+      if (message && message.ok === false) {
+        console.warn('[stream-socket]', message.type, message.udid, message.error);
+      }
+      const entry = message && subscriptions.get(message.udid || '');
+      if (entry && typeof entry.onMessage === 'function') {
+        try { entry.onMessage(message); } catch (_err) {}
+      }
+      return;
+    }
+    const frame = parseFrame(event.data);
+    if (!frame) return;
+    const entry = subscriptions.get(frame.udid);
+    if (entry) {
+      try { entry.onFrame(frame); } catch (err) { console.warn('[stream-socket] onFrame failed', err); }
+    }
+    sendJson({ type: 'stream.ack', udid: frame.udid, seq: frame.seq });
+  }
+
+  function scheduleReconnect() {
+    if (reconnectTimer || subscriptions.size === 0) return;
+    state.status = 'reconnecting';
+    const delay = Math.min(reconnectDelay, RECONNECT_MAX);
+    reconnectDelay = Math.min(reconnectDelay * 1.5, RECONNECT_MAX);
+    reconnectTimer = window.setTimeout(() => {
+      reconnectTimer = null;
+      connect();
+    }, delay);
+  }
+
+  function connect() {
+    if (socket && (socket.readyState === WebSocket.OPEN || socket.readyState === WebSocket.CONNECTING)) {
+      return;
+    }
+    try {
+      socket = new WebSocket(state.url);
+    } catch (err) {
+      console.error('[stream-socket] failed to create WebSocket', err);
+      scheduleReconnect();
+      return;
+    }
+    socket.binaryType = 'arraybuffer';
+    state.status = 'connecting';
+    socket.onopen = () => {
+      reconnectDelay = RECONNECT_BASE;
+      state.status = 'open';
+      subscriptions.forEach((entry, udid) => sendSubscribe(udid, entry));
+    };
+    socket.onmessage = handleMessage;
+    socket.onclose = () => {
+      state.status = 'closed';
+      socket = null;
+      scheduleReconnect();
+    };
+  }
+
+  function subscribe(udid, onFrame, options = {}) {
+    const key = udid || '';
+    const entry = {
+      onFrame,
+      onMessage: options.onMessage,
+      options: {
+        fps: options.fps ?? 0,
+        window: options.window ?? 2,
+        rendition: options.rendition || 'full',
+      },
+    };
+    subscriptions.set(key, entry);
+    if (socket && socket.readyState === WebSocket.OPEN) {
+      sendSubscribe(key, entry);
+    } else {
+      connect();
+    }
+    return () => unsubscribe(key);
+  }
+
+  function configure(udid, { fps, window: win } = {}) {
+    const key = udid || '';
+    const entry = subscriptions.get(key);
+    if (!entry) return;
+    if (fps != null) entry.options.fps = fps;
+    if (win != null) entry.options.window = win;
+    sendJson({ id: nextId(), type: 'stream.config', udid: key, fps, window: win });
+  }
+
+  function unsubscribe(udid) {
+    const key = udid || '';
+    if (!subscriptions.delete(key)) return;
+    sendJson({ id: nextId(), type: 'stream.unsubscribe', udid: key });
+    if (subscriptions.size === 0) close();
+  }
+
+  function close() {
+    subscriptions.clear();
+    if (reconnectTimer) {
+      window.clearTimeout(reconnectTimer);
+      reconnectTimer = null;
+    }
+    try {
+      if (socket) socket.close();
+    } catch (_err) {
+      /* ignore */
+    }
+    socket = null;
+    state.status = 'idle';
+  }
+
+  return {
+    state,
+    subscribe,
+    configure,
+    unsubscribe,
+    close,
+  };
+}
@@ -5,6 +5,7 @@ const TYPE_TIMEOUTS = {
   'appium.session.create': 240000,
   'appium.exec.mobile': 120000,
   'appium.actions.execute': 120000,
+  'appium.batch.execute': 120000,
   'appium.settings.apply': 60000,
 };
 const RECONNECT_BASE = 1500;